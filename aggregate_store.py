@@ -0,0 +1,241 @@
+import csv
+import time
+import sqlite3
+from sqlite_store import WRITE_LOCK_TIMEOUT_MS, WRITE_LOCK_RETRY, is_locked
+
+AGGREGATE_DB_FILE = 'halo_player_aggregates.sqlite'
+# Matches kept per group for rolling "last N" stats
+ROLLING_WINDOW = 20
+# Columns summed per group; duration is summed in seconds
+SUM_COLUMNS = [
+    'kills', 'deaths', 'assists', 'score', 'personal_score', 'shots_fired', 'shots_hit',
+    'damage_dealt', 'damage_taken', 'headshot_kills', 'medal_count', 'duration'
+]
+GROUP_COLUMNS = ['player_xuid', 'playlist_id', 'map', 'game_type']
+OUTCOME_COLUMNS = {'Win': 'wins', 'Loss': 'losses', 'Tie': 'ties'}
+
+
+def number(value):
+    """Numeric value of a row field, which may have been read back from CSV as a string"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def duration_seconds(value):
+    # Durations are written as str(timedelta), e.g. '0:12:03.5' or '1 day, 0:01:00'
+    if hasattr(value, 'total_seconds'):
+        return value.total_seconds()
+    text = str(value or '')
+    days = 0
+    if 'day' in text:
+        day_text, text = text.split(',', 1)
+        days = number(day_text.split()[0])
+    seconds = 0
+    for part in text.strip().split(':'):
+        seconds = seconds * 60 + number(part)
+    return days * 24 * 60 * 60 + seconds
+
+
+def derived_stats(totals):
+    """Add K/D, win rate, accuracy and per-match averages to summed totals"""
+    matches = totals.get('matches') or 0
+    kills = totals.get('kills') or 0
+    deaths = totals.get('deaths') or 0
+    shots_fired = totals.get('shots_fired') or 0
+    totals['kd'] = round(kills / deaths, 2) if deaths > 0 else kills
+    totals['win_rate'] = round(100 * (totals.get('wins') or 0) / matches, 2) if matches else 0
+    totals['accuracy'] = round(100 * (totals.get('shots_hit') or 0) / shots_fired, 2) if shots_fired else 0
+    totals['average_score'] = round((totals.get('score') or 0) / matches, 2) if matches else 0
+    return totals
+
+
+class AggregateStore:
+    """Running per-player totals, grouped by player, playlist, map and game type.
+
+    Used as a writer alongside the CSV: each new (player, match) row is added to
+    its group's sums and outcome counts and to a rolling window of the group's
+    latest matches, so career, per-map and per-playlist stats and leaderboards
+    read a row per group instead of every match. A row that was already counted
+    is ignored, including when its values have changed since or another process
+    sharing the file counted it. Rows that meet a locked database stay pending
+    and are retried by the next write_rows or flush.
+    """
+
+    def __init__(self, path=AGGREGATE_DB_FILE, window=ROLLING_WINDOW):
+        self.path = path
+        self.window = window
+        self.rows_written = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        group_columns = ', '.join(f'{column} TEXT NOT NULL' for column in GROUP_COLUMNS)
+        sum_columns = ', '.join(f'{column} REAL NOT NULL DEFAULT 0' for column in SUM_COLUMNS)
+        outcome_columns = ', '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in OUTCOME_COLUMNS.values())
+        group_key = ', '.join(GROUP_COLUMNS)
+        self.conn.execute(
+            f'CREATE TABLE IF NOT EXISTS groups ({group_columns}, '
+            f'matches INTEGER NOT NULL DEFAULT 0, {outcome_columns}, {sum_columns}, '
+            f'first_date TEXT, last_date TEXT, PRIMARY KEY ({group_key}))'
+        )
+        self.conn.execute(
+            f'CREATE TABLE IF NOT EXISTS recent ({group_columns}, match_id TEXT NOT NULL, date TEXT, '
+            f'outcome TEXT, {sum_columns}, PRIMARY KEY (player_xuid, match_id))'
+        )
+        # Every counted (player, match), so a row is only ever added once
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS counted ('
+            'player_xuid TEXT NOT NULL, '
+            'match_id TEXT NOT NULL, '
+            'PRIMARY KEY (player_xuid, match_id))'
+        )
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS recent_group_date ON recent ({group_key}, date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS recent_player_date ON recent (player_xuid, date)')
+        self.conn.commit()
+        self.keys = set(self.conn.execute('SELECT player_xuid, match_id FROM counted'))
+        self.pending = []
+        self.lock_waits = 0
+        self.conn.execute(f'PRAGMA busy_timeout = {WRITE_LOCK_TIMEOUT_MS}')
+
+    def write_rows(self, rows, row_headers=()):
+        """Add rows that haven't been counted yet to their group's totals"""
+        self.pending.extend(rows)
+        return self._write_pending()
+
+    def _write_pending(self):
+        if not self.pending:
+            return 0
+        added_keys = []
+        try:
+            for row in self.pending:
+                key = (str(row.get('player_xuid')), str(row.get('match_id')))
+                if key not in self.keys and self._add_row(key, row):
+                    added_keys.append(key)
+            self.conn.commit()
+        except sqlite3.OperationalError as e:
+            if not is_locked(e):
+                raise
+            self.conn.rollback()
+            self.lock_waits += 1
+            return 0
+        self.pending = []
+        self.keys.update(added_keys)
+        self.rows_written += len(added_keys)
+        return len(added_keys)
+
+    def _add_row(self, key, row):
+        player_xuid, match_id = key
+        group = [player_xuid] + [str(row.get(column) or 'Unknown') for column in GROUP_COLUMNS[1:]]
+        date = str(row.get('date') or '')
+        outcome = str(row.get('outcome') or '')
+        values = [duration_seconds(row.get(column)) if column == 'duration' else number(row.get(column)) for column in SUM_COLUMNS]
+        outcomes = [int(outcome == name) for name in OUTCOME_COLUMNS]
+        # keys only covers this process, so a row another worker already counted is caught here
+        if self.conn.execute('INSERT OR IGNORE INTO counted (player_xuid, match_id) VALUES (?, ?)', key).rowcount != 1:
+            return False
+        columns = GROUP_COLUMNS + ['matches'] + list(OUTCOME_COLUMNS.values()) + SUM_COLUMNS + ['first_date', 'last_date']
+        placeholders = ', '.join('?' for _ in columns)
+        updates = ', '.join(
+            [f'{column} = {column} + excluded.{column}' for column in ['matches'] + list(OUTCOME_COLUMNS.values()) + SUM_COLUMNS]
+            + ['first_date = MIN(first_date, excluded.first_date)', 'last_date = MAX(last_date, excluded.last_date)']
+        )
+        self.conn.execute(
+            f'INSERT INTO groups ({", ".join(columns)}) VALUES ({placeholders}) '
+            f'ON CONFLICT ({", ".join(GROUP_COLUMNS)}) DO UPDATE SET {updates}',
+            group + [1] + outcomes + values + [date, date]
+        )
+        recent_columns = GROUP_COLUMNS + ['match_id', 'date', 'outcome'] + SUM_COLUMNS
+        self.conn.execute(
+            f'INSERT INTO recent ({", ".join(recent_columns)}) VALUES ({", ".join("?" for _ in recent_columns)})',
+            group + [match_id, date, outcome] + values
+        )
+        # Backfilled matches can be older than the window, in which case this drops them straight away
+        group_filter = ' AND '.join(f'{column} = ?' for column in GROUP_COLUMNS)
+        self.conn.execute(
+            f'DELETE FROM recent WHERE rowid IN (SELECT rowid FROM recent WHERE {group_filter} '
+            f'ORDER BY date DESC, match_id DESC LIMIT -1 OFFSET ?)',
+            group + [self.window]
+        )
+        return True
+
+    def _filters(self, filters):
+        clauses = []
+        params = []
+        for column, value in filters.items():
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(str(value))
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def totals(self, group_by=('player_xuid',), player_xuid=None, playlist_id=None, map=None, game_type=None):
+        """Summed stats with K/D, win rate and accuracy, one dict per combination of group_by columns"""
+        group_by = [column for column in group_by if column in GROUP_COLUMNS]
+        where, params = self._filters({'player_xuid': player_xuid, 'playlist_id': playlist_id, 'map': map, 'game_type': game_type})
+        sums = ['matches'] + list(OUTCOME_COLUMNS.values()) + SUM_COLUMNS
+        select = group_by + [f'SUM({column}) AS {column}' for column in sums] + ['MIN(first_date) AS first_date', 'MAX(last_date) AS last_date']
+        query = f'SELECT {", ".join(select)} FROM groups{where}'
+        if group_by:
+            query += f' GROUP BY {", ".join(group_by)}'
+        cursor = self.conn.execute(query, params)
+        names = [description[0] for description in cursor.description]
+        return [derived_stats(dict(zip(names, values))) for values in cursor if values[len(group_by)]]
+
+    def leaderboard(self, stat='kd', limit=10, min_matches=1, group_by=('player_xuid',), **filters):
+        """Groups ranked by a summed or derived stat, best first"""
+        totals = [entry for entry in self.totals(group_by, **filters) if entry['matches'] >= min_matches]
+        return sorted(totals, key=lambda entry: entry.get(stat) or 0, reverse=True)[:limit]
+
+    def recent_form(self, player_xuid, matches=ROLLING_WINDOW, playlist_id=None, map=None, game_type=None):
+        """Totals over a player's last matches (at most the store's window), overall or for one split"""
+        # A player's last N matches overall are always within the last N of their own groups
+        where, params = self._filters({'player_xuid': player_xuid, 'playlist_id': playlist_id, 'map': map, 'game_type': game_type})
+        cursor = self.conn.execute(
+            f'SELECT outcome, {", ".join(SUM_COLUMNS)} FROM recent{where} ORDER BY date DESC, match_id DESC LIMIT ?',
+            params + [min(matches, self.window)]
+        )
+        totals = dict.fromkeys(['matches'] + list(OUTCOME_COLUMNS.values()) + SUM_COLUMNS, 0)
+        for outcome, *values in cursor:
+            totals['matches'] += 1
+            if outcome in OUTCOME_COLUMNS:
+                totals[OUTCOME_COLUMNS[outcome]] += 1
+            for column, value in zip(SUM_COLUMNS, values):
+                totals[column] += value
+        return derived_stats(totals)
+
+    def load_csv(self, csv_filename):
+        """Count every row of an existing stats CSV that isn't counted yet"""
+        added = 0
+        with open(csv_filename, 'r', newline='', encoding='utf-8') as csvfile:
+            batch = []
+            for row in csv.DictReader(csvfile):
+                batch.append(row)
+                if len(batch) >= 1000:
+                    added += self.write_rows(batch)
+                    batch = []
+            added += self.write_rows(batch)
+        while self.pending:
+            time.sleep(WRITE_LOCK_RETRY)
+            added += self._write_pending()
+        return added
+
+    def flush(self):
+        """Retry rows left pending by a locked database"""
+        self._write_pending()
+
+    def close(self):
+        # Nothing else is waiting by now, so the last pending rows may wait out the lock
+        self.conn.execute('PRAGMA busy_timeout = 30000')
+        self._write_pending()
+        if self.pending:
+            print(f"Aggregates: {len(self.pending)} rows could not be counted in {self.path}")
+        self.conn.close()
+
+if __name__ == "__main__":
+    store = AggregateStore(AGGREGATE_DB_FILE)
+    try:
+        print(f"Aggregates: counted {store.load_csv('halo_multi_player_stats.csv')} new rows")
+    finally:
+        store.close()
@@ -0,0 +1,191 @@
+import csv
+from csv_writer import is_medal_column
+from parquet_writer import PARQUET_DIR, read_parquet_dataset
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    pd = None
+
+# Columns the analytics read, besides every per-medal column
+ANALYTICS_COLUMNS = [
+    'player_xuid', 'player_gamertag', 'match_id', 'date', 'duration', 'map', 'playlist_id', 'outcome',
+    'kills', 'deaths', 'assists', 'accuracy', 'damage_dealt', 'shots_fired', 'shots_hit',
+    'match_csr_value', 'post_match_csr_value'
+]
+NUMERIC_COLUMNS = ['kills', 'deaths', 'assists', 'accuracy', 'damage_dealt', 'shots_fired', 'shots_hit']
+# Rows carry 0 for these when the match was unranked or the skill lookup failed
+CSR_COLUMNS = ['match_csr_value', 'post_match_csr_value']
+ROLLING_KD_WINDOW = 20
+# Medal rates are given per this many minutes played
+MEDAL_RATE_MINUTES = 10
+
+
+def require_pandas():
+    if pd is None:
+        raise RuntimeError("Analytics needs numpy and pandas (pip install pandas)")
+
+
+def analytics_columns(headers):
+    """The analytics columns and medal columns present in a table's headers"""
+    return [header for header in headers if header in ANALYTICS_COLUMNS or is_medal_column(header)]
+
+
+class MatchTable:
+    """Exported match rows as column arrays, sorted by player and then date.
+
+    The table is loaded once; every statistic is worked out with whole-column
+    NumPy operations, using each row's player start offset in place of a
+    per-player loop. Missing or zero CSR values (unranked matches, failed skill
+    lookups) are NaN.
+    """
+
+    def __init__(self, frame):
+        require_pandas()
+        frame = frame.copy()
+        for header in ANALYTICS_COLUMNS:
+            if header not in frame:
+                frame[header] = np.nan if header in NUMERIC_COLUMNS or header in CSR_COLUMNS else ''
+        for header in ('player_xuid', 'match_id', 'map', 'playlist_id', 'outcome'):
+            frame[header] = frame[header].astype(str)
+        frame['date'] = pd.to_datetime(frame['date'], errors='coerce')
+        self.frame = frame.sort_values(['player_xuid', 'date', 'match_id'], kind='mergesort').reset_index(drop=True)
+        self.size = len(self.frame)
+        self.player_codes, self.players = pd.factorize(self.frame['player_xuid'])
+        # Rows are sorted by player, so each player is one contiguous run starting at starts[code]
+        self.starts = np.flatnonzero(np.r_[True, self.player_codes[1:] != self.player_codes[:-1]]) if self.size else np.array([], dtype=int)
+        self.row_start = self.starts[self.player_codes] if self.size else np.array([], dtype=int)
+        self.columns = {header: self._numeric(header) for header in NUMERIC_COLUMNS}
+        for header in CSR_COLUMNS:
+            values = self._numeric(header)
+            self.columns[header] = np.where(values == 0, np.nan, values)
+        self.seconds = self._seconds(self.frame['duration'])
+        self.outcome = np.select([self.frame['outcome'].to_numpy() == 'Win', self.frame['outcome'].to_numpy() == 'Loss'], [1, -1], 0)
+        self.medal_columns = [header for header in self.frame.columns if is_medal_column(header)]
+
+    @classmethod
+    def from_csv(cls, csv_filename='halo_multi_player_stats.csv'):
+        require_pandas()
+        with open(csv_filename, 'r', newline='', encoding='utf-8') as csvfile:
+            headers = next(csv.reader(csvfile), [])
+        return cls(pd.read_csv(csv_filename, usecols=analytics_columns(headers), dtype={'player_xuid': str, 'match_id': str}))
+
+    @classmethod
+    def from_parquet(cls, output_dir=PARQUET_DIR):
+        require_pandas()
+        table = read_parquet_dataset(output_dir)
+        return cls(table.select(analytics_columns(table.column_names)).to_pandas())
+
+    @classmethod
+    def from_rows(cls, rows):
+        require_pandas()
+        return cls(pd.DataFrame.from_records([dict(row) for row in rows]))
+
+    def _numeric(self, header):
+        return pd.to_numeric(self.frame[header], errors='coerce').to_numpy(dtype=float)
+
+    def _seconds(self, durations):
+        # CSV durations are H:MM:SS strings; Parquet stores them as seconds already
+        if pd.api.types.is_numeric_dtype(durations):
+            return durations.to_numpy(dtype=float)
+        return pd.to_timedelta(durations.astype(str), errors='coerce').dt.total_seconds().to_numpy(dtype=float)
+
+    def _keys(self):
+        return self.frame[['player_xuid', 'match_id', 'date']]
+
+    def _rolling_sum(self, values, window):
+        """Sum of each row and the player's previous window - 1 rows"""
+        cumulative = np.concatenate(([0.0], np.cumsum(np.nan_to_num(values))))
+        end = np.arange(1, self.size + 1)
+        begin = np.maximum(end - window, self.row_start)
+        return cumulative[end] - cumulative[begin]
+
+    def rolling_kd(self, window=ROLLING_KD_WINDOW):
+        """K/D over each match and the player's window - 1 matches before it"""
+        kills = self._rolling_sum(self.columns['kills'], window)
+        deaths = self._rolling_sum(self.columns['deaths'], window)
+        result = self._keys().copy()
+        result['rolling_kills'] = kills
+        result['rolling_deaths'] = deaths
+        result['rolling_kd'] = np.where(deaths > 0, kills / np.maximum(deaths, 1), kills)
+        return result
+
+    def csr_deltas(self):
+        """CSR change from each ranked match: post-match minus pre-match CSR where the post-match
+        value was recorded, otherwise the pre-match CSR of the player's next match in the same playlist"""
+        before = self.columns['match_csr_value']
+        after = self.columns['post_match_csr_value'].copy()
+        ranked = np.flatnonzero(~np.isnan(before))
+        if len(ranked):
+            playlist_codes = pd.factorize(self.frame['playlist_id'])[0]
+            # Ranked rows in (player, playlist, date) order; rows are already date ordered within a player
+            order = ranked[np.lexsort((ranked, playlist_codes[ranked], self.player_codes[ranked]))]
+            same = (self.player_codes[order[1:]] == self.player_codes[order[:-1]]) & (playlist_codes[order[1:]] == playlist_codes[order[:-1]])
+            following = np.full(self.size, np.nan)
+            following[order[:-1][same]] = before[order[1:][same]]
+            after = np.where(np.isnan(after), following, after)
+        result = self._keys().copy()
+        result['playlist_id'] = self.frame['playlist_id']
+        result['csr_before'] = before
+        result['csr_after'] = after
+        result['csr_delta'] = after - before
+        return result
+
+    def _run_lengths(self):
+        # Position of each row within its run of identical outcomes for the same player
+        index = np.arange(self.size)
+        new_run = np.r_[True, (self.outcome[1:] != self.outcome[:-1]) | (self.player_codes[1:] != self.player_codes[:-1])] if self.size else np.array([], dtype=bool)
+        run_start = np.maximum.accumulate(np.where(new_run, index, 0)) if self.size else index
+        return index - run_start + 1
+
+    def streaks(self):
+        """Streak after each match: +n for the nth win in a row, -n for the nth loss, 0 after anything else"""
+        result = self._keys().copy()
+        result['outcome'] = self.frame['outcome']
+        result['streak'] = self.outcome * self._run_lengths()
+        return result
+
+    def longest_streaks(self):
+        """Per player: longest win and loss streaks, and the streak they are on now"""
+        lengths = self._run_lengths()
+        if not self.size:
+            return pd.DataFrame(columns=['player_xuid', 'longest_win_streak', 'longest_loss_streak', 'current_streak'])
+        ends = np.r_[self.starts[1:], self.size] - 1
+        return pd.DataFrame({
+            'player_xuid': self.players,
+            'longest_win_streak': np.maximum.reduceat(np.where(self.outcome == 1, lengths, 0), self.starts),
+            'longest_loss_streak': np.maximum.reduceat(np.where(self.outcome == -1, lengths, 0), self.starts),
+            'current_streak': self.outcome[ends] * lengths[ends]
+        })
+
+    def map_win_rates(self, min_matches=1):
+        """Matches, wins and win rate for every player and map"""
+        map_codes, maps = pd.factorize(self.frame['map'])
+        group = self.player_codes * len(maps) + map_codes
+        size = len(self.players) * len(maps)
+        matches = np.bincount(group, minlength=size)
+        wins = np.bincount(group, weights=self.outcome == 1, minlength=size)
+        present = np.flatnonzero(matches >= max(min_matches, 1))
+        return pd.DataFrame({
+            'player_xuid': self.players[present // len(maps)] if len(maps) else [],
+            'map': maps[present % len(maps)] if len(maps) else [],
+            'matches': matches[present],
+            'wins': wins[present].astype(int),
+            'win_rate': 100 * wins[present] / matches[present]
+        })
+
+    def medal_rates(self, minutes=MEDAL_RATE_MINUTES):
+        """Each medal earned per this many minutes played, one row per player"""
+        if not self.size or not self.medal_columns:
+            return pd.DataFrame(index=pd.Index(self.players, name='player_xuid'))
+        medals = self.frame[self.medal_columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        totals = np.add.reduceat(np.nan_to_num(medals), self.starts, axis=0)
+        seconds = np.add.reduceat(np.nan_to_num(self.seconds), self.starts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.where(seconds[:, None] > 0, totals * (60 * minutes) / seconds[:, None], 0)
+        return pd.DataFrame(
+            rates,
+            index=pd.Index(self.players, name='player_xuid'),
+            columns=[header[len('medal_'):] for header in self.medal_columns]
+        )
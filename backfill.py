@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import asyncio
+from csv_writer import StreamingCsvWriter
+from aggregate_store import AggregateStore
+from stats import (
+    PLAYERS, BASE_CSV_HEADERS, DEFAULT_MAX_IN_FLIGHT, HISTORY_PAGE_SIZE, METADATA_CACHE_FILE,
+    clean_xuid, open_halo_client, get_medal_metadata, run_bounded, process_matches, flush_writers
+)
+
+BACKFILL_CHECKPOINT_FILE = 'halo_backfill_checkpoint.json'
+# History pages requested per player before rows are written and the checkpoint is saved
+PAGES_PER_ROUND = 4
+
+MATCH_COUNT_FIELDS = {
+    'all': 'matches_played_count',
+    'matchmaking': 'matchmade_matches_played_count',
+    'custom': 'custom_matches_played_count',
+    'local': 'local_matches_played_count'
+}
+
+def load_checkpoint(checkpoint_file=BACKFILL_CHECKPOINT_FILE):
+    """Load backfill progress saved by a previous run"""
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_checkpoint(checkpoint, checkpoint_file=BACKFILL_CHECKPOINT_FILE):
+    """Save backfill progress, replacing the old file in one step"""
+    temp_file = f"{checkpoint_file}.tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(checkpoint, f, indent=4)
+    os.replace(temp_file, checkpoint_file)
+
+async def fetch_match_total(client, player_xuid, match_type, semaphore):
+    try:
+        count_response = await run_bounded(semaphore, client.stats.get_match_count(player_xuid))
+        match_counts = await count_response.parse()
+        return getattr(match_counts, MATCH_COUNT_FIELDS.get(match_type, 'matches_played_count'))
+    except Exception:
+        return None
+
+async def fetch_history_page(client, player_xuid, start, match_type, semaphore):
+    history_response = await run_bounded(semaphore, client.stats.get_match_history(
+        player=player_xuid,
+        start=start,
+        count=HISTORY_PAGE_SIZE,
+        match_type=match_type
+    ))
+    match_history = await history_response.parse()
+    return [match_result.match_id for match_result in (match_history.results or [])]
+
+async def run_backfill(match_type='all', csv_filename='halo_multi_player_stats.csv', checkpoint_file=BACKFILL_CHECKPOINT_FILE,
+                       max_in_flight=DEFAULT_MAX_IN_FLIGHT, pages_per_round=PAGES_PER_ROUND, metadata_cache_file=METADATA_CACHE_FILE,
+                       aggregate_file=None, roster_file=None):
+    """Page through every tracked player's full match history, resuming from the checkpoint"""
+    checkpoint = load_checkpoint(checkpoint_file)
+    for player in PLAYERS:
+        checkpoint.setdefault(clean_xuid(player["xuid"]), {
+            'gamertag': player["gamertag"],
+            'offset': 0,
+            'total': None,
+            'done': False,
+            'processed': [],
+            'failed': {}
+        })
+    # Membership checks use sets; the checkpoint only holds lists once it is saved
+    processed_ids = {player_xuid: set(state['processed']) for player_xuid, state in checkpoint.items()}
+    csv_writer = StreamingCsvWriter(csv_filename, BASE_CSV_HEADERS)
+    # Old matches land in the same running totals as new ones
+    aggregate_store = AggregateStore(aggregate_file) if aggregate_file else None
+    produced = {}
+
+    def write_rows(match_results):
+        for _, _, match_row, row_headers in match_results:
+            produced.setdefault(str(match_row['player_xuid']), set()).add(str(match_row['match_id']))
+            csv_writer.write_rows([match_row], row_headers)
+            if aggregate_store:
+                aggregate_store.write_rows([match_row], row_headers)
+
+    try:
+        async with open_halo_client(metadata_cache_file, roster_file=roster_file) as client:
+            medal_names = await get_medal_metadata(client)
+            semaphore = asyncio.Semaphore(max_in_flight)
+            csr_cache = {}
+            missing_totals = [player for player in PLAYERS if checkpoint[clean_xuid(player["xuid"])]['total'] is None]
+            totals = await asyncio.gather(*[
+                fetch_match_total(client, clean_xuid(player["xuid"]), match_type, semaphore)
+                for player in missing_totals
+            ])
+            for player, total in zip(missing_totals, totals):
+                checkpoint[clean_xuid(player["xuid"])]['total'] = total
+            started = time.monotonic()
+            matches_done = 0
+            first_round = True
+            while True:
+                active_players = [player for player in PLAYERS if not checkpoint[clean_xuid(player["xuid"])]['done']]
+                if not active_players and not first_round:
+                    break
+                page_requests = []
+                for player in active_players:
+                    state = checkpoint[clean_xuid(player["xuid"])]
+                    if state['total'] is not None and state['offset'] >= state['total']:
+                        state['done'] = True
+                        continue
+                    for page in range(pages_per_round):
+                        start = state['offset'] + page * HISTORY_PAGE_SIZE
+                        if state['total'] is not None and start >= state['total']:
+                            break
+                        page_requests.append((player, start))
+                pages = await asyncio.gather(*[
+                    fetch_history_page(client, clean_xuid(player["xuid"]), start, match_type, semaphore)
+                    for player, start in page_requests
+                ], return_exceptions=True)
+                # The offset only advances over pages that loaded in order, so a failed page
+                # is requested again next round instead of leaving a hole in the history.
+                round_matches = {clean_xuid(player["xuid"]): [] for player in PLAYERS}
+                next_offsets = {}
+                finished = set()
+                for (player, start), page in zip(page_requests, pages):
+                    player_xuid = clean_xuid(player["xuid"])
+                    if player_xuid in finished or next_offsets.get(player_xuid, checkpoint[player_xuid]['offset']) != start:
+                        continue
+                    if isinstance(page, BaseException):
+                        finished.add(player_xuid)
+                        continue
+                    round_matches[player_xuid].extend((start + i + 1, match_id) for i, match_id in enumerate(page))
+                    next_offsets[player_xuid] = start + len(page)
+                    if len(page) < HISTORY_PAGE_SIZE:
+                        checkpoint[player_xuid]['done'] = True
+                        finished.add(player_xuid)
+                if page_requests and not next_offsets and not first_round:
+                    print("Backfill: no history pages could be loaded, stopping; run again to resume")
+                    break
+                if first_round:
+                    for player in PLAYERS:
+                        player_xuid = clean_xuid(player["xuid"])
+                        retries = checkpoint[player_xuid]['failed'].items()
+                        round_matches[player_xuid].extend((match_number, match_id) for match_id, match_number in retries)
+                    first_round = False
+                match_players = {}
+                for player in PLAYERS:
+                    player_xuid = clean_xuid(player["xuid"])
+                    for match_number, match_id in round_matches[player_xuid]:
+                        if str(match_id) not in processed_ids[player_xuid]:
+                            match_players.setdefault(match_id, []).append((player, match_number))
+                produced.clear()
+                matches_done += await process_matches(client, PLAYERS, match_players, medal_names, csr_cache, semaphore, write_rows)
+                # Rows must be on disk before the checkpoint says they were processed
+                csv_writer.sync()
+                if aggregate_store:
+                    await flush_writers([aggregate_store])
+                for player in PLAYERS:
+                    player_xuid = clean_xuid(player["xuid"])
+                    state = checkpoint[player_xuid]
+                    state['offset'] = next_offsets.get(player_xuid, state['offset'])
+                    for match_number, match_id in round_matches[player_xuid]:
+                        if str(match_id) in produced.get(player_xuid, set()):
+                            processed_ids[player_xuid].add(str(match_id))
+                            state['failed'].pop(str(match_id), None)
+                        elif str(match_id) not in processed_ids[player_xuid]:
+                            state['failed'][str(match_id)] = match_number
+                    state['processed'] = sorted(processed_ids[player_xuid])
+                save_checkpoint(checkpoint, checkpoint_file)
+                elapsed = time.monotonic() - started
+                rate = matches_done / elapsed if elapsed > 0 else 0
+                offsets = ', '.join(f"{state['gamertag']} {state['offset']}/{state['total'] if state['total'] is not None else '?'}" for state in checkpoint.values())
+                print(f"Backfill: {matches_done} matches in {elapsed:.1f}s ({rate:.2f} matches/sec) - {offsets}")
+    finally:
+        csv_writer.close()
+        if aggregate_store:
+            aggregate_store.close()
+    failed = sum(len(state['failed']) for state in checkpoint.values())
+    if failed:
+        print(f"Backfill: {failed} matches failed and will be retried on the next run")
+
+if __name__ == "__main__":
+    asyncio.run(run_backfill(
+        match_type='all',
+        csv_filename='halo_multi_player_stats.csv',
+        checkpoint_file=BACKFILL_CHECKPOINT_FILE,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT
+    ))
@@ -0,0 +1,225 @@
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import tempfile
+import contextlib
+import multiprocessing
+from functools import partial
+from spnkr.services import stats as stats_service, skill as skill_service
+from spnkr.services import gamecms_hacs as gamecms_hacs_service, discovery_ugc as discovery_ugc_service
+import stats
+from http_session import ConnectionStats, percentile
+from rate_limiter import AdaptiveRateLimiter
+from token_manager import TOKEN_TIERS
+from fake_halo_api import FakeHaloApi, DEFAULT_LATENCY, DEFAULT_LATENCY_JITTER
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCHMARK_PLAYER_COUNTS = [1, 4, 8]
+BENCHMARK_HISTORY_DEPTHS = [10, 50]
+BENCHMARK_CONCURRENCY = [4, 16]
+# The production limiter would turn every case into a measurement of the limiter itself
+BENCHMARK_REQUESTS_PER_SECOND = 500
+BENCHMARK_REPORT_FILE = 'benchmark_results.json'
+# A case whose matches/sec drops by more than this against the previous report is flagged
+REGRESSION_THRESHOLD = 0.10
+SPNKR_SERVICES = [stats_service, skill_service, gamecms_hacs_service, discovery_ugc_service]
+
+
+def benchmark_players(count, recorded=False):
+    """Players for a case: the tracked players for recorded payloads, made-up ones otherwise"""
+    if recorded:
+        return stats.PLAYERS[:count]
+    return [{"gamertag": f"Benchmark {i + 1}", "xuid": str(2535400100000000 + i)} for i in range(count)]
+
+
+def write_benchmark_tokens(token_file):
+    # Every tier is valid for a year, so the TokenManager never tries to sign in
+    expires_at = time.time() + 365 * 24 * 60 * 60
+    tokens = {'refresh_token': 'benchmark', 'clearance_token': 'benchmark', 'xuid': '2535400100000000'}
+    for token_name, expiry_key in TOKEN_TIERS:
+        tokens[token_name] = 'benchmark'
+        tokens[expiry_key] = expires_at
+    with open(token_file, 'w') as f:
+        json.dump(tokens, f)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _run_case(base_url, case, requests_per_second, results):
+    # Runs in its own process so peak RSS belongs to this case alone
+    for service in SPNKR_SERVICES:
+        service._HOST = base_url
+    if requests_per_second:
+        stats.MAX_REQUESTS_PER_SECOND = requests_per_second
+        stats.AdaptiveRateLimiter = partial(AdaptiveRateLimiter, rate=requests_per_second, max_rate=requests_per_second)
+    connection_stats = []
+
+    class RecordingConnectionStats(ConnectionStats):
+        def __init__(self):
+            super().__init__()
+            connection_stats.append(self)
+
+    stats.ConnectionStats = RecordingConnectionStats
+    stats.PLAYERS = case['player_list']
+    with tempfile.TemporaryDirectory() as work_dir:
+        token_file = os.path.join(work_dir, 'tokens.json')
+        csv_filename = os.path.join(work_dir, 'benchmark.csv')
+        write_benchmark_tokens(token_file)
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            asyncio.run(stats.run_multi_player_stats(
+                match_count=case['depth'],
+                csv_filename=csv_filename,
+                max_in_flight=case['concurrency'],
+                metadata_cache_file=os.path.join(work_dir, 'metadata.sqlite'),
+                incremental=True,
+                sync_state_file=os.path.join(work_dir, 'sync_state.json'),
+                response_cache_file=None,
+                token_file=token_file
+            ))
+        elapsed = time.perf_counter() - started
+        match_ids = set()
+        rows = 0
+        if os.path.exists(csv_filename):
+            with open(csv_filename, 'r', newline='', encoding='utf-8') as csvfile:
+                for row in csv.DictReader(csvfile):
+                    match_ids.add(row['match_id'])
+                    rows += 1
+    latencies = sorted(latency for recorded in connection_stats for latency in recorded.latencies)
+    results.put({
+        'elapsed': round(elapsed, 3),
+        'matches': len(match_ids),
+        'rows': rows,
+        'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'peak_rss_mb': peak_rss_mb()
+    })
+
+
+async def run_case(case, latency=DEFAULT_LATENCY, latency_jitter=DEFAULT_LATENCY_JITTER, error_rate=0.0,
+                   throttle_rate=0.0, requests_per_second=BENCHMARK_REQUESTS_PER_SECOND, response_cache_file=None):
+    """Run one player count / depth / concurrency combination against a fresh fake API"""
+    case = dict(case, player_list=benchmark_players(case['players'], recorded=bool(response_cache_file)))
+    api = FakeHaloApi(
+        [player['xuid'] for player in case['player_list']],
+        case['depth'],
+        latency=latency,
+        latency_jitter=latency_jitter,
+        error_rate=error_rate,
+        throttle_rate=throttle_rate,
+        response_cache_file=response_cache_file
+    )
+    base_url = await api.start()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_case, args=(base_url, case, requests_per_second, results))
+    loop = asyncio.get_running_loop()
+    try:
+        process.start()
+        # The fake API keeps serving on this loop while the case runs in the child
+        await loop.run_in_executor(None, process.join)
+    finally:
+        await api.stop()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark case {case['players']} players/{case['depth']} deep/{case['concurrency']} in flight exited with {process.exitcode}")
+    result = results.get(timeout=10)
+    requests = sum(api.requests.values())
+    result.update({
+        'players': case['players'],
+        'depth': case['depth'],
+        'concurrency': case['concurrency'],
+        'matches_per_sec': round(result['matches'] / result['elapsed'], 2) if result['elapsed'] else 0,
+        'requests': requests,
+        'requests_per_match': round(requests / result['matches'], 2) if result['matches'] else 0,
+        'requests_by_endpoint': dict(api.requests),
+        'injected': dict(api.injected)
+    })
+    return result
+
+
+def case_key(result):
+    return (result['players'], result['depth'], result['concurrency'])
+
+
+def find_regressions(results, previous_results, threshold=REGRESSION_THRESHOLD):
+    """Cases whose matches/sec fell by more than threshold against the same case last time"""
+    previous_by_case = {case_key(result): result for result in previous_results}
+    regressions = []
+    for result in results:
+        previous = previous_by_case.get(case_key(result))
+        if previous and previous['matches_per_sec'] and result['matches_per_sec'] < previous['matches_per_sec'] * (1 - threshold):
+            regressions.append((result, previous))
+    return regressions
+
+
+async def run_benchmarks(player_counts=BENCHMARK_PLAYER_COUNTS, history_depths=BENCHMARK_HISTORY_DEPTHS,
+                         concurrency_levels=BENCHMARK_CONCURRENCY, latency=DEFAULT_LATENCY,
+                         latency_jitter=DEFAULT_LATENCY_JITTER, error_rate=0.0, throttle_rate=0.0,
+                         requests_per_second=BENCHMARK_REQUESTS_PER_SECOND, response_cache_file=None,
+                         report_file=BENCHMARK_REPORT_FILE):
+    """Run every combination against the fake API, print a report and compare it with the last one"""
+    results = []
+    for players in player_counts:
+        for depth in history_depths:
+            for concurrency in concurrency_levels:
+                result = await run_case(
+                    {'players': players, 'depth': depth, 'concurrency': concurrency},
+                    latency, latency_jitter, error_rate, throttle_rate, requests_per_second, response_cache_file
+                )
+                results.append(result)
+                print(f"{players:>3} players {depth:>4} deep {concurrency:>3} in flight: "
+                      f"{result['matches_per_sec']:>7} matches/s, {result['requests_per_match']:>5} requests/match, "
+                      f"p50 {result['latency_p50_ms']}ms, p99 {result['latency_p99_ms']}ms, "
+                      f"peak RSS {result['peak_rss_mb']}MB, injected {result['injected']}")
+    settings = {
+        'latency': latency,
+        'latency_jitter': latency_jitter,
+        'error_rate': error_rate,
+        'throttle_rate': throttle_rate,
+        'requests_per_second': requests_per_second,
+        'recorded': bool(response_cache_file)
+    }
+    previous_results = []
+    if report_file and os.path.exists(report_file):
+        with open(report_file, 'r') as f:
+            previous_report = json.load(f)
+        # Runs against a differently behaving fake API aren't comparable
+        if previous_report.get('settings') == settings:
+            previous_results = previous_report.get('results', [])
+    for result, previous in find_regressions(results, previous_results):
+        print(f"Regression: {result['players']} players {result['depth']} deep {result['concurrency']} in flight "
+              f"fell from {previous['matches_per_sec']} to {result['matches_per_sec']} matches/s")
+    if report_file:
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'settings': settings,
+            'results': results
+        }
+        temp_file = f"{report_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(temp_file, report_file)
+    return results
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmarks(
+        player_counts=BENCHMARK_PLAYER_COUNTS,
+        history_depths=BENCHMARK_HISTORY_DEPTHS,
+        concurrency_levels=BENCHMARK_CONCURRENCY,
+        latency=DEFAULT_LATENCY,
+        error_rate=0.0,
+        throttle_rate=0.0
+    ))
@@ -0,0 +1,123 @@
+from array import array
+from csv_writer import csv_default_value, is_medal_column
+
+# Stands in for a dense column a row doesn't have
+_MISSING = object()
+
+
+def is_sparse_column(header):
+    """Medal and mode stat columns, which most rows have few non-zero values for"""
+    return is_medal_column(header) or '_stats_' in header
+
+
+class RowLayout:
+    """Shared layout for CompactRow.
+
+    Dense columns (identity, core stats, CSR) are stored positionally in a tuple;
+    the layout grows as new ones are seen, so rows packed earlier just have
+    shorter tuples. Medal and mode stat columns are kept as an array of column
+    ids plus a tuple of values, and only when the value isn't the column's default.
+    """
+
+    def __init__(self, dense_columns=()):
+        self.dense_columns = []
+        self.index = {}
+        self.sparse_columns = []
+        self.sparse_index = {}
+        self.defaults = {}
+        for header in dense_columns:
+            self.add_dense(header)
+
+    def add_dense(self, header):
+        self.index[header] = len(self.dense_columns)
+        self.dense_columns.append(header)
+
+    def sparse_id(self, header):
+        column_id = self.sparse_index.get(header)
+        if column_id is None:
+            column_id = self.sparse_index[header] = len(self.sparse_columns)
+            self.sparse_columns.append(header)
+            self.defaults[header] = csv_default_value(header)
+        return column_id
+
+    def pack(self, row):
+        """CompactRow holding the same values as the dict row"""
+        if isinstance(row, CompactRow):
+            return row
+        index = self.index
+        sparse_ids = array('I')
+        sparse_values = []
+        for header, value in row.items():
+            if header in index:
+                continue
+            if not is_sparse_column(header):
+                self.add_dense(header)
+                continue
+            column_id = self.sparse_id(header)
+            default = self.defaults[header]
+            # 0.0 is kept so a float column still looks like one when its type is worked out
+            if type(value) is type(default) and value == default:
+                continue
+            sparse_ids.append(column_id)
+            sparse_values.append(value)
+        dense = tuple(row.get(header, _MISSING) for header in self.dense_columns)
+        return CompactRow(self, dense, sparse_ids, tuple(sparse_values))
+
+
+class CompactRow:
+    """Read-only row with the mapping methods the writers use; to_dict() gives a plain dict"""
+
+    __slots__ = ('layout', 'dense', 'sparse_ids', 'sparse_values')
+
+    def __init__(self, layout, dense, sparse_ids, sparse_values):
+        self.layout = layout
+        self.dense = dense
+        self.sparse_ids = sparse_ids
+        self.sparse_values = sparse_values
+
+    def _lookup(self, header):
+        position = self.layout.index.get(header)
+        if position is not None:
+            if position < len(self.dense):
+                return self.dense[position]
+            return _MISSING
+        column_id = self.layout.sparse_index.get(header)
+        if column_id is None:
+            return _MISSING
+        try:
+            return self.sparse_values[self.sparse_ids.index(column_id)]
+        except ValueError:
+            return _MISSING
+
+    def __contains__(self, header):
+        return self._lookup(header) is not _MISSING
+
+    def __getitem__(self, header):
+        value = self._lookup(header)
+        if value is _MISSING:
+            raise KeyError(header)
+        return value
+
+    def get(self, header, default=None):
+        value = self._lookup(header)
+        return default if value is _MISSING else value
+
+    def __iter__(self):
+        for header, value in zip(self.layout.dense_columns, self.dense):
+            if value is not _MISSING:
+                yield header
+        for column_id in self.sparse_ids:
+            yield self.layout.sparse_columns[column_id]
+
+    def __len__(self):
+        return sum(1 for value in self.dense if value is not _MISSING) + len(self.sparse_ids)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(header, self[header]) for header in self]
+
+    def to_dict(self):
+        """The row as a dict; medal and mode columns that were at their default are left out"""
+        return dict(self.items())
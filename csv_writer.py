@@ -0,0 +1,249 @@
+import io
+import os
+import csv
+import json
+from datetime import timedelta
+
+# Columns that are fractional even when a particular match happens to give a whole number
+FLOAT_COLUMNS = {'kd', 'kda', 'accuracy', 'match_mmr_value'}
+
+
+def csv_default_value(header):
+    """Value written for a column a row doesn't have"""
+    if (header.startswith(('current_csr_', 'season_max_csr_', 'all_time_max_csr_')) and
+        header.endswith(('_id', '_value', '_start', '_remaining', '_matches'))) or \
+       (header in ['kills', 'deaths', 'assists', 'kd', 'kda', 'score', 'medal_count', 'accuracy']) or \
+       header.endswith(('_count', '_kills', '_score', '_ticks', '_captures', '_defusals', '_plants',
+                      '_returns', '_steals', '_grabs', '_secures', '_denied', '_survived', '_remaining',
+                      '_assists', '_executions', '_pick_ups', '_detonations')) or \
+       header.startswith(('time_', 'damage_', 'medal_')) or \
+       'time_as_' in header:
+        return 0
+    return ''
+
+
+def is_medal_column(header):
+    """Whether header is a per-medal count; medal_count is the match's total, not a medal"""
+    return header.startswith('medal_') and header != 'medal_count'
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def column_type(header, values):
+    """Pick the column type name from the header and the values seen for it.
+
+    The values decide: any that isn't a number makes the column a string, and
+    numbers are ints unless the column is always fractional or a float shows up.
+    The header's CSV default only decides for a column with no values yet.
+    """
+    if header == 'date':
+        return 'timestamp'
+    if header == 'duration' or any(isinstance(value, timedelta) for value in values):
+        return 'seconds'
+    present = [value for value in values if value is not None and value != '']
+    if any(not is_number(value) for value in present):
+        return 'string'
+    if not present and csv_default_value(header) == '':
+        return 'string'
+    if header in FLOAT_COLUMNS or header.endswith('_kda') or any(isinstance(value, float) for value in present):
+        return 'float'
+    return 'int'
+
+
+class ColumnSchema:
+    """Ordered set of column names, each with its missing-value default worked out once"""
+
+    def __init__(self, headers=()):
+        self.columns = []
+        self.defaults = []
+        self.index = {}
+        for header in headers:
+            self.add(header)
+
+    def add(self, header):
+        """Append header if it is new; returns whether it was"""
+        if header in self.index:
+            return False
+        self.index[header] = len(self.columns)
+        self.columns.append(header)
+        self.defaults.append(csv_default_value(header))
+        return True
+
+    def update(self, headers):
+        """Add every new header in order; returns whether any were new"""
+        # A row (a dict) usually has no new columns, which one set comparison can tell
+        if isinstance(headers, dict) and self.index.keys() >= headers.keys():
+            return False
+        added = False
+        for header in headers:
+            added = self.add(header) or added
+        return added
+
+    def default(self, header):
+        return self.defaults[self.index[header]]
+
+    def values(self, row):
+        """row as a list in column order, with defaults for the columns it doesn't have"""
+        return list(map(row.get, self.columns, self.defaults))
+
+    def __contains__(self, header):
+        return header in self.index
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+
+class StreamingCsvWriter:
+    """Appends rows to a CSV as they are produced.
+
+    Columns only ever get added at the end, and the full column list lives in a
+    sidecar schema file. Rows written before a column existed are just shorter, so
+    new columns never force a rewrite mid-run; compact() rewrites the header and
+    pads the short rows once at the end of a run that added columns.
+    """
+
+    def __init__(self, csv_filename, base_headers):
+        self.csv_filename = csv_filename
+        self.schema_filename = f"{csv_filename}.schema.json"
+        self.schema = ColumnSchema()
+        self.header_length = 0
+        self.keys = set()
+        self.rows_written = 0
+        self.file = None
+        self.writer = None
+        if os.path.exists(csv_filename) and os.path.getsize(csv_filename) > 0:
+            self._load_existing()
+        self.schema.update(base_headers)
+
+    def _load_existing(self):
+        with open(self.csv_filename, 'r', newline='', encoding='utf-8') as csvfile:
+            reader = csv.reader(csvfile)
+            file_headers = next(reader, [])
+            xuid_index = file_headers.index('player_xuid') if 'player_xuid' in file_headers else None
+            match_index = file_headers.index('match_id') if 'match_id' in file_headers else None
+            if xuid_index is not None and match_index is not None:
+                for values in reader:
+                    if len(values) > max(xuid_index, match_index):
+                        self.keys.add((values[xuid_index], values[match_index]))
+        self.header_length = len(file_headers)
+        schema = file_headers
+        if os.path.exists(self.schema_filename):
+            with open(self.schema_filename, 'r') as f:
+                saved_columns = json.load(f).get('columns', [])
+            # The sidecar is only trusted if it extends the header actually in the file
+            if saved_columns[:len(file_headers)] == file_headers:
+                schema = saved_columns
+        self.schema.update(schema)
+
+    @property
+    def columns(self):
+        return self.schema.columns
+
+    def add_column(self, header):
+        return self.schema.add(header)
+
+    def _open(self):
+        new_file = self.header_length == 0
+        self.file = open(self.csv_filename, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(self.columns)
+            self.header_length = len(self.columns)
+
+    def write_rows(self, rows, row_headers=()):
+        """Append rows, skipping (player_xuid, match_id) pairs already in the file"""
+        schema_changed = self.schema.update(row_headers)
+        new_rows = []
+        for row in rows:
+            key = (str(row.get('player_xuid')), str(row.get('match_id')))
+            if key in self.keys:
+                continue
+            self.keys.add(key)
+            schema_changed = self.schema.update(row) or schema_changed
+            new_rows.append(row)
+        if not new_rows:
+            return 0
+        if self.file is None:
+            self._open()
+        self.writer.writerows(map(self.schema.values, new_rows))
+        self.file.flush()
+        self.rows_written += len(new_rows)
+        if schema_changed or len(self.columns) > self.header_length:
+            self._save_schema()
+        return len(new_rows)
+
+    def _save_schema(self):
+        temp_file = f"{self.schema_filename}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump({'columns': self.columns}, f)
+        os.replace(temp_file, self.schema_filename)
+
+    def sync(self):
+        """Make everything written so far durable, e.g. before saving a checkpoint"""
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def flush(self):
+        """Make written rows durable and bring the header up to date, for writers that stay open"""
+        self.sync()
+        if self.needs_compaction():
+            self.compact()
+
+    def needs_compaction(self):
+        return 0 < self.header_length < len(self.columns)
+
+    def compact(self):
+        """Rewrite the header with the full schema and pad rows written before new columns"""
+        self._close_file()
+        temp_file = f"{self.csv_filename}.tmp"
+        # Rows are copied as text with the padding for their width appended, so only
+        # the added columns get written rather than every cell being re-encoded
+        padding = {}
+        with open(self.csv_filename, 'r', newline='', encoding='utf-8') as source, \
+             open(temp_file, 'w', newline='', encoding='utf-8') as target:
+            next(source, None)
+            csv.writer(target).writerow(self.columns)
+            for line in source:
+                if not line.rstrip('\r\n'):
+                    continue
+                if '"' in line:
+                    # Quoted fields can hold commas and newlines, so these rows are parsed
+                    more = ''
+                    while line.count('"') % 2 and more is not None:
+                        more = next(source, None)
+                        line += more or ''
+                    width = len(next(csv.reader(io.StringIO(line)), []))
+                else:
+                    width = line.count(',') + 1
+                line = line.rstrip('\r\n')
+                if width not in padding:
+                    padding[width] = self._padding(width)
+                target.write(line + padding[width] + '\r\n')
+        os.replace(temp_file, self.csv_filename)
+        self.header_length = len(self.columns)
+        self._save_schema()
+
+    def _padding(self, width):
+        # The defaults for the columns after width, as CSV text
+        text = io.StringIO()
+        csv.writer(text).writerow(self.schema.defaults[width:])
+        return ',' + text.getvalue().rstrip('\r\n') if width < len(self.columns) else ''
+
+    def _close_file(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+            self.writer = None
+
+    def close(self):
+        """Close the file, compacting first if columns were added since the header was written"""
+        self._close_file()
+        if self.needs_compaction():
+            self.compact()
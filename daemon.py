@@ -0,0 +1,118 @@
+import time
+import signal
+import asyncio
+import instrumentation
+from instrumentation import RUN_REPORT_FILE
+from stats import (
+    PLAYERS, DEFAULT_MAX_IN_FLIGHT, METADATA_CACHE_FILE, RESPONSE_CACHE_FILE, SYNC_STATE_FILE,
+    clean_xuid, open_halo_client, get_medal_metadata, fetch_new_player_history, group_matches,
+    advance_high_water_mark, load_sync_state, save_sync_state, open_writers, skip_written_matches,
+    add_processed_matches, flush_writers, process_matches
+)
+
+# Seconds between history polls for a player who just played
+POLL_INTERVAL = 30
+# Idle players are polled less and less often, up to this many seconds apart
+MAX_IDLE_INTERVAL = 5 * 60
+IDLE_BACKOFF_FACTOR = 2
+# New matches taken per player per poll; more than this means a gap, as in incremental runs
+MAX_NEW_MATCHES = 25
+# Port for the Prometheus /metrics endpoint; None leaves it off
+METRICS_PORT = None
+
+def next_interval(interval, found_new_matches, poll_interval=POLL_INTERVAL, max_idle_interval=MAX_IDLE_INTERVAL):
+    """Poll again soon after a new match, back off while a player stays idle"""
+    if found_new_matches:
+        return poll_interval
+    return min(max_idle_interval, interval * IDLE_BACKOFF_FACTOR)
+
+async def run_daemon(match_type='all', save_to_csv=True, csv_filename='halo_multi_player_stats.csv', parquet_dir=None, sqlite_file=None,
+                     poll_interval=POLL_INTERVAL, max_idle_interval=MAX_IDLE_INTERVAL, max_new_matches=MAX_NEW_MATCHES,
+                     max_in_flight=DEFAULT_MAX_IN_FLIGHT, metadata_cache_file=METADATA_CACHE_FILE,
+                     response_cache_file=RESPONSE_CACHE_FILE, sync_state_file=SYNC_STATE_FILE, metrics_port=METRICS_PORT,
+                     report_file=RUN_REPORT_FILE, aggregate_file=None, roster_file=None):
+    """Poll every player's history and write new matches until stopped with Ctrl+C or SIGTERM"""
+    # Metrics accumulate for the life of the daemon; report_file is rewritten after every poll
+    instrumentation.reset()
+    metrics_server = await instrumentation.start_metrics_server(metrics_port) if metrics_port else None
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(stop_signal, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    writers = open_writers(save_to_csv, csv_filename, parquet_dir, sqlite_file, aggregate_file)
+    sync_state = load_sync_state(sync_state_file)
+    intervals = {clean_xuid(player["xuid"]): poll_interval for player in PLAYERS}
+    next_poll = {clean_xuid(player["xuid"]): 0 for player in PLAYERS}
+    try:
+        # The session, tokens and metadata caches stay warm for the life of the daemon
+        async with open_halo_client(metadata_cache_file, response_cache_file, roster_file=roster_file) as client:
+            medal_names = await get_medal_metadata(client)
+            semaphore = asyncio.Semaphore(max_in_flight)
+            while not stop.is_set():
+                now = time.monotonic()
+                due_players = [player for player in PLAYERS if next_poll[clean_xuid(player["xuid"])] <= now]
+                if due_players:
+                    new_player_matches = await asyncio.gather(*[
+                        fetch_new_player_history(
+                            client,
+                            player,
+                            match_type,
+                            sync_state.get(clean_xuid(player["xuid"])),
+                            max_new_matches,
+                            semaphore
+                        )
+                        for player in due_players
+                    ])
+                    processed_match_ids = {}
+
+                    def write_rows(match_results):
+                        for _, _, match_row, row_headers in match_results:
+                            processed_match_ids.setdefault(str(match_row['player_xuid']), set()).add(str(match_row['match_id']))
+                            with instrumentation.stage('write'):
+                                for writer in writers:
+                                    writer.write_rows([match_row], row_headers)
+
+                    player_histories = [[match_id for match_id, _ in new_matches] for new_matches in new_player_matches]
+                    match_players, written_keys = skip_written_matches(group_matches(due_players, player_histories), writers)
+                    if match_players:
+                        # CSR moves after every match, so it is only cached within one poll
+                        await process_matches(client, due_players, match_players, medal_names, {}, semaphore, write_rows)
+                        await flush_writers(writers)
+                    add_processed_matches(processed_match_ids, written_keys)
+                    for player, new_matches in zip(due_players, new_player_matches):
+                        player_xuid = clean_xuid(player["xuid"])
+                        high_water_mark = advance_high_water_mark(sync_state.get(player_xuid), new_matches, processed_match_ids.get(player_xuid, set()))
+                        if high_water_mark:
+                            sync_state[player_xuid] = high_water_mark
+                        intervals[player_xuid] = next_interval(intervals[player_xuid], bool(new_matches), poll_interval, max_idle_interval)
+                        next_poll[player_xuid] = time.monotonic() + intervals[player_xuid]
+                        if new_matches:
+                            print(f"{player['gamertag']}: {len(processed_match_ids.get(player_xuid, ()))} new matches")
+                    if writers:
+                        save_sync_state(sync_state, sync_state_file)
+                    if report_file:
+                        instrumentation.metrics.write_report(report_file)
+                wait = max(0, min(next_poll.values()) - time.monotonic())
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        for writer in writers:
+            writer.close()
+        if report_file:
+            instrumentation.metrics.write_report(report_file)
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(run_daemon(
+        match_type='all',
+        csv_filename='halo_multi_player_stats.csv',
+        poll_interval=POLL_INTERVAL,
+        max_idle_interval=MAX_IDLE_INTERVAL,
+        metrics_port=METRICS_PORT
+    ))
@@ -0,0 +1,118 @@
+from functools import lru_cache
+
+# Attributes tried, in order, for the display name of a map, playlist or game variant
+NAME_ATTRS = ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']
+
+# Mode-specific stats that are None in a response are written as 0 if the column looks numeric
+NUMERIC_STAT_SUFFIXES = ('_count', '_kills', '_score', '_ticks', '_captures', '_defusals',
+                         '_plants', '_returns', '_steals', '_grabs', '_secures', '_denied',
+                         '_survived', '_remaining', '_assists', '_executions', '_pick_ups',
+                         '_detonations')
+NUMERIC_STAT_PREFIXES = ('time_', 'damage_')
+
+GAME_MODE_DEFAULTS = {
+    "bomb_stats": ["bomb_carriers_killed", "bomb_defusals", "bomb_defusers_killed",
+                  "bomb_detonations", "bomb_pick_ups", "bomb_plants", "bomb_returns",
+                  "kills_as_bomb_carrier", "time_as_bomb_carrier"],
+    "capture_the_flag_stats": ["flag_capture_assists", "flag_captures", "flag_carriers_killed",
+                              "flag_grabs", "flag_returners_killed", "flag_returns",
+                              "flag_secures", "flag_steals", "kills_as_flag_carrier",
+                              "kills_as_flag_returner", "time_as_flag_carrier"],
+    "elimination_stats": ["allies_revived", "elimination_assists", "eliminations",
+                        "enemy_revives_denied", "executions", "kills_as_last_player_standing",
+                        "last_players_standing_killed", "rounds_survived",
+                        "times_revived_by_ally", "lives_remaining", "elimination_order"],
+    "oddball_stats": ["kills_as_skull_carrier", "longest_time_as_skull_carrier",
+                    "skull_carriers_killed", "skull_grabs", "time_as_skull_carrier",
+                    "skull_scoring_ticks"],
+    "zones_stats": ["zone_captures", "zone_defensive_kills", "zone_offensive_kills",
+                  "zone_secures", "total_zone_occupation_time", "zone_scoring_ticks",
+                  "stronghold_captures", "stronghold_defensive_kills",
+                  "stronghold_offensive_kills", "stronghold_secures",
+                  "stronghold_occupation_time", "stronghold_scoring_ticks"]
+}
+
+# Game type name fragments that mark a mode's stat category as relevant
+GAME_MODE_TERMS = [
+    ("capture_the_flag_stats", ["ctf", "flag", "capture the flag"]),
+    ("bomb_stats", ["bomb", "assault"]),
+    ("elimination_stats", ["elim", "elimination", "attrition"]),
+    ("oddball_stats", ["oddball", "ball"]),
+    ("zones_stats", ["zone", "stronghold", "koth", "king", "control"])
+]
+
+# Response models are frozen pydantic models, so every instance of a type has the same
+# fields; everything below is worked out from the first instance of each type and reused.
+_field_names = {}
+_name_attrs = {}
+_core_plans = {}
+_category_plans = {}
+
+
+def field_names(obj):
+    """Public attribute names of obj, in definition order"""
+    names = _field_names.get(type(obj))
+    if names is None:
+        names = tuple(name for name in vars(obj) if not name.startswith('_'))
+        _field_names[type(obj)] = names
+    return names
+
+
+def name_attr(obj):
+    """The first of NAME_ATTRS that obj has, or None"""
+    obj_type = type(obj)
+    if obj_type not in _name_attrs:
+        _name_attrs[obj_type] = next((attr for attr in NAME_ATTRS if hasattr(obj, attr)), None)
+    return _name_attrs[obj_type]
+
+
+def core_plan(core):
+    """(stat names, where kd comes from) for a core_stats type"""
+    plan = _core_plans.get(type(core))
+    if plan is None:
+        if hasattr(core, 'kd'):
+            kd_source = 'kd'
+        elif hasattr(core, 'kdr'):
+            kd_source = 'kdr'
+        elif hasattr(core, 'kills') and hasattr(core, 'deaths'):
+            kd_source = 'ratio'
+        else:
+            kd_source = None
+        plan = (field_names(core), kd_source)
+        _core_plans[type(core)] = plan
+    return plan
+
+
+def category_plan(category, category_stats):
+    """(attribute, column, value when None) for each stat in a mode-specific category"""
+    key = (category, type(category_stats))
+    plan = _category_plans.get(key)
+    if plan is None:
+        plan = []
+        for stat_name in field_names(category_stats):
+            column_name = f"{category}_{stat_name}"
+            numeric = column_name.endswith(NUMERIC_STAT_SUFFIXES) or column_name.startswith(NUMERIC_STAT_PREFIXES)
+            plan.append((stat_name, column_name, 0 if numeric else ''))
+        plan = tuple(plan)
+        _category_plans[key] = plan
+    return plan
+
+
+@lru_cache(maxsize=1024)
+def mode_default_columns(game_type, stat_categories):
+    """Columns defaulted to 0 for a game type, given the stat categories its response has"""
+    relevant_categories = []
+    game_type_lower = game_type.lower()
+    for category, terms in GAME_MODE_TERMS:
+        if any(term in game_type_lower for term in terms):
+            relevant_categories.append(category)
+    for category in stat_categories:
+        if category in GAME_MODE_DEFAULTS and category not in relevant_categories:
+            relevant_categories.append(category)
+    if not relevant_categories:
+        relevant_categories = list(GAME_MODE_DEFAULTS.keys())
+    return tuple(
+        f"{category}_{stat_name}"
+        for category in relevant_categories if category in GAME_MODE_DEFAULTS
+        for stat_name in GAME_MODE_DEFAULTS[category]
+    )
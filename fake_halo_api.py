@@ -0,0 +1,311 @@
+import uuid
+import random
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+from spnkr.models.refdata import MedalNameId, PersonalScoreNameId
+from response_cache import ResponseCache
+
+FAKE_API_HOST = '127.0.0.1'
+# Seconds added to every response, plus up to this much random jitter on top
+DEFAULT_LATENCY = 0.05
+DEFAULT_LATENCY_JITTER = 0.02
+# Retry-After sent with an injected 429
+THROTTLE_RETRY_AFTER = 1
+# Players in a synthetic match besides the tracked ones
+OTHER_PLAYERS_PER_MATCH = 6
+# Chance each tracked player was in any given synthetic match
+SQUAD_RATE = 0.8
+HISTORY_PAGE_SIZE = 25
+MEDALS = list(MedalNameId)[:40]
+PERSONAL_SCORES = list(PersonalScoreNameId)[:5]
+
+
+def _asset_ref(kind, asset_id, version_id):
+    return {"AssetKind": kind, "AssetId": str(asset_id), "VersionId": str(version_id)}
+
+
+def _ugc_asset(asset_id, version_id, name):
+    return {
+        "AssetId": str(asset_id), "VersionId": str(version_id), "PublicName": name, "Description": "",
+        "Files": {
+            "Prefix": "", "FileRelativePaths": [],
+            "PrefixEndpoint": {
+                "AuthorityId": "", "Path": "", "QueryString": None, "RetryPolicyId": "", "TopicName": "",
+                "AcknowledgementTypeId": 0, "AuthenticationLifetimeExtensionSupported": False, "ClearanceAware": False
+            }
+        },
+        "Contributors": [], "AssetHome": 1,
+        "AssetStats": {
+            "PlaysRecent": 0, "PlaysAllTime": 0, "Favorites": 0, "Likes": 0, "Bookmarks": 0,
+            "ParentAssetCount": 0, "AverageRating": None, "NumberOfRatings": 0
+        },
+        "InspectionResult": 0, "CloneBehavior": 0, "Order": 0
+    }
+
+
+def asset_payload(asset_type, asset_id, version_id):
+    """Discovery UGC response for a map, playlist or game variant"""
+    if asset_type == 'maps':
+        payload = _ugc_asset(asset_id, version_id, f"Map {str(asset_id)[:4]}")
+        payload.update({"CustomData": {"NumOfObjectsOnMap": 1, "TagLevelId": 1, "IsBaked": True, "HasNodeGraph": False},
+                        "Tags": [], "PrefabLinks": None})
+    elif asset_type == 'playlists':
+        payload = _ugc_asset(asset_id, version_id, f"Playlist {str(asset_id)[:4]}")
+        payload.update({"CustomData": {
+            "PlaylistEntries": [], "Strategy": 0, "MinTeams": 2, "MinTeamSize": 4, "MaxTeams": 2, "MaxTeamSize": 4,
+            "MaxTeamImbalance": 0, "MaxSplitscreenPlayersAllowed": 1, "AllowFriendJoinInProgress": False,
+            "AllowMatchmakingJoinInProgress": False, "AllowBotJoinInProgress": False, "ExitExperienceDurationSec": 0,
+            "FireteamLeaderKickAllowed": False, "DisableMidgameChat": False, "AllowedDeviceInputs": [],
+            "BotDifficulty": 0, "MinFireteamSize": 1, "MaxFireteamSize": 4
+        }, "Tags": [], "RotationEntries": []})
+    else:
+        payload = _ugc_asset(asset_id, version_id, f"Slayer {str(asset_id)[:4]}")
+        payload.update({"CustomData": {"KeyValues": {}}, "Tags": [],
+                        "EngineGameVariantLink": _ugc_asset(asset_id, version_id, "Engine")})
+    return payload
+
+
+def csr_payload(value):
+    return {"Value": value, "MeasurementMatchesRemaining": 0, "Tier": "Diamond", "TierStart": 1300, "SubTier": 2,
+            "NextTier": "Diamond", "NextTierStart": 1350, "NextSubTier": 3, "InitialMeasurementMatches": 5}
+
+
+def medal_metadata_payload():
+    return {
+        "difficulties": ["normal"], "types": ["spree"],
+        "sprites": {size: {"path": "", "columns": 1, "size": 1} for size in ("small", "medium", "extra-large")},
+        "medals": [{
+            "nameId": int(medal), "name": {"value": medal._display_name, "translations": {}},
+            "description": {"value": "", "translations": {}}, "spriteIndex": 0, "sortingWeight": 0,
+            "difficultyIndex": 0, "typeIndex": 0, "personalScore": 0
+        } for medal in MEDALS]
+    }
+
+
+def _core_stats(rng):
+    kills, deaths = rng.randint(0, 30), rng.randint(0, 30)
+    return {
+        "Score": rng.randint(0, 5000), "PersonalScore": rng.randint(0, 5000), "RoundsWon": 1, "RoundsLost": 0,
+        "RoundsTied": 0, "Kills": kills, "Deaths": deaths, "Assists": rng.randint(0, 15), "Suicides": 0,
+        "Betrayals": 0, "GrenadeKills": rng.randint(0, 3), "HeadshotKills": rng.randint(0, 10),
+        "MeleeKills": rng.randint(0, 3), "PowerWeaponKills": 0, "ShotsFired": 300, "ShotsHit": 150,
+        "Accuracy": round(rng.random() * 100, 2), "DamageDealt": rng.randint(1000, 5000),
+        "DamageTaken": rng.randint(1000, 5000), "CalloutAssists": 2, "VehicleDestroys": 0, "DriverAssists": 0,
+        "Hijacks": 0, "EmpAssists": 0, "MaxKillingSpree": rng.randint(0, 8),
+        "Medals": [{"NameId": int(medal), "Count": rng.randint(1, 3), "TotalPersonalScoreAwarded": 50}
+                   for medal in rng.sample(MEDALS, 4)],
+        "PersonalScores": [{"NameId": int(score), "Count": 1, "TotalPersonalScoreAwarded": 10}
+                           for score in PERSONAL_SCORES[:2]],
+        "Spawns": 10, "ObjectivesCompleted": 0, "KDA": kills - deaths, "AverageLifeDuration": "PT30S"
+    }
+
+
+def match_stats_payload(rng, match_id, start_time, xuids, assets):
+    """Synthetic match stats for xuids, alternating them between two teams"""
+    map_asset, playlist_asset, variant_asset = assets
+    players = []
+    for i, xuid in enumerate(xuids):
+        team_id = i % 2
+        player_stats = {"CoreStats": _core_stats(rng), "PvpStats": {"Kills": 1, "Deaths": 1, "Assists": 1, "KDA": 1.0}}
+        if rng.random() < 0.5:
+            player_stats["OddballStats"] = {
+                "KillsAsSkullCarrier": 1, "LongestTimeAsSkullCarrier": "PT10S", "SkullCarriersKilled": 1,
+                "SkullGrabs": 2, "TimeAsSkullCarrier": "PT20S", "SkullScoringTicks": 5
+            }
+        players.append({
+            "PlayerId": f"xuid({xuid})", "PlayerType": 1, "BotAttributes": None, "LastTeamId": team_id,
+            "Outcome": 2 if team_id == 0 else 3, "Rank": i + 1,
+            "ParticipationInfo": {
+                "FirstJoinedTime": start_time.isoformat(), "LastLeaveTime": None, "PresentAtBeginning": True,
+                "JoinedInProgress": False, "LeftInProgress": False, "PresentAtCompletion": True,
+                "TimePlayed": "PT12M", "ConfirmedParticipation": None
+            },
+            "PlayerTeamStats": [{"TeamId": team_id, "Stats": player_stats}]
+        })
+    return {
+        "MatchId": match_id,
+        "MatchInfo": {
+            "StartTime": start_time.isoformat(), "EndTime": (start_time + timedelta(minutes=12)).isoformat(),
+            "Duration": "PT12M", "LifecycleMode": 3, "GameVariantCategory": 6, "LevelId": str(uuid.UUID(int=1)),
+            "MapVariant": _asset_ref(2, *map_asset), "UgcGameVariant": _asset_ref(6, *variant_asset),
+            "ClearanceId": str(uuid.UUID(int=2)), "Playlist": _asset_ref(3, *playlist_asset),
+            "PlaylistExperience": 2, "PlaylistMapModePair": None, "SeasonId": "Csr/Seasons/CsrSeason1.json",
+            "PlayableDuration": "PT12M", "TeamsEnabled": True, "TeamScoringEnabled": True, "GameplayInteraction": 1
+        },
+        "Teams": [{"TeamId": team_id, "Outcome": 2 if team_id == 0 else 3, "Rank": team_id + 1,
+                   "Stats": {"CoreStats": _core_stats(rng)}} for team_id in (0, 1)],
+        "Players": players
+    }
+
+
+def match_skill_payload(xuids):
+    return {"Value": [{
+        "Id": f"xuid({xuid})", "ResultCode": 0,
+        "Result": {
+            "TeamMmr": 1400.5, "RankRecap": {"PreMatchCsr": csr_payload(1400), "PostMatchCsr": csr_payload(1410)},
+            "StatPerformances": None, "TeamId": 0, "TeamMmrs": {"0": 1400.5, "1": 1390.0},
+            "RankedRewards": None, "Counterfactuals": None
+        }
+    } for xuid in xuids]}
+
+
+def playlist_csr_payload(xuids):
+    return {"Value": [{
+        "Id": f"xuid({xuid})", "ResultCode": 0,
+        "Result": {"Current": csr_payload(1400 + int(xuid) % 97), "SeasonMax": csr_payload(1500), "AllTimeMax": csr_payload(1600)}
+    } for xuid in xuids]}
+
+
+def _xuid(value):
+    value = str(value)
+    if value.startswith('xuid(') and value.endswith(')'):
+        return value[5:-1]
+    return value
+
+
+class FakeHaloApi:
+    """Local stand-in for the Halo Infinite API, for benchmarks.
+
+    Serves match history, match stats, skill, playlist CSR, medal metadata and
+    discovery UGC for a set of players, from synthetic matches or from the raw
+    responses in a response cache. Latency, 5xx errors and 429s are injected per
+    request. Point spnkr's service hosts at base_url to use it.
+    """
+
+    def __init__(self, xuids, depth, latency=DEFAULT_LATENCY, latency_jitter=DEFAULT_LATENCY_JITTER,
+                 error_rate=0.0, throttle_rate=0.0, response_cache_file=None, seed=1):
+        self.xuids = [str(xuid) for xuid in xuids]
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.matches = {}
+        self.skills = {}
+        self.histories = {xuid: [] for xuid in self.xuids}
+        self.requests = Counter()
+        self.injected = Counter()
+        self.runner = None
+        self.base_url = None
+        if response_cache_file:
+            self._load_recorded(response_cache_file, depth)
+        else:
+            self._generate(depth)
+
+    def _generate(self, depth):
+        rng = random.Random(self.rng.random())
+        new_id = lambda: str(uuid.UUID(int=rng.getrandbits(128)))
+        asset_sets = [tuple((new_id(), new_id()) for _ in range(3)) for _ in range(4)]
+        first_start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        match_number = 0
+        # Matches are added newest first until every player has depth of them
+        while self.xuids and min(len(history) for history in self.histories.values()) < depth:
+            match_id = new_id()
+            present = [xuid for xuid in self.xuids if len(self.histories[xuid]) < depth and rng.random() < SQUAD_RATE]
+            if not present:
+                continue
+            roster = present + [str(2535400000000000 + rng.randint(0, 10 ** 6)) for _ in range(OTHER_PLAYERS_PER_MATCH)]
+            start_time = first_start - timedelta(minutes=15 * match_number)
+            self.matches[match_id] = match_stats_payload(rng, match_id, start_time, roster, rng.choice(asset_sets))
+            for xuid in present:
+                self.histories[xuid].append(match_id)
+            match_number += 1
+
+    def _load_recorded(self, response_cache_file, depth):
+        response_store = ResponseCache(response_cache_file)
+        try:
+            for match_id in response_store.keys('match_stats'):
+                payload = response_store.get('match_stats', match_id)
+                if payload is None:
+                    continue
+                self.matches[match_id] = payload
+                skill = response_store.get('match_skill', match_id)
+                if skill is not None:
+                    self.skills[match_id] = skill
+        finally:
+            response_store.close()
+        newest_first = sorted(self.matches, key=lambda match_id: self.matches[match_id]["MatchInfo"]["StartTime"], reverse=True)
+        for match_id in newest_first:
+            for player in self.matches[match_id]["Players"]:
+                xuid = _xuid(player["PlayerId"])
+                if xuid in self.histories and len(self.histories[xuid]) < depth:
+                    self.histories[xuid].append(match_id)
+
+    @web.middleware
+    async def _inject(self, request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else 'unknown'
+        self.requests[route] += 1
+        await asyncio.sleep(self.latency + self.rng.random() * self.latency_jitter)
+        roll = self.rng.random()
+        if roll < self.throttle_rate:
+            self.injected['429'] += 1
+            return web.Response(status=429, headers={'Retry-After': str(THROTTLE_RETRY_AFTER)})
+        if roll < self.throttle_rate + self.error_rate:
+            self.injected['503'] += 1
+            return web.Response(status=503)
+        return await handler(request)
+
+    async def _match_history(self, request):
+        history = self.histories.get(_xuid(request.match_info['player']), [])
+        start = int(request.query.get('start', 0))
+        count = min(int(request.query.get('count', HISTORY_PAGE_SIZE)), HISTORY_PAGE_SIZE)
+        page = history[start:start + count]
+        return web.json_response({
+            "Start": start, "Count": count, "ResultCount": len(page),
+            "Results": [{
+                "MatchId": match_id, "MatchInfo": self.matches[match_id]["MatchInfo"], "LastTeamId": 0,
+                "Outcome": 2, "Rank": 1, "PresentAtEndOfMatch": True
+            } for match_id in page]
+        })
+
+    async def _match_count(self, request):
+        played = len(self.histories.get(_xuid(request.match_info['player']), []))
+        return web.json_response({"CustomMatchesPlayedCount": 0, "MatchesPlayedCount": played,
+                                  "MatchmadeMatchesPlayedCount": played, "LocalMatchesPlayedCount": 0})
+
+    async def _match_stats(self, request):
+        payload = self.matches.get(request.match_info['match_id'])
+        if payload is None:
+            return web.Response(status=404)
+        return web.json_response(payload)
+
+    async def _match_skill(self, request):
+        xuids = [_xuid(player) for player in request.query.getall('players', [])]
+        recorded = self.skills.get(request.match_info['match_id'])
+        if recorded is not None:
+            return web.json_response({"Value": [entry for entry in recorded.get("Value", []) if _xuid(entry.get("Id")) in xuids]})
+        return web.json_response(match_skill_payload(xuids))
+
+    async def _playlist_csr(self, request):
+        return web.json_response(playlist_csr_payload([_xuid(player) for player in request.query.getall('players', [])]))
+
+    async def _medal_metadata(self, request):
+        return web.json_response(medal_metadata_payload())
+
+    async def _asset(self, request):
+        return web.json_response(asset_payload(request.match_info['asset_type'], request.match_info['asset_id'], request.match_info['version_id']))
+
+    async def start(self, port=0):
+        """Start serving on localhost and return the base URL to use as every service's host"""
+        app = web.Application(middlewares=[self._inject])
+        app.router.add_get('/hi/players/{player}/matches', self._match_history)
+        app.router.add_get('/hi/players/{player}/matches/count', self._match_count)
+        app.router.add_get('/hi/matches/{match_id}/stats', self._match_stats)
+        app.router.add_get('/hi/matches/{match_id}/skill', self._match_skill)
+        app.router.add_get('/hi/playlist/{playlist_id}/csrs', self._playlist_csr)
+        app.router.add_get('/hi/Waypoint/file/medals/metadata.json', self._medal_metadata)
+        app.router.add_get('/hi/{asset_type}/{asset_id}/versions/{version_id}', self._asset)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, FAKE_API_HOST, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://{FAKE_API_HOST}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
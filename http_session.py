@@ -0,0 +1,97 @@
+import time
+from collections import deque
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+
+# The Halo API is spread over a handful of hosts (stats, skill, gamecms, discovery)
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_CONNECTIONS_PER_HOST = 8
+# Idle connections are kept open this long so later calls skip the TCP/TLS handshake
+HTTP_KEEPALIVE_SECONDS = 30
+HTTP_DNS_CACHE_SECONDS = 300
+HTTP_TIMEOUT_SECONDS = 60
+HTTP_CONNECT_TIMEOUT_SECONDS = 10
+HTTP_READ_TIMEOUT_SECONDS = 30
+# Latency percentiles cover this many of the most recent requests, so a daemon's stats stay bounded
+HTTP_LATENCY_SAMPLES = 5000
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list, or 0 if it is empty"""
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class ConnectionStats:
+    """Counts requests, new vs reused connections and request latency per host via aiohttp tracing"""
+
+    def __init__(self, latency_samples=HTTP_LATENCY_SAMPLES):
+        self.hosts = {}
+        self.latencies = deque(maxlen=latency_samples)
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_request_end.append(self._on_request_end)
+        self.trace_config.on_request_exception.append(self._on_request_end)
+        self.trace_config.on_connection_create_end.append(self._on_connection_create)
+        self.trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        self.trace_config.on_dns_cache_hit.append(self._on_dns_hit)
+        self.trace_config.on_dns_cache_miss.append(self._on_dns_miss)
+
+    def _host(self, host):
+        return self.hosts.setdefault(host, {'requests': 0, 'new': 0, 'reused': 0})
+
+    async def _on_request_start(self, session, context, params):
+        context.host = params.url.host
+        context.started = time.monotonic()
+        self._host(context.host)['requests'] += 1
+
+    async def _on_request_end(self, session, context, params):
+        # Time to response headers, including any wait for a free connection
+        self.latencies.append(time.monotonic() - context.started)
+
+    async def _on_connection_create(self, session, context, params):
+        self._host(getattr(context, 'host', None))['new'] += 1
+
+    async def _on_connection_reuse(self, session, context, params):
+        self._host(getattr(context, 'host', None))['reused'] += 1
+
+    async def _on_dns_hit(self, session, context, params):
+        self.dns_hits += 1
+
+    async def _on_dns_miss(self, session, context, params):
+        self.dns_misses += 1
+
+    def stats(self):
+        hosts = {}
+        for host, counts in self.hosts.items():
+            connections = counts['new'] + counts['reused']
+            hosts[host] = dict(counts, reuse_rate=round(counts['reused'] / connections, 3) if connections else 0)
+        latencies = sorted(self.latencies)
+        return {
+            'hosts': hosts,
+            'dns_cache_hits': self.dns_hits,
+            'dns_cache_misses': self.dns_misses,
+            'latency_p50': round(percentile(latencies, 0.5), 4),
+            'latency_p99': round(percentile(latencies, 0.99), 4)
+        }
+
+
+def create_session(connection_stats=None, max_connections=HTTP_MAX_CONNECTIONS,
+                   max_connections_per_host=HTTP_MAX_CONNECTIONS_PER_HOST):
+    """ClientSession with a bounded, keep-alive connection pool and cached DNS"""
+    connector = TCPConnector(
+        limit=max_connections,
+        limit_per_host=max_connections_per_host,
+        keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_CACHE_SECONDS
+    )
+    timeout = ClientTimeout(
+        total=HTTP_TIMEOUT_SECONDS,
+        connect=HTTP_CONNECT_TIMEOUT_SECONDS,
+        sock_read=HTTP_READ_TIMEOUT_SECONDS
+    )
+    trace_configs = [connection_stats.trace_config] if connection_stats is not None else None
+    return ClientSession(connector=connector, timeout=timeout, trace_configs=trace_configs)
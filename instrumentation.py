@@ -0,0 +1,190 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from aiohttp import web
+
+RUN_REPORT_FILE = 'halo_run_report.json'
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_PREFIX = 'halo'
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, plus count and total"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations"""
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'seconds': round(self.total, 4),
+            'mean': round(self.total / self.count, 4) if self.count else 0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+        }
+
+
+class RunMetrics:
+    """Everything recorded about one run (or the life of a daemon).
+
+    Stages are timed with stage(), API calls per endpoint with observe(), and
+    exceptions that the pipeline deliberately carries on past with error().
+    Rate limiter, cache, token and connection counters are pulled from the
+    objects that own them through add_source().
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.endpoints = {}
+        self.errors = {}
+        self.sources = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._histogram(self.stages, name).observe(time.perf_counter() - started)
+
+    def observe(self, endpoint, seconds):
+        self._histogram(self.endpoints, endpoint).observe(seconds)
+
+    def error(self, stage_name, exception):
+        key = (stage_name, type(exception).__name__)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def _histogram(self, histograms, name):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        return histogram
+
+    def add_source(self, name, stats):
+        """Include stats() (a dict of counters) in every report"""
+        self.sources[name] = stats
+
+    def close_source(self, name):
+        # Keep the final numbers once the object behind them is closed
+        stats = self.sources.get(name)
+        if callable(stats):
+            self.sources[name] = stats()
+
+    def source_stats(self):
+        return {name: stats() if callable(stats) else stats for name, stats in self.sources.items()}
+
+    def report(self):
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'elapsed': round(time.time() - self.started, 3),
+            'stages': {name: histogram.summary() for name, histogram in self.stages.items()},
+            'endpoints': {name: histogram.summary() for name, histogram in self.endpoints.items()},
+            'errors': [{'stage': stage, 'error': error, 'count': count} for (stage, error), count in sorted(self.errors.items())],
+            'sources': self.source_stats()
+        }
+
+    def write_report(self, path=RUN_REPORT_FILE):
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        os.replace(temp_file, path)
+
+    def prometheus_text(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric, label, histograms in (('stage_seconds', 'stage', self.stages), ('api_request_seconds', 'endpoint', self.endpoints)):
+            name = f"{METRICS_PREFIX}_{metric}"
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.total}')
+                lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+        name = f"{METRICS_PREFIX}_errors_total"
+        lines.append(f"# TYPE {name} counter")
+        for (stage, error), count in sorted(self.errors.items()):
+            lines.append(f'{name}{{stage="{stage}",error="{error}"}} {count}')
+        for source, stats in sorted(self.source_stats().items()):
+            for key, value in _numeric_leaves(stats):
+                lines.append(f"{METRICS_PREFIX}_{source}_{key} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _numeric_leaves(stats, prefix=''):
+    # Nested counters such as per-host connection stats are flattened into one metric name
+    for key, value in stats.items():
+        name = ''.join(c if c.isalnum() else '_' for c in f"{prefix}{key}")
+        if isinstance(value, dict):
+            yield from _numeric_leaves(value, f"{name}_")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+# Metrics for the current run, shared by every module in the process
+metrics = RunMetrics()
+
+
+def reset():
+    """Start recording a new run"""
+    global metrics
+    metrics = RunMetrics()
+    return metrics
+
+
+def stage(name):
+    return metrics.stage(name)
+
+
+def observe(endpoint, seconds):
+    metrics.observe(endpoint, seconds)
+
+
+def error(stage_name, exception):
+    metrics.error(stage_name, exception)
+
+
+async def start_metrics_server(port, host='127.0.0.1'):
+    """Serve /metrics (Prometheus text) and /report (JSON); returns the runner to clean up"""
+    async def serve_metrics(request):
+        return web.Response(text=metrics.prometheus_text(), content_type='text/plain')
+
+    async def serve_report(request):
+        return web.json_response(metrics.report(), dumps=lambda data: json.dumps(data, default=str))
+
+    app = web.Application()
+    app.router.add_get('/metrics', serve_metrics)
+    app.router.add_get('/report', serve_report)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
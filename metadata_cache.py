@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import time
+
+METADATA_CACHE_FILE = 'halo_metadata_cache.sqlite'
+# Failed lookups are remembered for a day so a missing asset isn't requested on every run
+NEGATIVE_TTL = 24 * 60 * 60
+# Least recently used entries are evicted beyond this many rows
+MAX_ENTRIES = 20000
+# last_used updates from cache hits are written in batches of this many
+TOUCH_BATCH_SIZE = 500
+
+
+class MetadataCache:
+    """Persistent cache for metadata lookups keyed by kind and asset_id:version_id.
+
+    Every row read (or found missing) is remembered in memory, so repeat lookups,
+    negative entries included, never go back to SQLite. Hits only record last_used
+    in memory; those are written in one batch with the next store, every
+    TOUCH_BATCH_SIZE hits, or on close.
+    """
+
+    def __init__(self, path=METADATA_CACHE_FILE, max_entries=MAX_ENTRIES, negative_ttl=NEGATIVE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = {}
+        self.touched = {}
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS metadata ('
+            'kind TEXT NOT NULL, '
+            'key TEXT NOT NULL, '
+            'value TEXT, '
+            'negative INTEGER NOT NULL DEFAULT 0, '
+            'expires_at REAL, '
+            'last_used REAL NOT NULL, '
+            'PRIMARY KEY (kind, key))'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata (last_used)')
+        self.conn.commit()
+
+    def get(self, kind, key):
+        """Return (found, value, negative) for a cached lookup"""
+        now = time.time()
+        if (kind, key) in self.entries:
+            row = self.entries[(kind, key)]
+        else:
+            row = self.conn.execute(
+                'SELECT value, negative, expires_at FROM metadata WHERE kind = ? AND key = ?',
+                (kind, key)
+            ).fetchone()
+            self.entries[(kind, key)] = row
+        if row is None or (row[2] is not None and row[2] < now):
+            self.misses += 1
+            return False, None, False
+        self.hits += 1
+        self.touched[(kind, key)] = now
+        if len(self.touched) >= TOUCH_BATCH_SIZE:
+            self._write_touches()
+            self.conn.commit()
+        return True, json.loads(row[0]), bool(row[1])
+
+    def set(self, kind, key, value, ttl=None):
+        """Store a lookup result; entries without a ttl never expire"""
+        self._store(kind, key, value, False, ttl)
+
+    def set_negative(self, kind, key, value):
+        """Store a failed lookup's fallback value for negative_ttl seconds"""
+        self._store(kind, key, value, True, self.negative_ttl)
+
+    def _store(self, kind, key, value, negative, ttl):
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        value = json.dumps(value)
+        self.touched.pop((kind, key), None)
+        # Pending hits are written first so eviction sees the real least recently used rows
+        self._write_touches()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO metadata (kind, key, value, negative, expires_at, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+            (kind, key, value, int(negative), expires_at, now)
+        )
+        self.entries[(kind, key)] = (value, int(negative), expires_at)
+        self._evict()
+        self.conn.commit()
+
+    def _write_touches(self):
+        if self.touched:
+            self.conn.executemany(
+                'UPDATE metadata SET last_used = ? WHERE kind = ? AND key = ?',
+                [(last_used, kind, key) for (kind, key), last_used in self.touched.items()]
+            )
+            self.touched = {}
+
+    def _evict(self):
+        count = self.conn.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                'DELETE FROM metadata WHERE rowid IN (SELECT rowid FROM metadata ORDER BY last_used LIMIT ?)',
+                (excess,)
+            )
+            self.evictions += excess
+
+    def stats(self):
+        """Return hit/miss counters for this process"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+        }
+
+    def close(self):
+        self._write_touches()
+        self.conn.commit()
+        self.conn.close()
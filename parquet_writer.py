@@ -0,0 +1,200 @@
+import os
+import json
+import time
+from datetime import datetime, timedelta
+from csv_writer import ColumnSchema, column_type
+from compact_row import RowLayout
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARQUET_DIR = 'halo_multi_player_stats_parquet'
+# Rows buffered for a single player/date partition before a file is written, and
+# the most rows a file is grown to by later flushes
+PARQUET_ROWS_PER_FILE = 5000
+
+
+def convert_value(value, type_name):
+    if value is None or value == '':
+        return None
+    try:
+        if type_name == 'timestamp':
+            return value if isinstance(value, datetime) else datetime.strptime(str(value), '%Y-%m-%d %H:%M:%S')
+        if type_name == 'seconds':
+            if isinstance(value, timedelta):
+                return value.total_seconds()
+            if ':' in str(value):
+                # Durations that were already formatted as H:MM:SS
+                hours, minutes, seconds = str(value).split(':')
+                return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            return float(value)
+        if type_name == 'float':
+            return float(value)
+        if type_name == 'int':
+            return int(value)
+    except Exception:
+        return None
+    return str(value)
+
+
+def arrow_schema(columns, column_types):
+    arrow_types = {
+        'string': pa.string(),
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'seconds': pa.float64(),
+        'timestamp': pa.timestamp('s')
+    }
+    return pa.schema([(header, arrow_types[column_types[header]]) for header in columns])
+
+
+class ParquetWriter:
+    """Writes rows as Parquet files partitioned by player_xuid and date.
+
+    Column order follows the same header list the CSV uses, and each column keeps
+    one type across runs via a _schema.json file in the output directory (ints are
+    widened to floats if a fractional value ever shows up). Each flush appends to the
+    file this run already wrote for a partition, so flushing after every daemon poll
+    doesn't leave a small file per poll.
+    """
+
+    def __init__(self, output_dir=PARQUET_DIR, base_headers=(), rows_per_file=PARQUET_ROWS_PER_FILE):
+        if pa is None:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+        self.output_dir = output_dir
+        self.schema_filename = os.path.join(output_dir, '_schema.json')
+        self.rows_per_file = rows_per_file
+        self.run_id = time.strftime('%Y%m%d%H%M%S')
+        self.file_count = 0
+        self.rows_written = 0
+        self.schema = ColumnSchema()
+        self.column_types = {}
+        self.partitions = {}
+        # (file name, row count) of the file this run last wrote for each partition
+        self.partition_files = {}
+        self.keys = set()
+        if os.path.exists(self.schema_filename):
+            with open(self.schema_filename, 'r') as f:
+                saved = json.load(f)
+            self.schema.update(saved.get('columns', []))
+            self.column_types = saved.get('types', {})
+            self._load_keys()
+        self.schema.update(base_headers)
+        # Buffered rows can add up to a whole run's worth, so they are kept packed
+        self.layout = RowLayout(base_headers)
+
+    @property
+    def columns(self):
+        return self.schema.columns
+
+    def _load_keys(self):
+        # Only the two key columns are read, not the whole dataset
+        try:
+            dataset = ds.dataset(self.output_dir, format='parquet')
+            table = dataset.to_table(columns=['player_xuid', 'match_id'])
+            for player_xuid, match_id in zip(table.column('player_xuid').to_pylist(), table.column('match_id').to_pylist()):
+                self.keys.add((str(player_xuid), str(match_id)))
+        except Exception:
+            pass
+
+    def write_rows(self, rows, row_headers=()):
+        """Buffer rows into their player/date partition, skipping pairs already written"""
+        self.schema.update(row_headers)
+        added = 0
+        for row in rows:
+            key = (str(row.get('player_xuid')), str(row.get('match_id')))
+            if key in self.keys:
+                continue
+            self.keys.add(key)
+            self.schema.update(row)
+            date = str(row.get('date') or '')[:10] or 'unknown'
+            partition = (key[0], date)
+            self.partitions.setdefault(partition, []).append(self.layout.pack(row))
+            if len(self.partitions[partition]) >= self.rows_per_file:
+                self._write_partition(partition)
+            added += 1
+        return added
+
+    def _update_types(self, rows):
+        changed = False
+        for header in self.columns:
+            values = [row[header] for row in rows if header in row]
+            type_name = column_type(header, values)
+            old_type = self.column_types.get(header)
+            # A column only ever widens, from int to float or to seconds
+            if old_type is None or (old_type == 'int' and type_name in ('float', 'seconds')):
+                self.column_types[header] = type_name
+                changed = True
+        if changed:
+            self._save_schema()
+
+    def _write_partition(self, partition):
+        rows = self.partitions.pop(partition, [])
+        if not rows:
+            return
+        self._update_types(rows)
+        arrays = {}
+        for header, default in zip(self.schema.columns, self.schema.defaults):
+            type_name = self.column_types[header]
+            default = convert_value(default, type_name)
+            arrays[header] = [convert_value(row[header], type_name) if header in row else default for row in rows]
+        schema = arrow_schema(self.columns, self.column_types)
+        table = pa.Table.from_pydict(arrays, schema=schema)
+        filename, row_count = self.partition_files.get(partition, (None, 0))
+        if filename is not None and row_count + len(rows) <= self.rows_per_file:
+            # The file is rewritten with the new rows added rather than left as a second small file
+            table = pa.concat_tables([self._conform(pq.ParquetFile(filename).read(), schema), table])
+        else:
+            player_xuid, date = partition
+            directory = os.path.join(self.output_dir, f"player_xuid={player_xuid}", f"date={date}")
+            os.makedirs(directory, exist_ok=True)
+            self.file_count += 1
+            filename = os.path.join(directory, f"part-{self.run_id}-{self.file_count:04d}.parquet")
+        # Files starting with an underscore are skipped by dataset readers until renamed
+        directory, name = os.path.split(filename)
+        temp_file = os.path.join(directory, f"_{name}.tmp")
+        pq.write_table(table, temp_file, compression='zstd')
+        os.replace(temp_file, filename)
+        self.partition_files[partition] = (filename, table.num_rows)
+        self.rows_written += len(rows)
+
+    def _conform(self, table, schema):
+        # Columns added or widened since the file was written
+        arrays = []
+        for field, default in zip(schema, self.schema.defaults):
+            if field.name in table.column_names:
+                arrays.append(table.column(field.name).cast(field.type))
+            else:
+                default = convert_value(default, self.column_types[field.name])
+                arrays.append(pa.array([default] * table.num_rows, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    def _save_schema(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        temp_file = f"{self.schema_filename}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump({'columns': self.columns, 'types': self.column_types}, f)
+        os.replace(temp_file, self.schema_filename)
+
+    def flush(self):
+        """Write every buffered partition out"""
+        for partition in sorted(self.partitions):
+            self._write_partition(partition)
+
+    def close(self):
+        self.flush()
+
+
+def read_parquet_dataset(output_dir=PARQUET_DIR, columns=None, filter=None):
+    """Read selected columns back as one Arrow table with the current column types"""
+    if pa is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    with open(os.path.join(output_dir, '_schema.json'), 'r') as f:
+        saved = json.load(f)
+    # Files written before a column was widened are cast to the current type on read
+    dataset = ds.dataset(output_dir, format='parquet', schema=arrow_schema(saved['columns'], saved['types']))
+    return dataset.to_table(columns=columns, filter=filter)
@@ -0,0 +1,74 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import stats
+from metadata_cache import MetadataCache
+from response_cache import ResponseCache, OfflineClient
+
+# Worker processes default to one per core; parsing is pure CPU once responses are cached
+PARSE_WORKERS = os.cpu_count() or 1
+
+# Per-process state, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(players, medal_names, metadata_cache_file, response_cache_file):
+    # Each worker opens its own read connections to the caches and keeps one event loop
+    stats.metadata_store = MetadataCache(metadata_cache_file) if metadata_cache_file else None
+    stats.response_store = ResponseCache(response_cache_file) if response_cache_file else None
+    _worker['players'] = players
+    _worker['medal_names'] = medal_names
+    _worker['tracked_xuids'] = [stats.clean_xuid(player["xuid"]) for player in players]
+    _worker['client'] = OfflineClient()
+    _worker['csr_cache'] = {}
+    _worker['loop'] = asyncio.new_event_loop()
+
+
+def _process_match_in_worker(match_id, player_numbers):
+    """Parse and flatten one cached match; players are passed by index into the shared list"""
+    players = _worker['players']
+    match_players = [(players[index], match_number) for index, match_number in player_numbers]
+    match_results = _worker['loop'].run_until_complete(stats.process_match(
+        _worker['client'],
+        match_id,
+        match_players,
+        _worker['medal_names'],
+        _worker['csr_cache'],
+        _worker['tracked_xuids']
+    ))
+    player_index = {id(player): index for index, player in enumerate(players)}
+    # Only indices, rows and headers go back; the player dicts are already on the other side
+    return [(player_index[id(player_info)], match_number, match_row, row_headers)
+            for player_info, match_number, match_row, row_headers in match_results]
+
+
+class ParsePool:
+    """Runs process_match for cached matches in worker processes.
+
+    Only for offline work: the workers read responses and metadata straight from
+    the caches and never touch the network. Pass it to process_matches as
+    parse_pool and rows come back in the same order a single process produces.
+    """
+
+    def __init__(self, players, medal_names, metadata_cache_file, response_cache_file, workers=PARSE_WORKERS):
+        self.players = players
+        self.player_index = {id(player): index for index, player in enumerate(players)}
+        self.workers = workers
+        # spawn gives each worker a clean interpreter rather than a copy of the running event loop
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(players, medal_names, metadata_cache_file, response_cache_file)
+        )
+
+    async def process_match(self, match_id, match_players):
+        player_numbers = [(self.player_index[id(player_info)], match_number) for player_info, match_number in match_players]
+        loop = asyncio.get_running_loop()
+        match_results = await loop.run_in_executor(self.executor, _process_match_in_worker, match_id, player_numbers)
+        return [(self.players[index], match_number, match_row, row_headers)
+                for index, match_number, match_row, row_headers in match_results]
+
+    def close(self):
+        self.executor.shutdown()
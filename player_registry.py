@@ -0,0 +1,40 @@
+import os
+import csv
+import json
+
+PLAYER_REGISTRY_FILE = 'halo_players.json'
+
+
+def load_players(path=PLAYER_REGISTRY_FILE, default=()):
+    """Tracked players from a JSON list or a CSV with gamertag and xuid columns.
+
+    Falls back to default when the file doesn't exist. Entries without an xuid
+    are skipped and a repeated xuid keeps its first gamertag.
+    """
+    if not path or not os.path.exists(path):
+        return [dict(player) for player in default]
+    if path.endswith('.csv'):
+        with open(path, 'r', newline='', encoding='utf-8') as csvfile:
+            entries = list(csv.DictReader(csvfile))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = entries.get('players', [])
+    players = []
+    seen = set()
+    for entry in entries:
+        xuid = str(entry.get('xuid') or '').strip()
+        if not xuid or xuid in seen:
+            continue
+        seen.add(xuid)
+        players.append({"gamertag": str(entry.get('gamertag') or xuid).strip(), "xuid": xuid})
+    return players
+
+
+def save_players(players, path=PLAYER_REGISTRY_FILE):
+    """Write the registry as JSON, replacing the old file in one step"""
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump([{"gamertag": player["gamertag"], "xuid": str(player["xuid"])} for player in players], f, indent=4)
+    os.replace(temp_file, path)
@@ -0,0 +1,268 @@
+import time
+import random
+import sqlite3
+import asyncio
+from email.utils import parsedate_to_datetime
+from aiohttp import ClientResponseError, ClientConnectionError
+import instrumentation
+
+# Starting request rate; spnkr's own default is 5 requests/second per service
+INITIAL_REQUESTS_PER_SECOND = 5
+MIN_REQUESTS_PER_SECOND = 0.5
+MAX_REQUESTS_PER_SECOND = 20
+# Requests allowed back to back before the bucket is empty
+BURST = 5
+# The rate is halved on a 429 and creeps back up by this much per successful request
+RATE_DECREASE_FACTOR = 0.5
+RATE_INCREASE_STEP = 0.05
+# 429s arriving within this many seconds of a decrease are treated as the same episode
+DECREASE_COOLDOWN = 1.0
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Request budget shared by worker processes
+RATE_BUDGET_FILE = 'halo_rate_budget.sqlite'
+# Longest the event loop blocks waiting for another process's budget transaction, in
+# milliseconds; past that the grant is retried after BUDGET_LOCK_RETRY seconds
+BUDGET_LOCK_TIMEOUT_MS = 20
+BUDGET_LOCK_RETRY = 0.01
+
+
+def retry_after_seconds(error):
+    """Seconds asked for by a Retry-After header (delta-seconds or HTTP date), or None"""
+    headers = getattr(error, 'headers', None) or {}
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def is_retryable(error):
+    if isinstance(error, ClientResponseError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (ClientConnectionError, asyncio.TimeoutError))
+
+
+class AdaptiveRateLimiter:
+    """Token bucket shared by every API call in the process.
+
+    The refill rate backs off multiplicatively whenever the API answers 429 and
+    recovers additively on success, so it settles just under what the API allows.
+    """
+
+    def __init__(self, rate=INITIAL_REQUESTS_PER_SECOND, min_rate=MIN_REQUESTS_PER_SECOND,
+                 max_rate=MAX_REQUESTS_PER_SECOND, burst=BURST, budget=None):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.lock = asyncio.Lock()
+        # A SharedRateBudget, when set, has to grant every request as well
+        self.budget = budget
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    if self.budget is not None:
+                        await self.budget.acquire()
+                    self.requests += 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + RATE_INCREASE_STEP)
+
+    def on_throttled(self, retry_after=None):
+        self.throttled += 1
+        now = time.monotonic()
+        if now - self.last_decrease >= DECREASE_COOLDOWN:
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE_FACTOR)
+            self.last_decrease = now
+        # Nobody gets a token until the server says it is ready again
+        self.tokens = 0
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+            if self.budget is not None:
+                self.budget.pause(retry_after)
+
+    async def call(self, request):
+        """Run request() under the limiter, retrying throttled and transient failures"""
+        for attempt in range(MAX_ATTEMPTS):
+            await self.acquire()
+            try:
+                result = await request()
+            except Exception as e:
+                if not is_retryable(e) or attempt == MAX_ATTEMPTS - 1:
+                    self.failures += 1
+                    raise
+                retry_after = retry_after_seconds(e)
+                if getattr(e, 'status', None) == 429:
+                    self.on_throttled(retry_after)
+                self.retries += 1
+                # Full jitter keeps concurrent retries from landing at the same moment
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                await asyncio.sleep(max(delay, retry_after or 0))
+                continue
+            self.on_success()
+            return result
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'retries': self.retries,
+            'failures': self.failures,
+            'rate': round(self.rate, 2)
+        }
+
+
+class SharedRateBudget:
+    """Token bucket kept in SQLite, so worker processes draw from one request budget.
+
+    Each process still runs its own AdaptiveRateLimiter; this only caps their
+    combined rate, and a Retry-After seen by one process pauses all of them.
+    Grants run on the event loop, so a locked database is waited out with
+    asyncio.sleep rather than SQLite's blocking busy timeout.
+    """
+
+    def __init__(self, path=RATE_BUDGET_FILE, rate=MAX_REQUESTS_PER_SECOND, burst=BURST):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.granted = 0
+        self.waits = 0
+        self.lock_waits = 0
+        self.paused_until = 0
+        # Autocommit, so each grant is its own BEGIN IMMEDIATE transaction
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS budget ('
+            'name TEXT PRIMARY KEY, '
+            'tokens REAL NOT NULL, '
+            'updated REAL NOT NULL, '
+            'paused_until REAL NOT NULL DEFAULT 0)'
+        )
+        self.conn.execute(
+            "INSERT OR IGNORE INTO budget (name, tokens, updated) VALUES ('api', ?, ?)",
+            (burst, time.time())
+        )
+        self.conn.execute(f'PRAGMA busy_timeout = {BUDGET_LOCK_TIMEOUT_MS}')
+
+    def _take(self):
+        """Take a token if one is free; otherwise return the seconds to wait"""
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            self.lock_waits += 1
+            return BUDGET_LOCK_RETRY
+        try:
+            now = time.time()
+            tokens, updated, paused_until = self.conn.execute(
+                "SELECT tokens, updated, paused_until FROM budget WHERE name = 'api'"
+            ).fetchone()
+            if self.paused_until > paused_until:
+                # A pause recorded since the last grant is shared with the other processes here
+                paused_until = self.paused_until
+                self.conn.execute(
+                    "UPDATE budget SET tokens = 0, updated = ?, paused_until = ? WHERE name = 'api'",
+                    (now, paused_until)
+                )
+                tokens, updated = 0, now
+            if now < paused_until:
+                self.conn.execute('COMMIT')
+                return paused_until - now
+            tokens = min(self.burst, tokens + max(0, now - updated) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self.conn.execute("UPDATE budget SET tokens = ?, updated = ? WHERE name = 'api'", (tokens, now))
+            self.conn.execute('COMMIT')
+            return wait
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    async def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                self.granted += 1
+                return
+            self.waits += 1
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every process back for seconds, as asked for by a Retry-After"""
+        # Written by the next grant, which already retries when the database is locked
+        self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def stats(self):
+        return {'granted': self.granted, 'waits': self.waits, 'lock_waits': self.lock_waits, 'rate': self.rate}
+
+    def close(self):
+        self.conn.close()
+
+
+class _RateLimitedService:
+    def __init__(self, service, limiter, service_name):
+        self.service = service
+        self.limiter = limiter
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        method = getattr(self.service, name)
+        if not callable(method):
+            return method
+
+        async def limited(*args, **kwargs):
+            # Latency per endpoint covers waiting for the limiter and every retry
+            started = time.perf_counter()
+            try:
+                return await self.limiter.call(lambda: method(*args, **kwargs))
+            finally:
+                instrumentation.observe(f"{self.service_name}.{name}", time.perf_counter() - started)
+        return limited
+
+
+class RateLimitedClient:
+    """Wraps HaloInfiniteClient so every service call goes through one limiter"""
+
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+        self.services = {}
+
+    def __getattr__(self, name):
+        if name not in self.services:
+            service = getattr(self.client, name)
+            if callable(service):
+                return service
+            self.services[name] = _RateLimitedService(service, self.limiter, name)
+        return self.services[name]
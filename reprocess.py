@@ -0,0 +1,129 @@
+import os
+import csv
+import asyncio
+from datetime import datetime
+from spnkr.models.stats import MatchStats
+from csv_writer import StreamingCsvWriter
+from parse_pool import PARSE_WORKERS, ParsePool
+from response_cache import RESPONSE_CACHE_FILE, ResponseCache
+from roster_index import ROSTER_INDEX_FILE, RosterIndex
+from stats import (
+    PLAYERS, BASE_CSV_HEADERS, DEFAULT_MAX_IN_FLIGHT, METADATA_CACHE_FILE, PLAYLIST_CSR_PREFIXES,
+    clean_xuid, safe_get, roster_entries, open_halo_client, get_medal_metadata, process_matches
+)
+
+def cached_match_players(response_cache_file=RESPONSE_CACHE_FILE):
+    """Work out which tracked players were in each cached match, numbered newest first per player"""
+    player_by_xuid = {clean_xuid(player["xuid"]): player for player in PLAYERS}
+    player_matches = {player_xuid: [] for player_xuid in player_by_xuid}
+    response_store = ResponseCache(response_cache_file)
+    try:
+        for match_id in response_store.keys('match_stats'):
+            try:
+                match_stats = MatchStats(**response_store.get('match_stats', match_id))
+            except Exception:
+                continue
+            start_time = match_stats.match_info.start_time
+            for player in match_stats.players:
+                player_xuid = clean_xuid(safe_get(player, 'player_id'))
+                if player_xuid in player_matches:
+                    player_matches[player_xuid].append((start_time, match_id))
+    finally:
+        response_store.close()
+    match_players = {}
+    for player_xuid, matches in player_matches.items():
+        for i, (_, match_id) in enumerate(sorted(set(matches), reverse=True)):
+            match_players.setdefault(match_id, []).append((player_by_xuid[player_xuid], i+1))
+    return match_players
+
+def index_cached_rosters(roster_file=ROSTER_INDEX_FILE, response_cache_file=RESPONSE_CACHE_FILE):
+    """Add the roster of every cached match that isn't in the roster index yet"""
+    roster_index = RosterIndex(roster_file)
+    response_store = ResponseCache(response_cache_file)
+    try:
+        for match_id in response_store.keys('match_stats'):
+            if str(match_id) in roster_index.keys:
+                continue
+            try:
+                match_stats = MatchStats(**response_store.get('match_stats', match_id))
+            except Exception:
+                continue
+            start_time = match_stats.match_info.start_time
+            date = start_time.strftime('%Y-%m-%d %H:%M:%S') if isinstance(start_time, datetime) else str(start_time)
+            playlist_id = safe_get(match_stats.match_info, 'playlist', 'asset_id')
+            roster_index.record(match_id, date, playlist_id, roster_entries(match_stats))
+        print(f"Roster index: {roster_index.stats()}")
+    finally:
+        response_store.close()
+        roster_index.close()
+
+def csv_match_players(csv_filename):
+    """The (player, match_number) rows an existing CSV has for each match, and the playlist CSR each row recorded"""
+    player_by_xuid = {clean_xuid(player["xuid"]): player for player in PLAYERS}
+    match_players = {}
+    recorded_csr = {}
+    with open(csv_filename, 'r', newline='', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        csr_headers = [header for header in reader.fieldnames or () if header.startswith(PLAYLIST_CSR_PREFIXES)]
+        for row in reader:
+            player = player_by_xuid.get(clean_xuid(row.get('player_xuid')))
+            if player is not None and row.get('match_id'):
+                match_number = int(row['match_number']) if str(row.get('match_number')).isdigit() else 0
+                match_players.setdefault(row['match_id'], []).append((player, match_number))
+                recorded_csr[(clean_xuid(row['player_xuid']), row['match_id'])] = {header: row[header] for header in csr_headers}
+    return match_players, recorded_csr
+
+async def run_reprocess(csv_filename='halo_multi_player_stats.csv', response_cache_file=RESPONSE_CACHE_FILE,
+                        metadata_cache_file=METADATA_CACHE_FILE, max_in_flight=DEFAULT_MAX_IN_FLIGHT, workers=PARSE_WORKERS):
+    """Rebuild the CSV from cached responses without touching the network"""
+    # The rows already in the CSV are rebuilt as they are; without a CSV every tracked
+    # player in every cached match gets a row
+    # Playlist CSR can't be fetched offline, so rebuilt rows keep what was recorded
+    # when the match was first processed
+    if os.path.exists(csv_filename):
+        match_players, recorded_csr = csv_match_players(csv_filename)
+    else:
+        match_players, recorded_csr = cached_match_players(response_cache_file), {}
+    # The new file is built next to the old one and only replaces it once complete
+    temp_filename = f"{csv_filename}.reprocess"
+    for filename in (temp_filename, f"{temp_filename}.schema.json"):
+        if os.path.exists(filename):
+            os.remove(filename)
+    csv_writer = StreamingCsvWriter(temp_filename, BASE_CSV_HEADERS)
+
+    def write_rows(match_results):
+        for _, _, match_row, row_headers in match_results:
+            match_row.update(recorded_csr.get((match_row['player_xuid'], str(match_row['match_id'])), {}))
+            csv_writer.write_rows([match_row], row_headers)
+
+    try:
+        async with open_halo_client(metadata_cache_file, response_cache_file, offline=True) as client:
+            medal_names = await get_medal_metadata(client)
+            # With more than one worker, parsing and row building run in a process pool
+            parse_pool = ParsePool(PLAYERS, medal_names, metadata_cache_file, response_cache_file, workers) if workers > 1 else None
+            try:
+                # Enough matches in flight to keep every worker busy
+                semaphore = asyncio.Semaphore(max(max_in_flight, workers * 2))
+                await process_matches(client, PLAYERS, match_players, medal_names, {}, semaphore, write_rows, parse_pool)
+            finally:
+                if parse_pool is not None:
+                    parse_pool.close()
+        rebuilt = csv_writer.rows_written
+        if os.path.exists(csv_filename):
+            # Rows whose match was never cached are carried over unchanged
+            with open(csv_filename, 'r', newline='', encoding='utf-8') as csvfile:
+                for row in csv.DictReader(csvfile):
+                    csv_writer.write_rows([row])
+    finally:
+        csv_writer.close()
+    os.replace(temp_filename, csv_filename)
+    if os.path.exists(f"{temp_filename}.schema.json"):
+        os.replace(f"{temp_filename}.schema.json", f"{csv_filename}.schema.json")
+    print(f"Reprocess: rebuilt {rebuilt} rows from cached responses, kept {csv_writer.rows_written - rebuilt} uncached rows as they were")
+
+if __name__ == "__main__":
+    asyncio.run(run_reprocess(
+        csv_filename='halo_multi_player_stats.csv',
+        response_cache_file=RESPONSE_CACHE_FILE,
+        workers=PARSE_WORKERS
+    ))
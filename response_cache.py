@@ -0,0 +1,101 @@
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+
+RESPONSE_CACHE_FILE = 'halo_response_cache.sqlite'
+
+
+class ResponseCache:
+    """On-disk cache of raw API responses keyed by endpoint and key (usually a match_id).
+
+    Payloads are stored zlib-compressed under the sha256 of their JSON, so identical
+    responses are only stored once no matter how many keys point at them.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_FILE):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            'digest TEXT PRIMARY KEY, '
+            'data BLOB NOT NULL)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'endpoint TEXT NOT NULL, '
+            'key TEXT NOT NULL, '
+            'digest TEXT NOT NULL, '
+            'fetched_at REAL NOT NULL, '
+            'PRIMARY KEY (endpoint, key))'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_digest ON responses (digest)')
+        self.conn.commit()
+
+    def get(self, endpoint, key):
+        """Return the cached JSON payload, or None"""
+        row = self.conn.execute(
+            'SELECT blobs.data FROM responses JOIN blobs ON blobs.digest = responses.digest '
+            'WHERE responses.endpoint = ? AND responses.key = ?',
+            (endpoint, str(key))
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, endpoint, key, data):
+        encoded = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()
+        old = self.conn.execute(
+            'SELECT digest FROM responses WHERE endpoint = ? AND key = ?',
+            (endpoint, str(key))
+        ).fetchone()
+        self.conn.execute('INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)', (digest, zlib.compress(encoded, 6)))
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses (endpoint, key, digest, fetched_at) VALUES (?, ?, ?, ?)',
+            (endpoint, str(key), digest, time.time())
+        )
+        if old is not None and old[0] != digest:
+            self.conn.execute(
+                'DELETE FROM blobs WHERE digest = ? AND NOT EXISTS (SELECT 1 FROM responses WHERE digest = ?)',
+                (old[0], old[0])
+            )
+        self.conn.commit()
+
+    def keys(self, endpoint):
+        return [row[0] for row in self.conn.execute('SELECT key FROM responses WHERE endpoint = ? ORDER BY key', (endpoint,))]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+class OfflineError(Exception):
+    pass
+
+
+class _OfflineService:
+    def __getattr__(self, name):
+        async def request(*args, **kwargs):
+            raise OfflineError(f"{name} needs the network")
+        return request
+
+
+class OfflineClient:
+    """Stands in for HaloInfiniteClient when rebuilding rows from cached responses"""
+
+    def __getattr__(self, name):
+        return _OfflineService()
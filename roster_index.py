@@ -0,0 +1,125 @@
+import sqlite3
+
+ROSTER_INDEX_FILE = 'halo_roster_index.sqlite'
+
+
+class RosterIndex:
+    """Every player in every processed match, with their team and outcome.
+
+    Rows are keyed by (match_id, xuid) with a second index on (xuid, match_id),
+    so both "who was in this match, by team" and "which matches was this player
+    in" are index lookups. Teammate and opponent questions are a self-join on
+    match_id over the matches of one player rather than a scan of the stats table.
+    """
+
+    def __init__(self, path=ROSTER_INDEX_FILE):
+        self.path = path
+        self.matches_recorded = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS matches ('
+            'match_id TEXT PRIMARY KEY, '
+            'date TEXT, '
+            'playlist_id TEXT)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS rosters ('
+            'match_id TEXT NOT NULL, '
+            'xuid TEXT NOT NULL, '
+            'team_id INTEGER, '
+            'outcome TEXT, '
+            'is_bot INTEGER NOT NULL DEFAULT 0, '
+            'PRIMARY KEY (match_id, xuid)) WITHOUT ROWID'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS rosters_xuid ON rosters (xuid, match_id, team_id)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS matches_date ON matches (date)')
+        self.conn.commit()
+        self.keys = set(match_id for match_id, in self.conn.execute('SELECT match_id FROM matches'))
+
+    def record(self, match_id, date, playlist_id, entries):
+        """Store a match's roster; entries are (xuid, team_id, outcome, is_bot). A match is only stored once"""
+        match_id = str(match_id)
+        if match_id in self.keys:
+            return False
+        self.conn.execute(
+            'INSERT OR IGNORE INTO matches (match_id, date, playlist_id) VALUES (?, ?, ?)',
+            (match_id, date, str(playlist_id) if playlist_id else None)
+        )
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO rosters (match_id, xuid, team_id, outcome, is_bot) VALUES (?, ?, ?, ?, ?)',
+            [(match_id, str(xuid), team_id, outcome, int(bool(is_bot))) for xuid, team_id, outcome, is_bot in entries]
+        )
+        self.conn.commit()
+        self.keys.add(match_id)
+        self.matches_recorded += 1
+        return True
+
+    def match_roster(self, match_id):
+        """{team_id: [xuid, ...]} for one match"""
+        teams = {}
+        for xuid, team_id in self.conn.execute(
+            'SELECT xuid, team_id FROM rosters WHERE match_id = ? ORDER BY team_id, xuid', (str(match_id),)
+        ):
+            teams.setdefault(team_id, []).append(xuid)
+        return teams
+
+    def player_matches(self, xuid):
+        """Match ids a player appears in, newest first"""
+        return [match_id for match_id, in self.conn.execute(
+            'SELECT r.match_id FROM rosters r JOIN matches m ON m.match_id = r.match_id '
+            'WHERE r.xuid = ? ORDER BY m.date DESC', (str(xuid),)
+        )]
+
+    def _co_players(self, xuid, same_team, limit, include_bots):
+        comparison = '=' if same_team else '!='
+        bot_filter = '' if include_bots else ' AND other.is_bot = 0'
+        return self.conn.execute(
+            'SELECT other.xuid, COUNT(*) AS matches, '
+            'SUM(CASE WHEN player.outcome = \'Win\' THEN 1 ELSE 0 END) AS wins '
+            'FROM rosters player JOIN rosters other ON other.match_id = player.match_id '
+            f'WHERE player.xuid = ? AND other.xuid != player.xuid AND other.team_id {comparison} player.team_id{bot_filter} '
+            'GROUP BY other.xuid ORDER BY matches DESC, other.xuid LIMIT ?',
+            (str(xuid), limit)
+        ).fetchall()
+
+    def teammates(self, xuid, limit=10, include_bots=False):
+        """Most frequent teammates as (xuid, matches together, wins together)"""
+        return self._co_players(xuid, True, limit, include_bots)
+
+    def opponents(self, xuid, limit=10, include_bots=False):
+        """Most frequent opponents as (xuid, matches against, wins by xuid against them)"""
+        return self._co_players(xuid, False, limit, include_bots)
+
+    def shared_matches(self, xuids, same_team=True):
+        """(match_id, team_id, outcome) for matches with every given player in, newest first.
+
+        With same_team they must all have been on one team, and team_id and outcome
+        are that team's; otherwise they are the first player's.
+        """
+        xuids = list(dict.fromkeys(str(xuid) for xuid in xuids))
+        placeholders = ', '.join('?' for _ in xuids)
+        if same_team:
+            query = (
+                'SELECT r.match_id, r.team_id, MIN(r.outcome) FROM rosters r JOIN matches m ON m.match_id = r.match_id '
+                f'WHERE r.xuid IN ({placeholders}) GROUP BY r.match_id, r.team_id '
+                'HAVING COUNT(*) = ? ORDER BY MAX(m.date) DESC'
+            )
+            params = xuids + [len(xuids)]
+        else:
+            query = (
+                'SELECT r.match_id, first.team_id, first.outcome FROM rosters r '
+                'JOIN matches m ON m.match_id = r.match_id '
+                'JOIN rosters first ON first.match_id = r.match_id AND first.xuid = ? '
+                f'WHERE r.xuid IN ({placeholders}) GROUP BY r.match_id '
+                'HAVING COUNT(*) = ? ORDER BY MAX(m.date) DESC'
+            )
+            params = [xuids[0]] + xuids + [len(xuids)]
+        return self.conn.execute(query, params).fetchall()
+
+    def stats(self):
+        return {'matches': len(self.keys), 'recorded': self.matches_recorded}
+
+    def close(self):
+        self.conn.close()
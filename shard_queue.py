@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import zlib
+import signal
+import socket
+import sqlite3
+import asyncio
+import multiprocessing
+import instrumentation
+from csv_writer import StreamingCsvWriter
+from rate_limiter import MAX_REQUESTS_PER_SECOND, RATE_BUDGET_FILE, SharedRateBudget
+from token_manager import TOKEN_FILE
+from stats import (
+    PLAYERS, BASE_CSV_HEADERS, DEFAULT_MAX_IN_FLIGHT, METADATA_CACHE_FILE, RESPONSE_CACHE_FILE,
+    clean_xuid, open_halo_client, get_medal_metadata, fetch_new_player_history, group_matches,
+    advance_high_water_mark, open_writers, skip_written_matches, add_processed_matches, flush_writers,
+    process_matches
+)
+
+SHARD_QUEUE_FILE = 'halo_shard_queue.sqlite'
+# Players are spread over this many shards by a hash of their xuid
+SHARD_COUNT = 16
+WORKER_COUNT = 4
+# A shard whose worker hasn't renewed its claim for this long can be taken by another
+SHARD_LEASE_SECONDS = 10 * 60
+# A shard is synced again at most this often
+SHARD_REFRESH_INTERVAL = 5 * 60
+# Longest an idle worker sleeps before looking for a due shard again
+CLAIM_INTERVAL = 30
+# New matches taken per player per sync, as in incremental runs
+MAX_NEW_MATCHES = 25
+
+
+def shard_for(xuid, shard_count=SHARD_COUNT):
+    """Stable shard number for a player, the same in every process"""
+    return zlib.crc32(clean_xuid(xuid).encode()) % shard_count
+
+
+def shard_csv_filename(csv_filename, shard_id):
+    # Each shard has its own CSV, only ever written by the worker holding the shard
+    stem, extension = os.path.splitext(csv_filename)
+    return f"{stem}.shard-{shard_id:03d}{extension or '.csv'}"
+
+
+class ShardQueue:
+    """Player shards that worker processes claim through one SQLite file.
+
+    A claim is a lease: the worker renews it while it syncs the shard's players
+    and releases it with their new high-water marks, which live here rather than
+    in a per-process sync state file. A worker that dies simply lets its lease
+    expire. Every change is a BEGIN IMMEDIATE transaction, so two workers can
+    never hold the same shard.
+    """
+
+    def __init__(self, path=SHARD_QUEUE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS players ('
+            'xuid TEXT PRIMARY KEY, '
+            'gamertag TEXT NOT NULL, '
+            'shard_id INTEGER NOT NULL, '
+            'high_water_mark TEXT)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS shards ('
+            'shard_id INTEGER PRIMARY KEY, '
+            'claimed_by TEXT, '
+            'lease_expires REAL, '
+            'last_synced REAL, '
+            'syncs INTEGER NOT NULL DEFAULT 0)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS players_shard ON players (shard_id)')
+
+    def _transaction(self, work):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = work()
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+        return result
+
+    def load_players(self, players, shard_count=SHARD_COUNT):
+        """Make the queue hold exactly these players; high-water marks of players already there are kept"""
+        def work():
+            xuids = []
+            for player in players:
+                xuid = clean_xuid(player["xuid"])
+                xuids.append(xuid)
+                self.conn.execute(
+                    'INSERT INTO players (xuid, gamertag, shard_id) VALUES (?, ?, ?) '
+                    'ON CONFLICT (xuid) DO UPDATE SET gamertag = excluded.gamertag, shard_id = excluded.shard_id',
+                    (xuid, player["gamertag"], shard_for(xuid, shard_count))
+                )
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS registry (xuid TEXT PRIMARY KEY)')
+            self.conn.execute('DELETE FROM registry')
+            self.conn.executemany('INSERT OR IGNORE INTO registry (xuid) VALUES (?)', [(xuid,) for xuid in xuids])
+            self.conn.execute('DELETE FROM players WHERE xuid NOT IN (SELECT xuid FROM registry)')
+            self.conn.executemany('INSERT OR IGNORE INTO shards (shard_id) VALUES (?)', [(shard_id,) for shard_id in range(shard_count)])
+            self.conn.execute('DELETE FROM shards WHERE shard_id >= ?', (shard_count,))
+            return len(xuids)
+        return self._transaction(work)
+
+    def claim(self, worker_id, lease_seconds=SHARD_LEASE_SECONDS, refresh_interval=SHARD_REFRESH_INTERVAL):
+        """Claim the longest-waiting due shard; (shard_id, players, sync_state) or None"""
+        def work():
+            now = time.time()
+            row = self.conn.execute(
+                'SELECT shard_id FROM shards '
+                'WHERE (claimed_by IS NULL OR lease_expires < ?) AND COALESCE(last_synced, 0) <= ? '
+                'AND EXISTS (SELECT 1 FROM players WHERE players.shard_id = shards.shard_id) '
+                'ORDER BY COALESCE(last_synced, 0), shard_id LIMIT 1',
+                (now, now - refresh_interval)
+            ).fetchone()
+            if row is None:
+                return None
+            shard_id = row[0]
+            self.conn.execute(
+                'UPDATE shards SET claimed_by = ?, lease_expires = ? WHERE shard_id = ?',
+                (worker_id, now + lease_seconds, shard_id)
+            )
+            players = []
+            sync_state = {}
+            for xuid, gamertag, high_water_mark in self.conn.execute(
+                'SELECT xuid, gamertag, high_water_mark FROM players WHERE shard_id = ? ORDER BY xuid', (shard_id,)
+            ):
+                players.append({"gamertag": gamertag, "xuid": xuid})
+                if high_water_mark:
+                    sync_state[xuid] = json.loads(high_water_mark)
+            return shard_id, players, sync_state
+        return self._transaction(work)
+
+    def renew(self, shard_id, worker_id, lease_seconds=SHARD_LEASE_SECONDS):
+        """Extend a claim; False if the lease was lost to another worker"""
+        cursor = self.conn.execute(
+            'UPDATE shards SET lease_expires = ? WHERE shard_id = ? AND claimed_by = ?',
+            (time.time() + lease_seconds, shard_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def release(self, shard_id, worker_id, sync_state):
+        """Save the shard's high-water marks and free it; nothing is saved if the lease was lost"""
+        def work():
+            cursor = self.conn.execute(
+                'UPDATE shards SET claimed_by = NULL, lease_expires = NULL, last_synced = ?, syncs = syncs + 1 '
+                'WHERE shard_id = ? AND claimed_by = ?',
+                (time.time(), shard_id, worker_id)
+            )
+            if cursor.rowcount != 1:
+                return False
+            self.conn.executemany(
+                'UPDATE players SET high_water_mark = ? WHERE xuid = ? AND shard_id = ?',
+                [(json.dumps(high_water_mark), xuid, shard_id) for xuid, high_water_mark in sync_state.items()]
+            )
+            return True
+        return self._transaction(work)
+
+    def next_due(self, refresh_interval=SHARD_REFRESH_INTERVAL):
+        """Seconds until some shard can be claimed, or None if no shard has players"""
+        now = time.time()
+        row = self.conn.execute(
+            'SELECT MIN(MAX(COALESCE(last_synced, 0) + ?, CASE WHEN claimed_by IS NULL THEN 0 ELSE lease_expires END)) '
+            'FROM shards WHERE EXISTS (SELECT 1 FROM players WHERE players.shard_id = shards.shard_id)',
+            (refresh_interval,)
+        ).fetchone()
+        return None if row[0] is None else max(0, row[0] - now)
+
+    def stats(self):
+        players, = self.conn.execute('SELECT COUNT(*) FROM players').fetchone()
+        shards, claimed, syncs = self.conn.execute(
+            'SELECT COUNT(*), COUNT(claimed_by), COALESCE(SUM(syncs), 0) FROM shards'
+        ).fetchone()
+        return {'players': players, 'shards': shards, 'claimed': claimed, 'syncs': syncs}
+
+    def close(self):
+        self.conn.close()
+
+
+async def sync_shard(client, players, sync_state, writers, medal_names, semaphore, match_type='all', max_new_matches=MAX_NEW_MATCHES):
+    """Fetch and write every new match for one shard's players, advancing sync_state in place"""
+    new_player_matches = await asyncio.gather(*[
+        fetch_new_player_history(
+            client,
+            player,
+            match_type,
+            sync_state.get(clean_xuid(player["xuid"])),
+            max_new_matches,
+            semaphore
+        )
+        for player in players
+    ])
+    processed_match_ids = {}
+
+    def write_rows(match_results):
+        for _, _, match_row, row_headers in match_results:
+            processed_match_ids.setdefault(str(match_row['player_xuid']), set()).add(str(match_row['match_id']))
+            with instrumentation.stage('write'):
+                for writer in writers:
+                    writer.write_rows([match_row], row_headers)
+
+    player_histories = [[match_id for match_id, _ in new_matches] for new_matches in new_player_matches]
+    match_players, written_keys = skip_written_matches(group_matches(players, player_histories), writers)
+    if match_players:
+        await process_matches(client, players, match_players, medal_names, {}, semaphore, write_rows)
+        await flush_writers(writers)
+    rows_written = sum(len(match_ids) for match_ids in processed_match_ids.values())
+    add_processed_matches(processed_match_ids, written_keys)
+    for player, new_matches in zip(players, new_player_matches):
+        player_xuid = clean_xuid(player["xuid"])
+        high_water_mark = advance_high_water_mark(sync_state.get(player_xuid), new_matches, processed_match_ids.get(player_xuid, set()))
+        if high_water_mark:
+            sync_state[player_xuid] = high_water_mark
+    return rows_written
+
+
+async def keep_lease(queue, shard_id, worker_id, lease_seconds):
+    # Renewed well before it runs out, so a long sync never loses its shard
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        if not queue.renew(shard_id, worker_id, lease_seconds):
+            print(f"Lost the claim on shard {shard_id}")
+            return
+
+
+async def run_worker(worker_id=None, queue_file=SHARD_QUEUE_FILE, match_type='all', save_to_csv=True,
+                     csv_filename='halo_multi_player_stats.csv', sqlite_file=None, aggregate_file=None, roster_file=None,
+                     max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_new_matches=MAX_NEW_MATCHES,
+                     metadata_cache_file=METADATA_CACHE_FILE, response_cache_file=RESPONSE_CACHE_FILE,
+                     rate_budget_file=RATE_BUDGET_FILE, requests_per_second=MAX_REQUESTS_PER_SECOND, token_file=TOKEN_FILE, lease_seconds=SHARD_LEASE_SECONDS,
+                     refresh_interval=SHARD_REFRESH_INTERVAL, once=False):
+    """Claim due shards one at a time and sync their players until stopped, or until none is due with once"""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    instrumentation.reset()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(stop_signal, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    queue = ShardQueue(queue_file)
+    # requests_per_second is the API limit for all workers together, not for each one
+    rate_budget = SharedRateBudget(rate_budget_file, requests_per_second)
+    # SQLite outputs are shared by every worker; CSV output is one file per shard
+    shared_writers = open_writers(False, csv_filename, None, sqlite_file, aggregate_file)
+    try:
+        # Metadata and response caches are SQLite files every worker opens, so they are shared as well
+        async with open_halo_client(metadata_cache_file, response_cache_file, token_file=token_file,
+                                    roster_file=roster_file, rate_budget=rate_budget) as client:
+            medal_names = await get_medal_metadata(client)
+            semaphore = asyncio.Semaphore(max_in_flight)
+            while not stop.is_set():
+                claim = queue.claim(worker_id, lease_seconds, refresh_interval)
+                if claim is None:
+                    wait = queue.next_due(refresh_interval)
+                    if once or wait is None:
+                        break
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout=min(CLAIM_INTERVAL, wait))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                shard_id, players, sync_state = claim
+                writers = list(shared_writers)
+                if save_to_csv:
+                    writers.append(StreamingCsvWriter(shard_csv_filename(csv_filename, shard_id), BASE_CSV_HEADERS))
+                lease_task = asyncio.ensure_future(keep_lease(queue, shard_id, worker_id, lease_seconds))
+                started = time.monotonic()
+                try:
+                    new_matches = await sync_shard(client, players, sync_state, writers, medal_names, semaphore, match_type, max_new_matches)
+                except Exception as e:
+                    # The shard is released with its old high-water marks and comes round again
+                    instrumentation.error('shard', e)
+                    print(f"Worker {worker_id}: shard {shard_id} failed: {e}")
+                    new_matches = 0
+                finally:
+                    lease_task.cancel()
+                    for writer in writers[len(shared_writers):]:
+                        writer.close()
+                if queue.release(shard_id, worker_id, sync_state):
+                    print(f"Worker {worker_id}: shard {shard_id} ({len(players)} players) - {new_matches} new rows in {time.monotonic() - started:.1f}s")
+    finally:
+        for writer in shared_writers:
+            writer.close()
+        print(f"Shared rate budget: {rate_budget.stats()}")
+        rate_budget.close()
+        queue.close()
+
+
+def _worker_main(worker_kwargs):
+    asyncio.run(run_worker(**worker_kwargs))
+
+
+def run_workers(players=None, workers=WORKER_COUNT, shard_count=SHARD_COUNT, queue_file=SHARD_QUEUE_FILE, **worker_kwargs):
+    """Load the registry into the queue and run workers processes until they all exit"""
+    queue = ShardQueue(queue_file)
+    try:
+        queue.load_players(PLAYERS if players is None else players, shard_count)
+        print(f"Shard queue: {queue.stats()}")
+    finally:
+        queue.close()
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=_worker_main, args=(dict(worker_kwargs, queue_file=queue_file),))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Each worker gets the same Ctrl+C and finishes its current shard
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    run_workers(
+        players=PLAYERS,
+        workers=WORKER_COUNT,
+        shard_count=SHARD_COUNT,
+        match_type='all',
+        csv_filename='halo_multi_player_stats.csv'
+    )
@@ -0,0 +1,167 @@
+import sqlite3
+from datetime import timedelta
+from csv_writer import column_type, is_medal_column
+
+STATS_DB_FILE = 'halo_multi_player_stats.sqlite'
+# Writes give up on a database another process has locked after this many milliseconds;
+# the rows stay pending and are retried, so the event loop never blocks for long
+WRITE_LOCK_TIMEOUT_MS = 20
+WRITE_LOCK_RETRY = 0.01
+SQL_TYPES = {'int': 'INTEGER', 'float': 'REAL', 'seconds': 'REAL', 'string': 'TEXT', 'timestamp': 'TEXT'}
+
+
+def is_locked(error):
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+
+def sql_value(value):
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+class SqliteStatsStore:
+    """Stores match rows in SQLite, one row per (match_id, player_xuid).
+
+    Medal counts go to a long-format medals table instead of one column per medal;
+    every other row field is a column of matches, added with ALTER TABLE the first
+    time it shows up.
+    """
+
+    def __init__(self, path=STATS_DB_FILE, base_headers=()):
+        self.path = path
+        self.rows_written = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS matches ('
+            'match_id TEXT NOT NULL, '
+            'player_xuid TEXT NOT NULL, '
+            'date TEXT, '
+            'playlist_id TEXT, '
+            'PRIMARY KEY (match_id, player_xuid))'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS medals ('
+            'match_id TEXT NOT NULL, '
+            'player_xuid TEXT NOT NULL, '
+            'medal_name TEXT NOT NULL, '
+            'count INTEGER NOT NULL, '
+            'PRIMARY KEY (match_id, player_xuid, medal_name))'
+        )
+        self.columns = [row[1] for row in self.conn.execute('PRAGMA table_info(matches)')]
+        self.column_set = set(self.columns)
+        # Base columns are added with the first rows written, so their types come from real values
+        self.pending_headers = [header for header in base_headers if header not in self.column_set]
+        self.conn.execute('CREATE INDEX IF NOT EXISTS matches_player_date ON matches (player_xuid, date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS matches_date ON matches (date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS matches_playlist_date ON matches (playlist_id, date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS matches_player_playlist_date ON matches (player_xuid, playlist_id, date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS medals_name ON medals (medal_name)')
+        self.conn.commit()
+        self.keys = set(self.conn.execute('SELECT player_xuid, match_id FROM matches'))
+        self.pending = []
+        self.lock_waits = 0
+        self.conn.execute(f'PRAGMA busy_timeout = {WRITE_LOCK_TIMEOUT_MS}')
+
+    def add_column(self, header, values=()):
+        if header in self.column_set or is_medal_column(header):
+            return
+        try:
+            self.conn.execute(f'ALTER TABLE matches ADD COLUMN "{header}" {SQL_TYPES[column_type(header, values)]}')
+        except sqlite3.OperationalError as e:
+            # Another process writing to the same database added it first
+            if 'duplicate column name' not in str(e):
+                raise
+        self.column_set.add(header)
+        self.columns.append(header)
+
+    def write_rows(self, rows, row_headers=()):
+        """Upsert rows and their medals; re-writing a row overwrites it with the new values.
+
+        While another process holds the database lock, rows stay in pending and
+        are written by the next write_rows or flush.
+        """
+        self.pending.extend(rows)
+        return self._write_pending()
+
+    def _write_pending(self):
+        rows = self.pending
+        if not rows:
+            return 0
+        try:
+            for header in self.pending_headers:
+                self.add_column(header, [row[header] for row in rows if header in row])
+            for row in rows:
+                self._upsert(row)
+            self.conn.commit()
+        except sqlite3.OperationalError as e:
+            if not is_locked(e):
+                raise
+            self.conn.rollback()
+            self.lock_waits += 1
+            # Columns added by the rolled back transaction are gone again
+            self.columns = [row[1] for row in self.conn.execute('PRAGMA table_info(matches)')]
+            self.column_set = set(self.columns)
+            return 0
+        self.pending = []
+        self.pending_headers = []
+        self.keys.update((str(row.get('player_xuid')), str(row.get('match_id'))) for row in rows)
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def _upsert(self, row):
+        for header in row:
+            self.add_column(header, [row[header]])
+        player_xuid = str(row.get('player_xuid'))
+        match_id = str(row.get('match_id'))
+        headers = [header for header in row if not is_medal_column(header) and header not in ('match_id', 'player_xuid')]
+        column_list = ', '.join(f'"{header}"' for header in ['match_id', 'player_xuid'] + headers)
+        placeholders = ', '.join('?' for _ in range(len(headers) + 2))
+        updates = ', '.join(f'"{header}" = excluded."{header}"' for header in headers)
+        conflict = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+        self.conn.execute(
+            f'INSERT INTO matches ({column_list}) VALUES ({placeholders}) '
+            f'ON CONFLICT (match_id, player_xuid) {conflict}',
+            [match_id, player_xuid] + [sql_value(row[header]) for header in headers]
+        )
+        self.conn.executemany(
+            'INSERT INTO medals (match_id, player_xuid, medal_name, count) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (match_id, player_xuid, medal_name) DO UPDATE SET count = excluded.count',
+            [(match_id, player_xuid, header[len('medal_'):], row[header])
+             for header in row if is_medal_column(header) and row[header]]
+        )
+
+    def recent_matches(self, player_xuid, limit=50, playlist_id=None):
+        """Latest matches for a player, newest first, optionally for one playlist"""
+        query = 'SELECT * FROM matches WHERE player_xuid = ?'
+        params = [str(player_xuid)]
+        if playlist_id is not None:
+            query += ' AND playlist_id = ?'
+            params.append(str(playlist_id))
+        query += ' ORDER BY date DESC LIMIT ?'
+        params.append(limit)
+        cursor = self.conn.execute(query, params)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, values)) for values in cursor]
+
+    def match_medals(self, match_id, player_xuid):
+        return dict(self.conn.execute(
+            'SELECT medal_name, count FROM medals WHERE match_id = ? AND player_xuid = ?',
+            (str(match_id), str(player_xuid))
+        ))
+
+    def flush(self):
+        """Retry rows left pending by a locked database"""
+        self._write_pending()
+
+    def close(self):
+        # Nothing else is waiting by now, so the last pending rows may wait out the lock
+        self.conn.execute('PRAGMA busy_timeout = 30000')
+        self._write_pending()
+        if self.pending:
+            print(f"SQLite store: {len(self.pending)} rows could not be written to {self.path}")
+        self.conn.close()
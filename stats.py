@@ -1,24 +1,71 @@
+import os
 import json
-import csv
 import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
-from aiohttp import ClientSession
 from spnkr.client import HaloInfiniteClient
+from spnkr.models.stats import MatchStats
+from spnkr.models.skill import MatchSkill, PlaylistCsr
+from spnkr.models.refdata import Outcome
+from metadata_cache import METADATA_CACHE_FILE, MetadataCache
+from response_cache import RESPONSE_CACHE_FILE, ResponseCache, OfflineClient, OfflineError
+from rate_limiter import MAX_REQUESTS_PER_SECOND, AdaptiveRateLimiter, RateLimitedClient
+from http_session import HTTP_MAX_CONNECTIONS, HTTP_MAX_CONNECTIONS_PER_HOST, ConnectionStats, create_session
+from token_manager import TOKEN_FILE, TokenManager, TokenRefreshingClient
+from csv_writer import StreamingCsvWriter
+import instrumentation
+from instrumentation import RUN_REPORT_FILE
+from extractors import name_attr, field_names, core_plan, category_plan, mode_default_columns
+from parquet_writer import ParquetWriter
+from sqlite_store import WRITE_LOCK_RETRY, SqliteStatsStore
+from aggregate_store import AggregateStore
+from roster_index import RosterIndex
+from player_registry import PLAYER_REGISTRY_FILE, load_players
 
-# Define the players to track
-PLAYERS = [
+# Players tracked when there is no player registry file
+DEFAULT_PLAYERS = [
     {"gamertag": "l 0cty l", "xuid": "2533274818160056"},
     {"gamertag": "Zaidster7", "xuid": "2533274965035069"},
     {"gamertag": "l P1N1 l", "xuid": "2533274804338345"},
     {"gamertag": "l Viper18 l", "xuid": "2535430400255009"},
     {"gamertag": "l Jordo l", "xuid": "2533274797008163"}
 ]
+# Define the players to track; halo_players.json, if present, replaces the list above
+PLAYERS = load_players(PLAYER_REGISTRY_FILE, DEFAULT_PLAYERS)
+
+# Maximum number of matches (or history pages) being fetched at once across all players
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Playlist used for CSR lookups when a match has no playlist
+DEFAULT_RANKED_PLAYLIST = "edfef3ac-9cbe-4fa2-b949-8f29deafd483"
+# Maximum number of xuids sent in a single playlist CSR request
+CSR_BATCH_SIZE = 50
+# Columns filled from the playlist CSR, which reflects when the row was built rather than the match
+PLAYLIST_CSR_PREFIXES = ('current_csr_', 'season_max_csr_', 'all_time_max_csr_')
+
+# The match history endpoint returns at most 25 matches per request
+HISTORY_PAGE_SIZE = 25
+# Per-player high-water marks for incremental runs
+SYNC_STATE_FILE = 'halo_sync_state.json'
 
 # Caches for metadata
 medal_cache = {}
 map_name_cache = {}
 playlist_name_cache = {}
 game_type_cache = {}
+# Column name for each (medal id, medal name), so names are only cleaned once
+medal_columns = {}
+# Persistent metadata cache shared across runs, opened by run_multi_player_stats
+metadata_store = None
+# Raw match stats/skill responses, opened alongside metadata_store. Completed matches
+# never change, so a cached payload is used instead of asking the API again.
+response_store = None
+# Medal metadata isn't versioned, so the persisted copy is refreshed weekly
+MEDAL_METADATA_TTL = 7 * 24 * 60 * 60
+# Lookups currently being fetched, so concurrent matches share one request per asset
+pending_lookups = {}
+# Full roster of every processed match, opened by open_halo_client when a roster_file is given
+roster_index = None
 
 def clean_xuid(xuid):
     if isinstance(xuid, str) and "xuid(" in xuid:
@@ -26,14 +73,21 @@ def clean_xuid(xuid):
     return str(xuid)
 
 def outcome_to_string(outcome_value):
-    outcomes = {0: "Left", 1: "Loss", 2: "Win", 3: "Tie"}
+    # spnkr's Outcome is an IntEnum, so its members and plain ints both look up here
+    outcomes = {Outcome.TIE: "Tie", Outcome.WIN: "Win", Outcome.LOSS: "Loss", Outcome.DID_NOT_FINISH: "Left"}
     if isinstance(outcome_value, (int, str)) and str(outcome_value).isdigit():
         return outcomes.get(int(outcome_value), f"Unknown ({outcome_value})")
     return str(outcome_value)
 
-def load_tokens():
-    with open('tokens.json', 'r') as f:
-        return json.load(f)
+def load_sync_state(sync_state_file=SYNC_STATE_FILE):
+    if os.path.exists(sync_state_file):
+        with open(sync_state_file, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_sync_state(sync_state, sync_state_file=SYNC_STATE_FILE):
+    with open(sync_state_file, 'w') as f:
+        json.dump(sync_state, f, indent=4)
 
 def safe_get(obj, *attrs, default=None):
     for attr in attrs:
@@ -44,6 +98,14 @@ def safe_get(obj, *attrs, default=None):
             return default
     return obj
 
+async def single_flight(key, fetch):
+    task = pending_lookups.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        pending_lookups[key] = task
+        task.add_done_callback(lambda _: pending_lookups.pop(key, None))
+    return await asyncio.shield(task)
+
 def process_csr_data(playlist_csr_value, match_row):
     if not playlist_csr_value:
         return
@@ -79,8 +141,98 @@ def process_csr_data(playlist_csr_value, match_row):
                 match_row['all_time_max_csr_tier_name'] = str(all_time_max_csr.tier)
             if hasattr(all_time_max_csr, 'sub_tier'):
                 match_row['all_time_max_csr_sub_tier_name'] = str(all_time_max_csr.sub_tier)
-    except Exception:
-        pass
+    except Exception as e:
+        instrumentation.error('playlist_csr', e)
+
+def skill_fields_by_xuid(match_skill_data):
+    # Match CSR/MMR fields for every player in a skill response, worked out once per match
+    skill_fields = {}
+    if not match_skill_data:
+        return skill_fields
+    try:
+        if hasattr(match_skill_data, 'players') and match_skill_data.players:
+            for player_skill in match_skill_data.players:
+                player_id = safe_get(player_skill, 'id')
+                if player_id:
+                    fields = skill_fields.setdefault(clean_xuid(player_id), {})
+                    if hasattr(player_skill, 'csr'):
+                        match_csr = player_skill.csr
+                        if hasattr(match_csr, 'value'):
+                            fields['match_csr_value'] = match_csr.value
+                        if hasattr(match_csr, 'tier'):
+                            fields['match_csr_tier_name'] = str(match_csr.tier)
+                        if hasattr(match_csr, 'sub_tier'):
+                            fields['match_csr_sub_tier_name'] = str(match_csr.sub_tier)
+                    if hasattr(player_skill, 'mmr'):
+                        match_mmr = player_skill.mmr
+                        if hasattr(match_mmr, 'value'):
+                            fields['match_mmr_value'] = match_mmr.value
+        elif hasattr(match_skill_data, 'value'):
+            value_data = match_skill_data.value
+            if hasattr(value_data, '__iter__') and not isinstance(value_data, str):
+                for skill_value in value_data:
+                    player_id = safe_get(skill_value, 'id')
+                    if player_id:
+                        fields = skill_fields.setdefault(clean_xuid(player_id), {})
+                        skill_result = safe_get(skill_value, 'result')
+                        if skill_result:
+                            rank_recap = safe_get(skill_result, 'rank_recap')
+                            if rank_recap:
+                                pre_match_csr = safe_get(rank_recap, 'pre_match_csr')
+                                if pre_match_csr:
+                                    if hasattr(pre_match_csr, 'value'):
+                                        fields['match_csr_value'] = pre_match_csr.value
+                                    if hasattr(pre_match_csr, 'tier'):
+                                        fields['match_csr_tier_name'] = str(pre_match_csr.tier)
+                                    if hasattr(pre_match_csr, 'sub_tier'):
+                                        fields['match_csr_sub_tier_name'] = str(pre_match_csr.sub_tier)
+                                post_match_csr = safe_get(rank_recap, 'post_match_csr')
+                                if post_match_csr:
+                                    if hasattr(post_match_csr, 'value'):
+                                        fields['post_match_csr_value'] = post_match_csr.value
+                                    if hasattr(post_match_csr, 'tier'):
+                                        fields['post_match_csr_tier_name'] = str(post_match_csr.tier)
+                                    if hasattr(post_match_csr, 'sub_tier'):
+                                        fields['post_match_csr_sub_tier_name'] = str(post_match_csr.sub_tier)
+                            if hasattr(skill_result, 'team_mmr'):
+                                fields['match_mmr_value'] = skill_result.team_mmr
+            elif hasattr(value_data, 'id') or hasattr(value_data, 'result'):
+                player_id = safe_get(value_data, 'id')
+                if player_id:
+                    fields = skill_fields.setdefault(clean_xuid(player_id), {})
+                    if hasattr(value_data, 'csr'):
+                        match_csr = value_data.csr
+                        if hasattr(match_csr, 'value'):
+                            fields['match_csr_value'] = match_csr.value
+                        if hasattr(match_csr, 'tier'):
+                            fields['match_csr_tier_name'] = str(match_csr.tier)
+                        if hasattr(match_csr, 'sub_tier'):
+                            fields['match_csr_sub_tier_name'] = str(match_csr.sub_tier)
+                    if hasattr(value_data, 'mmr'):
+                        match_mmr = value_data.mmr
+                        if hasattr(match_mmr, 'value'):
+                            fields['match_mmr_value'] = match_mmr.value
+    except Exception as e:
+        instrumentation.error('skill', e)
+    return skill_fields
+
+def roster_entries(match_stats):
+    # (xuid, team_id, outcome, is_bot) for everyone in the match, not just tracked players
+    entries = []
+    for player in match_stats.players or []:
+        player_xuid = clean_xuid(safe_get(player, 'player_id'))
+        is_bot = int(safe_get(player, 'player_type', default=1)) == 2
+        entries.append((player_xuid, safe_get(player, 'last_team_id'), outcome_to_string(safe_get(player, 'outcome', default="Unknown")), is_bot))
+    return entries
+
+def record_roster(match_id, match_stats, match_details):
+    if roster_index is None or str(match_id) in roster_index.keys:
+        return
+    try:
+        with instrumentation.stage('roster'):
+            roster_index.record(match_id, match_details['date'], match_details['playlist_id'], roster_entries(match_stats))
+    except Exception as e:
+        instrumentation.error('roster', e)
 
 def process_medals(medals_data, match_row, medal_names=None):
     if not medals_data:
@@ -90,23 +242,34 @@ def process_medals(medals_data, match_row, medal_names=None):
             if hasattr(medal, 'name_id') and hasattr(medal, 'count'):
                 medal_id = medal.name_id
                 medal_count = medal.count
-                if medal_names and medal_id in medal_names:
-                    medal_name = medal_names[medal_id]
-                    clean_name = ''.join(c if c.isalnum() else '_' for c in medal_name)
-                    column_name = f"medal_{clean_name}"
-                else:
-                    column_name = f"medal_id_{medal_id}"
+                medal_name = medal_names.get(medal_id) if medal_names else None
+                column_name = medal_columns.get((medal_id, medal_name))
+                if column_name is None:
+                    if medal_name is not None:
+                        clean_name = ''.join(c if c.isalnum() else '_' for c in medal_name)
+                        column_name = f"medal_{clean_name}"
+                    else:
+                        column_name = f"medal_id_{medal_id}"
+                    medal_columns[(medal_id, medal_name)] = column_name
                 match_row[column_name] = medal_count
-    except Exception:
-        pass
+    except Exception as e:
+        instrumentation.error('row_build', e)
 
 async def get_medal_metadata(client):
     global medal_cache
     if medal_cache:
         return medal_cache
+    if metadata_store is not None:
+        found, cached_medals, negative = metadata_store.get('medals', 'metadata')
+        if found and not negative:
+            for medal_id, medal_name in cached_medals.items():
+                medal_cache[int(medal_id)] = medal_name
+                medal_cache[medal_id] = medal_name
+            return medal_cache
     try:
-        metadata_response = await client.gamecms_hacs.get_medal_metadata()
-        metadata = await metadata_response.parse()
+        with instrumentation.stage('metadata'):
+            metadata_response = await client.gamecms_hacs.get_medal_metadata()
+            metadata = await metadata_response.parse()
         if hasattr(metadata, 'medals'):
             for medal in metadata.medals:
                 if hasattr(medal, 'name_id') and hasattr(medal, 'name'):
@@ -114,92 +277,301 @@ async def get_medal_metadata(client):
                     medal_name = medal.name.value if hasattr(medal.name, 'value') else str(medal.name)
                     medal_cache[medal_id] = medal_name
                     medal_cache[str(medal_id)] = medal_name
-    except Exception:
-        pass
+    except Exception as e:
+        instrumentation.error('metadata', e)
+    if medal_cache and metadata_store is not None:
+        cached_medals = {medal_id: medal_name for medal_id, medal_name in medal_cache.items() if isinstance(medal_id, str)}
+        metadata_store.set('medals', 'metadata', cached_medals, ttl=MEDAL_METADATA_TTL)
     return medal_cache
 
-async def get_map_name(client, asset_id, version_id=None):
-    key = f"{asset_id}:{version_id}"
-    if key in map_name_cache:
-        return map_name_cache[key]
-    if version_id is None:
-        return f"Map ID: {asset_id}"
+async def lookup_metadata(kind, memory_cache, key, fetch, fallback):
+    # In-memory cache, then the persistent cache, then the API. Assets are immutable per
+    # version_id so found names never expire; missing assets are cached as negative entries.
+    if key in memory_cache:
+        return memory_cache[key]
+    if metadata_store is not None:
+        found, name, negative = metadata_store.get(kind, key)
+        if found:
+            if not negative:
+                memory_cache[key] = name
+            return name
+    try:
+        with instrumentation.stage('metadata'):
+            name = await fetch()
+    except Exception as e:
+        instrumentation.error('metadata', e)
+        if getattr(e, 'status', None) == 404 and metadata_store is not None:
+            metadata_store.set_negative(kind, key, fallback)
+        return fallback
+    if name is None:
+        if metadata_store is not None:
+            metadata_store.set_negative(kind, key, fallback)
+        return fallback
+    memory_cache[key] = name
+    if metadata_store is not None:
+        metadata_store.set(kind, key, str(name))
+    return name
+
+async def fetch_map_name(client, asset_id, version_id):
+    map_response = await client.discovery_ugc.get_map(asset_id, version_id)
+    map_data = await map_response.parse()
+    for attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']:
+        if hasattr(map_data, attr):
+            return getattr(map_data, attr)
     try:
-        map_response = await client.discovery_ugc.get_map(asset_id, version_id)
-        map_data = await map_response.parse()
+        pair_response = await client.discovery_ugc.get_map_mode_pair(asset_id, version_id)
+        pair_data = await pair_response.parse()
         for attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']:
-            if hasattr(map_data, attr):
-                name = getattr(map_data, attr)
-                map_name_cache[key] = name
-                return name
-        try:
-            pair_response = await client.discovery_ugc.get_map_mode_pair(asset_id, version_id)
-            pair_data = await pair_response.parse()
-            for attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']:
-                if hasattr(pair_data, attr):
-                    name = getattr(pair_data, attr)
-                    map_name_cache[key] = name
-                    return name
-        except Exception:
-            pass
-        return f"Map ID: {asset_id}"
-    except Exception:
+            if hasattr(pair_data, attr):
+                return getattr(pair_data, attr)
+    except Exception as e:
+        instrumentation.error('metadata', e)
+    return None
+
+async def get_map_name(client, asset_id, version_id=None):
+    if version_id is None:
         return f"Map ID: {asset_id}"
+    return await lookup_metadata(
+        'map', map_name_cache, f"{asset_id}:{version_id}",
+        lambda: fetch_map_name(client, asset_id, version_id),
+        f"Map ID: {asset_id}"
+    )
+
+async def fetch_playlist_name(client, asset_id, version_id):
+    playlist_response = await client.discovery_ugc.get_playlist(asset_id, version_id)
+    playlist_data = await playlist_response.parse()
+    for attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']:
+        if hasattr(playlist_data, attr):
+            return getattr(playlist_data, attr)
+    return None
 
 async def get_playlist_name(client, asset_id, version_id=None):
-    key = f"{asset_id}:{version_id}"
-    if key in playlist_name_cache:
-        return playlist_name_cache[key]
     if version_id is None:
         return f"Playlist ID: {asset_id}"
-    try:
-        playlist_response = await client.discovery_ugc.get_playlist(asset_id, version_id)
-        playlist_data = await playlist_response.parse()
-        for attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']:
-            if hasattr(playlist_data, attr):
-                name = getattr(playlist_data, attr)
-                playlist_name_cache[key] = name
-                return name
-        return f"Playlist ID: {asset_id}"
-    except Exception:
-        return f"Playlist ID: {asset_id}"
+    return await lookup_metadata(
+        'playlist', playlist_name_cache, f"{asset_id}:{version_id}",
+        lambda: fetch_playlist_name(client, asset_id, version_id),
+        f"Playlist ID: {asset_id}"
+    )
+
+async def fetch_game_variant_name(client, asset_id, version_id):
+    variant_response = await client.discovery_ugc.get_ugc_game_variant(asset_id, version_id)
+    variant_data = await variant_response.parse()
+    for attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title', 'game_mode']:
+        if hasattr(variant_data, attr):
+            return getattr(variant_data, attr)
+    properties = safe_get(variant_data, 'properties')
+    if properties:
+        for attr in ['name', 'display_name', 'game_mode', 'variant_name']:
+            if hasattr(properties, attr):
+                return getattr(properties, attr)
+    return None
 
 async def get_game_variant_name(client, asset_id, version_id=None):
-    key = f"{asset_id}:{version_id}"
-    if key in game_type_cache:
-        return game_type_cache[key]
     if version_id is None:
         return f"Game Type ID: {asset_id}"
+    return await lookup_metadata(
+        'game_type', game_type_cache, f"{asset_id}:{version_id}",
+        lambda: fetch_game_variant_name(client, asset_id, version_id),
+        f"Game Type ID: {asset_id}"
+    )
+
+async def fetch_match_stats(client, match_id):
+    if response_store is not None:
+        data = response_store.get('match_stats', match_id)
+        if data is not None:
+            with instrumentation.stage('parse'):
+                return MatchStats(**data)
+    with instrumentation.stage('match_stats'):
+        match_stats_response = await client.stats.get_match_stats(match_id)
+        data = await match_stats_response.json()
+    with instrumentation.stage('parse'):
+        match_stats = MatchStats(**data)
+    if response_store is not None:
+        response_store.set('match_stats', match_id, data)
+    return match_stats
+
+async def fetch_match_skill(client, match_id, xuids):
+    # A cached skill payload is only used if it covers every xuid being asked for
+    if response_store is not None:
+        data = response_store.get('match_skill', match_id)
+        if data is not None and set(xuids) <= {clean_xuid(entry.get('Id')) for entry in data.get('Value', [])}:
+            with instrumentation.stage('parse'):
+                return MatchSkill(**data)
+    with instrumentation.stage('skill'):
+        match_skill_response = await client.skill.get_match_skill(
+            match_id=match_id,
+            xuids=xuids
+        )
+        if not match_skill_response:
+            return None
+        data = await match_skill_response.json()
+    with instrumentation.stage('parse'):
+        match_skill = MatchSkill(**data)
+    if response_store is not None:
+        response_store.set('match_skill', match_id, data)
+    return match_skill
+
+async def fetch_playlist_csr_data(client, playlist_id, batch):
+    # Playlist CSR changes over time, so it is never cached. Offline there is no
+    # CSR to be had; a rebuild keeps the values the existing rows recorded.
     try:
-        variant_response = await client.discovery_ugc.get_ugc_game_variant(asset_id, version_id)
-        variant_data = await variant_response.parse()
-        for attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title', 'game_mode']:
-            if hasattr(variant_data, attr):
-                name = getattr(variant_data, attr)
-                game_type_cache[key] = name
-                return name
-        properties = safe_get(variant_data, 'properties')
-        if properties:
-            for attr in ['name', 'display_name', 'game_mode', 'variant_name']:
-                if hasattr(properties, attr):
-                    name = getattr(properties, attr)
-                    game_type_cache[key] = name
-                    return name
-        return f"Game Type ID: {asset_id}"
-    except Exception:
-        return f"Game Type ID: {asset_id}"
+        with instrumentation.stage('playlist_csr'):
+            playlist_csr_response = await client.skill.get_playlist_csr(
+                playlist_id=playlist_id,
+                xuids=batch
+            )
+            data = await playlist_csr_response.json() if playlist_csr_response else None
+    except OfflineError:
+        return None
+    if data is None:
+        return None
+    with instrumentation.stage('parse'):
+        return PlaylistCsr(**data)
+
+async def fetch_playlist_csr(client, csr_cache, playlist_id, xuids):
+    for start in range(0, len(xuids), CSR_BATCH_SIZE):
+        batch = xuids[start:start + CSR_BATCH_SIZE]
+        playlist_csr_data = await fetch_playlist_csr_data(client, playlist_id, batch)
+        entries = {}
+        if playlist_csr_data:
+            if hasattr(playlist_csr_data, 'value'):
+                for player_csr in playlist_csr_data.value:
+                    player_id = safe_get(player_csr, 'id')
+                    if player_id:
+                        entries[clean_xuid(player_id)] = player_csr
+            else:
+                entries = {xuid: playlist_csr_data for xuid in batch}
+        for xuid in batch:
+            csr_cache[(xuid, str(playlist_id))] = entries.get(xuid)
 
-async def process_match(client, player_info, match_id, match_number, csv_data, csv_headers, medal_names):
+async def get_cached_playlist_csr(client, csr_cache, playlist_id, player_xuid, tracked_xuids):
+    key = (player_xuid, str(playlist_id))
+    if key not in csr_cache:
+        # A miss fetches the playlist for every tracked player at once
+        xuids = list(dict.fromkeys(tracked_xuids + [player_xuid]))
+        try:
+            await single_flight(('csr', str(playlist_id)), lambda: fetch_playlist_csr(client, csr_cache, playlist_id, xuids))
+        except Exception as e:
+            instrumentation.error('playlist_csr', e)
+            return None
+    return csr_cache.get(key)
+
+async def build_player_row(client, match_id, match_stats, match_details, match_skill_fields, player, player_info, match_number, csv_headers, medal_names, csr_cache, tracked_xuids):
     player_gamertag = player_info["gamertag"]
     player_xuid = clean_xuid(player_info["xuid"])
+    game_type = match_details['game_type']
+    playlist_id = match_details['playlist_id']
+    player_team_id = safe_get(player, 'last_team_id', default=0)
+    readable_outcome = outcome_to_string(safe_get(player, 'outcome', default="Unknown"))
+    team_rank = 0
+    if hasattr(match_stats, 'teams'):
+        for team in match_stats.teams:
+            if safe_get(team, 'team_id') == player_team_id:
+                team_rank = safe_get(team, 'rank', default=0)
+                break
+    match_row = {
+        'player_gamertag': player_gamertag,
+        'player_xuid': player_xuid,
+        'match_number': match_number,
+        'match_id': match_id,
+        'date': match_details['date'],
+        'duration': match_details['duration'],
+        'game_type': game_type,
+        'map': match_details['map'],
+        'playlist': match_details['playlist'],
+        'playlist_id': playlist_id if playlist_id else 'Unknown',
+        'outcome': readable_outcome,
+        'team_id': player_team_id,
+        'team_rank': team_rank,
+        'kills': 0,
+        'deaths': 0,
+        'assists': 0,
+        'kd': 0,
+        'kda': 0,
+        'accuracy': 0,
+        'score': 0,
+        'medal_count': 0,
+        'current_csr_value': 0,
+        'current_csr_tier_name': '',
+        'current_csr_sub_tier_name': '',
+        'current_csr_measurement_matches_remaining': 0,
+        'current_csr_initial_measurement_matches': 0,
+        'current_csr_tier_start': 0,
+        'season_max_csr_value': 0,
+        'season_max_csr_tier_name': '',
+        'season_max_csr_sub_tier_name': '',
+        'all_time_max_csr_value': 0,
+        'all_time_max_csr_tier_name': '',
+        'all_time_max_csr_sub_tier_name': '',
+        'match_csr_value': 0,
+        'match_csr_tier_name': '',
+        'match_csr_sub_tier_name': '',
+        'match_mmr_value': 0
+    }
+    if hasattr(player, 'csr'):
+        player_csr_result = {'current': player.csr}
+        process_csr_data(player_csr_result, match_row)
+    match_row.update(match_skill_fields.get(player_xuid, {}))
+    playlist_to_check = playlist_id if playlist_id else DEFAULT_RANKED_PLAYLIST
+    player_csr = await get_cached_playlist_csr(client, csr_cache, playlist_to_check, player_xuid, tracked_xuids)
+    process_csr_data(player_csr, match_row)
+    player_team_stats = safe_get(player, 'player_team_stats', default=[])
+    player_team_stats = player_team_stats[0] if player_team_stats else None
+    if player_team_stats:
+        stats = safe_get(player_team_stats, 'stats')
+        if stats:
+            core = safe_get(stats, 'core_stats')
+            if core:
+                core_stat_names, kd_source = core_plan(core)
+                core_values = vars(core)
+                for stat_name in core_stat_names:
+                    stat_value = core_values[stat_name]
+                    if stat_name == 'medals':
+                        match_row['medal_count'] = len(stat_value)
+                        process_medals(stat_value, match_row, medal_names)
+                    elif stat_name == 'personal_scores':
+                        process_medals(stat_value, match_row, medal_names)
+                    elif stat_name == 'accuracy' and isinstance(stat_value, float):
+                        match_row['accuracy'] = stat_value * 100
+                    else:
+                        match_row[stat_name] = stat_value
+                        csv_headers.append(stat_name)
+                if kd_source == 'ratio':
+                    kills = core_values['kills']
+                    deaths = core_values['deaths']
+                    match_row['kd'] = round(kills / deaths, 2) if deaths > 0 else kills
+                elif kd_source:
+                    match_row['kd'] = getattr(core, kd_source)
+            stat_categories = tuple(category for category in field_names(stats) if category != 'core_stats')
+            stats_values = vars(stats)
+            for category in stat_categories:
+                category_stats = stats_values[category]
+                if category_stats:
+                    category_values = vars(category_stats)
+                    for stat_name, column_name, none_value in category_plan(category, category_stats):
+                        stat_value = category_values[stat_name]
+                        match_row[column_name] = none_value if stat_value is None else stat_value
+                        csv_headers.append(column_name)
+            for column_name in mode_default_columns(game_type, stat_categories):
+                if column_name not in match_row:
+                    match_row[column_name] = 0
+                    csv_headers.append(column_name)
+    return match_row
+
+async def process_match(client, match_id, match_players, medal_names, csr_cache, tracked_xuids):
+    # match_players holds (player_info, match_number) for every tracked player whose
+    # history contains this match; the match is fetched and parsed once for all of them.
+    player_gamertags = ', '.join(player_info["gamertag"] for player_info, _ in match_players)
     # Add a print statement to show each match ID as it's being processed
-    print(f"Processing match ID: {match_id} for player {player_gamertag}")
+    print(f"Processing match ID: {match_id} for player {player_gamertags}")
     
     try:
-        match_stats_response = await client.stats.get_match_stats(match_id)
-        match_stats = await match_stats_response.parse()
-    except Exception:
-        return
+        match_stats = await fetch_match_stats(client, match_id)
+    except Exception as e:
+        instrumentation.error('match_stats', e)
+        print(f"Could not load match {match_id}: {e}")
+        return []
     match_date = match_stats.match_info.start_time
     match_duration = match_stats.match_info.duration
     game_type = "Unknown"
@@ -208,10 +580,9 @@ async def process_match(client, player_info, match_id, match_number, csv_data, c
         game_type = raw_game_type if not isinstance(raw_game_type, int) and not (isinstance(raw_game_type, str) and raw_game_type.isdigit()) else f"Game Type: {raw_game_type}"
     game_variant = safe_get(match_stats.match_info, 'ugc_game_variant')
     if game_variant:
-        for name_attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']:
-            if hasattr(game_variant, name_attr):
-                game_type = getattr(game_variant, name_attr)
-                break
+        attr = name_attr(game_variant)
+        if attr:
+            game_type = getattr(game_variant, attr)
         if game_type.startswith("Game Type:") or game_type == "Unknown":
             asset_id = safe_get(game_variant, 'asset_id')
             if asset_id:
@@ -221,16 +592,15 @@ async def process_match(client, player_info, match_id, match_number, csv_data, c
                     if version_id:
                         break
                 if version_id:
-                    game_type = await get_game_variant_name(client, asset_id, version_id)
+                    game_type = await single_flight(('game_type', asset_id, version_id), lambda: get_game_variant_name(client, asset_id, version_id))
                 else:
                     game_type = f"Game Type ID: {asset_id}"
     map_name = "Unknown"
     map_variant = safe_get(match_stats.match_info, 'map_variant')
     if map_variant:
-        for name_attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']:
-            if hasattr(map_variant, name_attr):
-                map_name = getattr(map_variant, name_attr)
-                break
+        attr = name_attr(map_variant)
+        if attr:
+            map_name = getattr(map_variant, attr)
         if map_name == "Unknown":
             asset_id = safe_get(map_variant, 'asset_id')
             if asset_id:
@@ -240,17 +610,16 @@ async def process_match(client, player_info, match_id, match_number, csv_data, c
                     if version_id:
                         break
                 if version_id:
-                    map_name = await get_map_name(client, asset_id, version_id)
+                    map_name = await single_flight(('map', asset_id, version_id), lambda: get_map_name(client, asset_id, version_id))
                 else:
                     map_name = f"Map ID: {asset_id}"
     playlist = "Unknown"
     playlist_id = None
     playlist_obj = safe_get(match_stats.match_info, 'playlist')
     if playlist_obj:
-        for name_attr in ['name', 'asset_name', 'internal_name', 'display_name', 'public_name', 'title']:
-            if hasattr(playlist_obj, name_attr):
-                playlist = getattr(playlist_obj, name_attr)
-                break
+        attr = name_attr(playlist_obj)
+        if attr:
+            playlist = getattr(playlist_obj, attr)
         playlist_id = safe_get(playlist_obj, 'asset_id')
         if playlist == "Unknown" and playlist_id:
             version_id = None
@@ -259,348 +628,365 @@ async def process_match(client, player_info, match_id, match_number, csv_data, c
                 if version_id:
                     break
             if version_id:
-                playlist = await get_playlist_name(client, playlist_id, version_id)
+                playlist = await single_flight(('playlist', playlist_id, version_id), lambda: get_playlist_name(client, playlist_id, version_id))
             else:
                 playlist = f"Playlist ID: {playlist_id}"
+    match_details = {
+        'date': match_date.strftime('%Y-%m-%d %H:%M:%S') if isinstance(match_date, datetime) else str(match_date),
+        'duration': str(match_duration),
+        'game_type': game_type,
+        'map': map_name,
+        'playlist': playlist,
+        'playlist_id': playlist_id
+    }
+    record_roster(match_id, match_stats, match_details)
+    roster = {}
     for player in match_stats.players:
-        player_id = safe_get(player, 'player_id')
-        current_xuid = clean_xuid(player_id)
-        if current_xuid != player_xuid:
-            continue
-        player_team_id = safe_get(player, 'last_team_id', default=0)
-        readable_outcome = outcome_to_string(safe_get(player, 'outcome', default="Unknown"))
-        team_rank = 0
-        if hasattr(match_stats, 'teams'):
-            for team in match_stats.teams:
-                if safe_get(team, 'team_id') == player_team_id:
-                    team_rank = safe_get(team, 'rank', default=0)
-                    break
-        match_row = {
-            'player_gamertag': player_gamertag,
-            'player_xuid': player_xuid,
-            'match_number': match_number,
-            'match_id': match_id,
-            'date': match_date.strftime('%Y-%m-%d %H:%M:%S') if isinstance(match_date, datetime) else str(match_date),
-            'duration': str(match_duration),
-            'game_type': game_type,
-            'map': map_name,
-            'playlist': playlist,
-            'playlist_id': playlist_id if playlist_id else 'Unknown',
-            'outcome': readable_outcome,
-            'team_id': player_team_id,
-            'team_rank': team_rank,
-            'kills': 0,
-            'deaths': 0,
-            'assists': 0,
-            'kd': 0,
-            'kda': 0,
-            'accuracy': 0,
-            'score': 0,
-            'medal_count': 0,
-            'current_csr_value': 0,
-            'current_csr_tier_name': '',
-            'current_csr_sub_tier_name': '',
-            'current_csr_measurement_matches_remaining': 0,
-            'current_csr_initial_measurement_matches': 0,
-            'current_csr_tier_start': 0,
-            'season_max_csr_value': 0,
-            'season_max_csr_tier_name': '',
-            'season_max_csr_sub_tier_name': '',
-            'all_time_max_csr_value': 0,
-            'all_time_max_csr_tier_name': '',
-            'all_time_max_csr_sub_tier_name': '',
-            'match_csr_value': 0,
-            'match_csr_tier_name': '',
-            'match_csr_sub_tier_name': '',
-            'match_mmr_value': 0
-        }
-        if hasattr(player, 'csr'):
-            player_csr_result = {'current': player.csr}
-            process_csr_data(player_csr_result, match_row)
+        roster.setdefault(clean_xuid(safe_get(player, 'player_id')), player)
+    match_players = [(player_info, match_number) for player_info, match_number in match_players if clean_xuid(player_info["xuid"]) in roster]
+    # One skill lookup covers every tracked player in the match
+    match_skill_fields = {}
+    skill_xuids = list(dict.fromkeys(clean_xuid(player_info["xuid"]) for player_info, _ in match_players))
+    if skill_xuids:
         try:
-            match_skill_response = await client.skill.get_match_skill(
-                match_id=match_id,
-                xuids=[player_xuid]
-            )
-            if match_skill_response:
-                match_skill_data = await match_skill_response.parse()
-                if match_skill_data:
-                    if hasattr(match_skill_data, 'players') and match_skill_data.players:
-                        for player_skill in match_skill_data.players:
-                            player_id = safe_get(player_skill, 'id')
-                            if player_id and clean_xuid(player_id) == player_xuid:
-                                if hasattr(player_skill, 'csr'):
-                                    match_csr = player_skill.csr
-                                    if hasattr(match_csr, 'value'):
-                                        match_row['match_csr_value'] = match_csr.value
-                                    if hasattr(match_csr, 'tier'):
-                                        match_row['match_csr_tier_name'] = str(match_csr.tier)
-                                    if hasattr(match_csr, 'sub_tier'):
-                                        match_row['match_csr_sub_tier_name'] = str(match_csr.sub_tier)
-                                if hasattr(player_skill, 'mmr'):
-                                    match_mmr = player_skill.mmr
-                                    if hasattr(match_mmr, 'value'):
-                                        match_row['match_mmr_value'] = match_mmr.value
-                    elif hasattr(match_skill_data, 'value'):
-                        value_data = match_skill_data.value
-                        if hasattr(value_data, '__iter__') and not isinstance(value_data, str):
-                            for skill_value in value_data:
-                                player_id = safe_get(skill_value, 'id')
-                                if player_id and clean_xuid(player_id) == player_xuid:
-                                    skill_result = safe_get(skill_value, 'result')
-                                    if skill_result:
-                                        rank_recap = safe_get(skill_result, 'rank_recap')
-                                        if rank_recap:
-                                            pre_match_csr = safe_get(rank_recap, 'pre_match_csr')
-                                            if pre_match_csr:
-                                                if hasattr(pre_match_csr, 'value'):
-                                                    match_row['match_csr_value'] = pre_match_csr.value
-                                                if hasattr(pre_match_csr, 'tier'):
-                                                    match_row['match_csr_tier_name'] = str(pre_match_csr.tier)
-                                                if hasattr(pre_match_csr, 'sub_tier'):
-                                                    match_row['match_csr_sub_tier_name'] = str(pre_match_csr.sub_tier)
-                                            post_match_csr = safe_get(rank_recap, 'post_match_csr')
-                                            if post_match_csr:
-                                                if hasattr(post_match_csr, 'value'):
-                                                    match_row['post_match_csr_value'] = post_match_csr.value
-                                                if hasattr(post_match_csr, 'tier'):
-                                                    match_row['post_match_csr_tier_name'] = str(post_match_csr.tier)
-                                                if hasattr(post_match_csr, 'sub_tier'):
-                                                    match_row['post_match_csr_sub_tier_name'] = str(post_match_csr.sub_tier)
-                                        if hasattr(skill_result, 'team_mmr'):
-                                            match_row['match_mmr_value'] = skill_result.team_mmr
-                        elif hasattr(value_data, 'id') or hasattr(value_data, 'result'):
-                            player_id = safe_get(value_data, 'id')
-                            if player_id and clean_xuid(player_id) == player_xuid:
-                                if hasattr(value_data, 'csr'):
-                                    match_csr = value_data.csr
-                                    if hasattr(match_csr, 'value'):
-                                        match_row['match_csr_value'] = match_csr.value
-                                    if hasattr(match_csr, 'tier'):
-                                        match_row['match_csr_tier_name'] = str(match_csr.tier)
-                                    if hasattr(match_csr, 'sub_tier'):
-                                        match_row['match_csr_sub_tier_name'] = str(match_csr.sub_tier)
-                                if hasattr(value_data, 'mmr'):
-                                    match_mmr = value_data.mmr
-                                    if hasattr(match_mmr, 'value'):
-                                        match_row['match_mmr_value'] = match_mmr.value
-        except Exception:
-            pass
+            match_skill_fields = skill_fields_by_xuid(await fetch_match_skill(client, match_id, skill_xuids))
+        except Exception as e:
+            instrumentation.error('skill', e)
+    match_results = []
+    for player_info, match_number in match_players:
+        player = roster[clean_xuid(player_info["xuid"])]
+        row_headers = []
         try:
-            default_ranked_playlist = "edfef3ac-9cbe-4fa2-b949-8f29deafd483"
-            playlist_to_check = playlist_id if playlist_id else default_ranked_playlist
-            try:
-                playlist_csr_response = await client.skill.get_playlist_csr(
-                    playlist_id=playlist_to_check,
-                    xuids=[player_xuid]
-                )
-                if playlist_csr_response:
-                    playlist_csr_data = await playlist_csr_response.parse()
-                    if playlist_csr_data:
-                        if hasattr(playlist_csr_data, 'value'):
-                            results = playlist_csr_data.value
-                            for player_csr in results:
-                                player_id = safe_get(player_csr, 'id')
-                                if player_id and clean_xuid(player_id) == player_xuid:
-                                    process_csr_data(player_csr, match_row)
-                        else:
-                            process_csr_data(playlist_csr_data, match_row)
-            except Exception:
-                pass
-        except Exception:
-            pass
-        player_team_stats = safe_get(player, 'player_team_stats', default=[])
-        player_team_stats = player_team_stats[0] if player_team_stats else None
-        if player_team_stats:
-            stats = safe_get(player_team_stats, 'stats')
-            if stats:
-                core = safe_get(stats, 'core_stats')
-                if core:
-                    for stat_name, stat_value in vars(core).items():
-                        if stat_name.startswith('_'):
-                            continue
-                        if stat_name == 'medals':
-                            match_row['medal_count'] = len(stat_value)
-                            process_medals(stat_value, match_row, medal_names)
-                        elif stat_name == 'personal_scores':
-                            process_medals(stat_value, match_row, medal_names)
-                        else:
-                            if stat_name == 'accuracy' and isinstance(stat_value, float):
-                                match_row['accuracy'] = stat_value * 100
-                            elif stat_name not in ['medals', 'personal_scores']:
-                                match_row[stat_name] = stat_value
-                                if stat_name not in csv_headers:
-                                    csv_headers.append(stat_name)
-                    if hasattr(core, 'kd'):
-                        match_row['kd'] = getattr(core, 'kd')
-                    elif hasattr(core, 'kdr'):
-                        match_row['kd'] = getattr(core, 'kdr')
-                    elif hasattr(core, 'kills') and hasattr(core, 'deaths'):
-                        kills = getattr(core, 'kills')
-                        deaths = getattr(core, 'deaths')
-                        match_row['kd'] = round(kills / deaths, 2) if deaths > 0 else kills
-                stat_categories = [attr for attr in vars(stats) if not attr.startswith('_') and attr != 'core_stats']
-                for category in stat_categories:
-                    category_stats = getattr(stats, category, None)
-                    if category_stats:
-                        attr_dict = vars(category_stats)
-                        for stat_name, stat_value in attr_dict.items():
-                            if not stat_name.startswith('_'):
-                                column_name = f"{category}_{stat_name}"
-                                if stat_value is None:
-                                    if column_name.endswith(('_count', '_kills', '_score', '_ticks', '_captures', '_defusals',
-                                                               '_plants', '_returns', '_steals', '_grabs', '_secures', '_denied',
-                                                               '_survived', '_remaining', '_assists', '_executions', '_pick_ups',
-                                                               '_detonations')) or column_name.startswith(('time_', 'damage_')):
-                                        match_row[column_name] = 0
-                                    else:
-                                        match_row[column_name] = ''
-                                else:
-                                    match_row[column_name] = stat_value
-                                if column_name not in csv_headers:
-                                    csv_headers.append(column_name)
-                game_mode_defaults = {
-                    "bomb_stats": ["bomb_carriers_killed", "bomb_defusals", "bomb_defusers_killed", 
-                                  "bomb_detonations", "bomb_pick_ups", "bomb_plants", "bomb_returns", 
-                                  "kills_as_bomb_carrier", "time_as_bomb_carrier"],
-                    "capture_the_flag_stats": ["flag_capture_assists", "flag_captures", "flag_carriers_killed", 
-                                              "flag_grabs", "flag_returners_killed", "flag_returns", 
-                                              "flag_secures", "flag_steals", "kills_as_flag_carrier",
-                                              "kills_as_flag_returner", "time_as_flag_carrier"],
-                    "elimination_stats": ["allies_revived", "elimination_assists", "eliminations", 
-                                        "enemy_revives_denied", "executions", "kills_as_last_player_standing", 
-                                        "last_players_standing_killed", "rounds_survived", 
-                                        "times_revived_by_ally", "lives_remaining", "elimination_order"],
-                    "oddball_stats": ["kills_as_skull_carrier", "longest_time_as_skull_carrier", 
-                                    "skull_carriers_killed", "skull_grabs", "time_as_skull_carrier", 
-                                    "skull_scoring_ticks"],
-                    "zones_stats": ["zone_captures", "zone_defensive_kills", "zone_offensive_kills", 
-                                  "zone_secures", "total_zone_occupation_time", "zone_scoring_ticks",
-                                  "stronghold_captures", "stronghold_defensive_kills", 
-                                  "stronghold_offensive_kills", "stronghold_secures",
-                                  "stronghold_occupation_time", "stronghold_scoring_ticks"]
-                }
-                relevant_categories = []
-                game_type_lower = game_type.lower()
-                if any(term in game_type_lower for term in ["ctf", "flag", "capture the flag"]):
-                    relevant_categories.append("capture_the_flag_stats")
-                if any(term in game_type_lower for term in ["bomb", "assault"]):
-                    relevant_categories.append("bomb_stats")
-                if any(term in game_type_lower for term in ["elim", "elimination", "attrition"]):
-                    relevant_categories.append("elimination_stats")
-                if any(term in game_type_lower for term in ["oddball", "ball"]):
-                    relevant_categories.append("oddball_stats")
-                if any(term in game_type_lower for term in ["zone", "stronghold", "koth", "king", "control"]):
-                    relevant_categories.append("zones_stats")
-                for category in stat_categories:
-                    if category in game_mode_defaults and category not in relevant_categories:
-                        relevant_categories.append(category)
-                if not relevant_categories:
-                    relevant_categories = list(game_mode_defaults.keys())
-                for category in relevant_categories:
-                    if category in game_mode_defaults:
-                        for stat_name in game_mode_defaults[category]:
-                            column_name = f"{category}_{stat_name}"
-                            if column_name not in match_row:
-                                match_row[column_name] = 0
-                                if column_name not in csv_headers:
-                                    csv_headers.append(column_name)
-        csv_data.append(match_row)
-        return
-    csv_data.append(match_row)
-    return
+            with instrumentation.stage('row_build'):
+                match_row = await build_player_row(client, match_id, match_stats, match_details, match_skill_fields, player, player_info, match_number, row_headers, medal_names, csr_cache, tracked_xuids)
+        except Exception as e:
+            instrumentation.error('row_build', e)
+            continue
+        match_results.append((player_info, match_number, match_row, row_headers))
+    return match_results
 
-async def process_player_matches(client, player_info, match_count, match_type, csv_data, csv_headers, medal_names):
-    player_gamertag = player_info["gamertag"]
+async def run_bounded(semaphore, coro):
+    async with semaphore:
+        return await coro
+
+async def fetch_player_history(client, player_info, match_count, match_type, semaphore):
     player_xuid = clean_xuid(player_info["xuid"])
     try:
-        history_response = await client.stats.get_match_history(
-            player=player_xuid, 
-            start=0, 
-            count=match_count,
-            match_type=match_type
-        )
-        match_history = await history_response.parse()
+        with instrumentation.stage('history'):
+            history_response = await run_bounded(semaphore, client.stats.get_match_history(
+                player=player_xuid, 
+                start=0, 
+                count=match_count,
+                match_type=match_type
+            ))
+            match_history = await history_response.parse()
         if not match_history.results:
-            return
-        for i, match_result in enumerate(match_history.results):
-            match_id = match_result.match_id
-            await process_match(client, player_info, match_id, i+1, csv_data, csv_headers, medal_names)
-    except Exception:
-        pass
-
-async def run_multi_player_stats(match_count=5, match_type='all', save_to_csv=True, csv_filename='halo_multi_player_stats.csv'):
-    tokens = load_tokens()
-    spartan_token = tokens["spartan_token"]
-    clearance_token = tokens["clearance_token"]
-    csv_data = []
-    csv_headers = [
-        'player_gamertag', 'player_xuid',
-        'match_number', 'match_id', 'date', 'duration', 
-        'game_type', 'map', 'playlist', 'playlist_id', 
-        'outcome', 'team_id', 'team_rank',
-        'kills', 'deaths', 'assists', 'kd', 'kda', 
-        'accuracy', 'score', 'medal_count',
-        'match_csr_value', 'match_csr_tier_name', 'match_csr_sub_tier_name',
-        'match_mmr_value',
-        'current_csr_value', 'current_csr_tier_name', 'current_csr_sub_tier_name',
-        'current_csr_measurement_matches_remaining', 'current_csr_initial_measurement_matches',
-        'current_csr_tier_start',
-        'season_max_csr_value', 'season_max_csr_tier_name', 'season_max_csr_sub_tier_name',
-        'all_time_max_csr_value', 'all_time_max_csr_tier_name', 'all_time_max_csr_sub_tier_name'
-    ]
-    async with ClientSession() as session:
-        client = HaloInfiniteClient(
-            session=session,
-            spartan_token=spartan_token, 
-            clearance_token=clearance_token
-        )
-        medal_names = await get_medal_metadata(client)
-        for player in PLAYERS:
-            await process_player_matches(
-                client, 
-                player, 
-                match_count, 
-                match_type, 
-                csv_data, 
-                csv_headers, 
-                medal_names
-            )
-        if save_to_csv and csv_data:
-            try:
-                additional_headers = []
-                for row in csv_data:
-                    for key in row.keys():
-                        if key not in csv_headers and key not in additional_headers:
-                            additional_headers.append(key)
-                csv_headers.extend(additional_headers)
-                with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=csv_headers)
-                    writer.writeheader()
-                    for row in csv_data:
-                        for header in csv_headers:
-                            if header not in row:
-                                if (header.startswith(('current_csr_', 'season_max_csr_', 'all_time_max_csr_')) and 
-                                    header.endswith(('_id', '_value', '_start', '_remaining', '_matches'))) or \
-                                   (header in ['kills', 'deaths', 'assists', 'kd', 'kda', 'score', 'medal_count', 'accuracy']) or \
-                                   header.endswith(('_count', '_kills', '_score', '_ticks', '_captures', '_defusals', '_plants', 
-                                                  '_returns', '_steals', '_grabs', '_secures', '_denied', '_survived', '_remaining', 
-                                                  '_assists', '_executions', '_pick_ups', '_detonations')) or \
-                                   header.startswith(('time_', 'damage_', 'medal_')) or \
-                                   'time_as_' in header:
-                                    row[header] = 0
-                                elif header.endswith('_name') and header.startswith(('current_csr_', 'season_max_csr_', 'all_time_max_csr_')):
-                                    row[header] = ''
-                                else:
-                                    row[header] = ''
-                        writer.writerow(row)
-            except Exception:
-                pass
+            return []
+        return [match_result.match_id for match_result in match_history.results]
+    except Exception as e:
+        instrumentation.error('history', e)
+        print(f"Could not load match history for {player_info['gamertag']}: {e}")
+        return []
+
+async def fetch_new_player_history(client, player_info, match_type, high_water_mark, max_matches, semaphore):
+    # Page backwards from the newest match until the high-water mark is reached, so an
+    # incremental run only requests the pages holding matches it hasn't seen.
+    player_xuid = clean_xuid(player_info["xuid"])
+    known_match_id = high_water_mark.get('match_id') if high_water_mark else None
+    known_start_time = datetime.fromisoformat(high_water_mark['start_time']) if high_water_mark and high_water_mark.get('start_time') else None
+    new_matches = []
+    start = 0
+    try:
+        while len(new_matches) < max_matches:
+            count = min(HISTORY_PAGE_SIZE, max_matches - len(new_matches))
+            with instrumentation.stage('history'):
+                history_response = await run_bounded(semaphore, client.stats.get_match_history(
+                    player=player_xuid,
+                    start=start,
+                    count=count,
+                    match_type=match_type
+                ))
+                match_history = await history_response.parse()
+            results = match_history.results or []
+            for match_result in results:
+                match_start = safe_get(match_result, 'match_info', 'start_time')
+                if str(match_result.match_id) == known_match_id:
+                    return new_matches
+                if known_start_time and isinstance(match_start, datetime) and match_start <= known_start_time:
+                    return new_matches
+                new_matches.append((match_result.match_id, match_start))
+            if len(results) < count:
+                break
+            start += count
+    except Exception as e:
+        # A partial page walk would leave a gap behind the high-water mark
+        instrumentation.error('history', e)
+        print(f"Could not load match history for {player_info['gamertag']}: {e}")
+        return []
+    if known_match_id and len(new_matches) >= max_matches:
+        print(f"More than {max_matches} new matches for {player_info['gamertag']}; older ones were skipped")
+    return new_matches
+
+def advance_high_water_mark(high_water_mark, new_matches, processed_match_ids):
+    # Only move past matches that produced a row, oldest first, so a failed match is
+    # retried on the next run instead of being skipped forever.
+    for match_id, match_start in reversed(new_matches):
+        if str(match_id) not in processed_match_ids:
+            break
+        high_water_mark = {
+            'match_id': str(match_id),
+            'start_time': match_start.isoformat() if isinstance(match_start, datetime) else None
+        }
+    return high_water_mark
+
+def group_matches(players, player_histories):
+    # Fan-out table: each unique match_id maps to every tracked player that has it in
+    # their history, in first-seen order so scheduling is deterministic.
+    match_players = {}
+    for player_info, match_ids in zip(players, player_histories):
+        for i, match_id in enumerate(match_ids):
+            match_players.setdefault(match_id, []).append((player_info, i+1))
+    return match_players
+
+BASE_CSV_HEADERS = [
+    'player_gamertag', 'player_xuid',
+    'match_number', 'match_id', 'date', 'duration', 
+    'game_type', 'map', 'playlist', 'playlist_id', 
+    'outcome', 'team_id', 'team_rank',
+    'kills', 'deaths', 'assists', 'kd', 'kda', 
+    'accuracy', 'score', 'medal_count',
+    'match_csr_value', 'match_csr_tier_name', 'match_csr_sub_tier_name',
+    'match_mmr_value',
+    'current_csr_value', 'current_csr_tier_name', 'current_csr_sub_tier_name',
+    'current_csr_measurement_matches_remaining', 'current_csr_initial_measurement_matches',
+    'current_csr_tier_start',
+    'season_max_csr_value', 'season_max_csr_tier_name', 'season_max_csr_sub_tier_name',
+    'all_time_max_csr_value', 'all_time_max_csr_tier_name', 'all_time_max_csr_sub_tier_name'
+]
+
+@asynccontextmanager
+async def open_halo_client(metadata_cache_file=METADATA_CACHE_FILE, response_cache_file=RESPONSE_CACHE_FILE, offline=False,
+                           max_connections=HTTP_MAX_CONNECTIONS, max_connections_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                           token_file=TOKEN_FILE, roster_file=None, rate_budget=None):
+    # offline yields a client that never touches the network, for rebuilding rows from response_store;
+    # roster_file opens roster_index so every processed match's full roster is kept;
+    # rate_budget (a SharedRateBudget) caps requests across every process sharing it
+    global metadata_store, response_store, roster_index
+    metadata_store = MetadataCache(metadata_cache_file) if metadata_cache_file else None
+    response_store = ResponseCache(response_cache_file) if response_cache_file else None
+    roster_index = RosterIndex(roster_file) if roster_file else None
+    if metadata_store is not None:
+        instrumentation.metrics.add_source('metadata_cache', metadata_store.stats)
+    if response_store is not None:
+        instrumentation.metrics.add_source('response_cache', response_store.stats)
+    try:
+        if offline:
+            yield OfflineClient()
+        else:
+            # Every call shares one adaptive limiter; spnkr's per-service limit is only a ceiling
+            rate_limiter = AdaptiveRateLimiter(budget=rate_budget)
+            # One pooled session serves every call for every player in the run
+            connection_stats = ConnectionStats()
+            async with create_session(connection_stats, max_connections, max_connections_per_host) as session, create_session() as auth_session:
+                # Tokens are refreshed in-process before they expire, so long runs never stall on auth.
+                # spnkr puts the spartan and clearance tokens in the API session's default headers,
+                # so sign-in requests go through their own session and never send them to Xbox Live.
+                token_manager = TokenManager(auth_session, token_file)
+                spartan_token, clearance_token = await token_manager.get_tokens()
+                instrumentation.metrics.add_source('tokens', token_manager.stats)
+                instrumentation.metrics.add_source('rate_limiter', rate_limiter.stats)
+                instrumentation.metrics.add_source('http', connection_stats.stats)
+                try:
+                    yield RateLimitedClient(TokenRefreshingClient(HaloInfiniteClient(
+                        session=session,
+                        spartan_token=spartan_token, 
+                        clearance_token=clearance_token,
+                        requests_per_second=MAX_REQUESTS_PER_SECOND
+                    ), token_manager), rate_limiter)
+                finally:
+                    print(f"Token refreshes: {token_manager.stats()}")
+                    print(f"Rate limiter: {rate_limiter.stats()}")
+                    print(f"HTTP connections: {connection_stats.stats()}")
+                    for source in ('tokens', 'rate_limiter', 'http'):
+                        instrumentation.metrics.close_source(source)
+    finally:
+        if metadata_store is not None:
+            print(f"Metadata cache: {metadata_store.stats()}")
+            instrumentation.metrics.close_source('metadata_cache')
+            metadata_store.close()
+            metadata_store = None
+        if response_store is not None:
+            print(f"Response cache: {response_store.stats()}")
+            instrumentation.metrics.close_source('response_cache')
+            response_store.close()
+            response_store = None
+        if roster_index is not None:
+            print(f"Roster index: {roster_index.stats()}")
+            roster_index.close()
+            roster_index = None
+
+async def process_matches(client, players, match_players, medal_names, csr_cache, semaphore, on_rows, parse_pool=None):
+    # Rows are handed to on_rows as soon as every row before them (by player, then
+    # match_number) is finished, so output streams out in the same order a
+    # sequential run would produce it without holding the whole run in memory.
+    # parse_pool (a parse_pool.ParsePool) moves parsing of cached matches to worker processes.
+    tracked_xuids = [clean_xuid(player["xuid"]) for player in players]
+    player_order = {id(player_info): index for index, player_info in enumerate(players)}
+    slots = sorted(
+        (player_order[id(player_info)], match_number, str(match_id))
+        for match_id, players_in_match in match_players.items()
+        for player_info, match_number in players_in_match
+    )
+    finished_slots = {}
+    next_slot = 0
+
+    def flush_ready_rows():
+        nonlocal next_slot
+        ready_results = []
+        while next_slot < len(slots) and slots[next_slot] in finished_slots:
+            match_result = finished_slots.pop(slots[next_slot])
+            if match_result is not None:
+                ready_results.append(match_result)
+            next_slot += 1
+        if ready_results:
+            on_rows(ready_results)
+
+    async def run_match(match_id, players_in_match):
+        try:
+            if parse_pool is not None:
+                match_results = await run_bounded(semaphore, parse_pool.process_match(match_id, players_in_match))
+            else:
+                match_results = await run_bounded(semaphore, process_match(client, match_id, players_in_match, medal_names, csr_cache, tracked_xuids))
+        except Exception as e:
+            instrumentation.error('match', e)
+            match_results = []
+        results_by_slot = {(player_order[id(result[0])], result[1], str(match_id)): result for result in match_results}
+        for player_info, match_number in players_in_match:
+            slot = (player_order[id(player_info)], match_number, str(match_id))
+            finished_slots[slot] = results_by_slot.get(slot)
+        flush_ready_rows()
+
+    await asyncio.gather(*[
+        run_match(match_id, players_in_match)
+        for match_id, players_in_match in match_players.items()
+    ])
+    return len(match_players)
+
+def open_writers(save_to_csv=True, csv_filename='halo_multi_player_stats.csv', parquet_dir=None, sqlite_file=None, aggregate_file=None):
+    # parquet_dir and sqlite_file add Parquet (partitioned by player and date) and SQLite outputs;
+    # aggregate_file keeps running per-player totals up to date as rows are written
+    writers = []
+    if save_to_csv:
+        writers.append(StreamingCsvWriter(csv_filename, BASE_CSV_HEADERS))
+    if parquet_dir:
+        writers.append(ParquetWriter(parquet_dir, BASE_CSV_HEADERS))
+    if sqlite_file:
+        writers.append(SqliteStatsStore(sqlite_file, BASE_CSV_HEADERS))
+    if aggregate_file:
+        writers.append(AggregateStore(aggregate_file))
+    return writers
+
+async def flush_writers(writers):
+    # Writers that share a database with other processes keep rows pending while it is
+    # locked; those are retried here, with the event loop free in between
+    with instrumentation.stage('write'):
+        for writer in writers:
+            writer.flush()
+    while any(getattr(writer, 'pending', None) for writer in writers):
+        await asyncio.sleep(WRITE_LOCK_RETRY)
+        with instrumentation.stage('write'):
+            for writer in writers:
+                if getattr(writer, 'pending', None):
+                    writer.flush()
+
+def skip_written_matches(match_players, writers):
+    # Matches already in every output never change, so they aren't fetched again. The
+    # skipped (xuid, match_id) keys are returned too, since they count as processed
+    # when the high-water mark is advanced.
+    if not writers:
+        return match_players, set()
+    new_match_players = {}
+    skipped = set()
+    for match_id, players_in_match in match_players.items():
+        for player_info, match_number in players_in_match:
+            key = (clean_xuid(player_info["xuid"]), str(match_id))
+            if all(key in writer.keys for writer in writers):
+                skipped.add(key)
+            else:
+                new_match_players.setdefault(match_id, []).append((player_info, match_number))
+    return new_match_players, skipped
+
+def add_processed_matches(processed_match_ids, keys):
+    for player_xuid, match_id in keys:
+        processed_match_ids.setdefault(player_xuid, set()).add(match_id)
+
+async def run_multi_player_stats(match_count=5, match_type='all', save_to_csv=True, csv_filename='halo_multi_player_stats.csv', max_in_flight=DEFAULT_MAX_IN_FLIGHT, metadata_cache_file=METADATA_CACHE_FILE, incremental=False, sync_state_file=SYNC_STATE_FILE, parquet_dir=None, sqlite_file=None, response_cache_file=RESPONSE_CACHE_FILE, token_file=TOKEN_FILE, report_file=RUN_REPORT_FILE, aggregate_file=None, roster_file=None):
+    # report_file gets a JSON breakdown of where the run's time went; None skips it
+    instrumentation.reset()
+    writers = open_writers(save_to_csv, csv_filename, parquet_dir, sqlite_file, aggregate_file)
+    processed_match_ids = {}
+
+    def write_rows(match_results):
+        for _, _, match_row, row_headers in match_results:
+            processed_match_ids.setdefault(str(match_row['player_xuid']), set()).add(str(match_row['match_id']))
+            with instrumentation.stage('write'):
+                for writer in writers:
+                    writer.write_rows([match_row], row_headers)
+
+    try:
+        async with open_halo_client(metadata_cache_file, response_cache_file, token_file=token_file, roster_file=roster_file) as client:
+            medal_names = await get_medal_metadata(client)
+            semaphore = asyncio.Semaphore(max_in_flight)
+            # Current/max playlist CSR doesn't change within a run, so it is cached per (xuid, playlist)
+            csr_cache = {}
+            if incremental:
+                # match_count caps how many new matches are taken per player
+                sync_state = load_sync_state(sync_state_file)
+                new_player_matches = await asyncio.gather(*[
+                    fetch_new_player_history(
+                        client,
+                        player,
+                        match_type,
+                        sync_state.get(clean_xuid(player["xuid"])),
+                        match_count,
+                        semaphore
+                    )
+                    for player in PLAYERS
+                ])
+                player_histories = [[match_id for match_id, _ in new_matches] for new_matches in new_player_matches]
+            else:
+                player_histories = await asyncio.gather(*[
+                    fetch_player_history(
+                        client, 
+                        player, 
+                        match_count, 
+                        match_type, 
+                        semaphore
+                    )
+                    for player in PLAYERS
+                ])
+            match_players, written_keys = skip_written_matches(group_matches(PLAYERS, player_histories), writers)
+            await process_matches(client, PLAYERS, match_players, medal_names, csr_cache, semaphore, write_rows)
+            add_processed_matches(processed_match_ids, written_keys)
+    finally:
+        with instrumentation.stage('write'):
+            for writer in writers:
+                writer.close()
+        if report_file:
+            instrumentation.metrics.write_report(report_file)
+    if incremental and writers:
+        for player, new_matches in zip(PLAYERS, new_player_matches):
+            player_xuid = clean_xuid(player["xuid"])
+            high_water_mark = advance_high_water_mark(sync_state.get(player_xuid), new_matches, processed_match_ids.get(player_xuid, set()))
+            if high_water_mark:
+                sync_state[player_xuid] = high_water_mark
+        save_sync_state(sync_state, sync_state_file)
 
 if __name__ == "__main__":
     asyncio.run(run_multi_player_stats(
         match_count=5,
         match_type='all',
         save_to_csv=True,
-        csv_filename='halo_multi_player_stats.csv'
+        csv_filename='halo_multi_player_stats.csv',
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT
     ))
@@ -0,0 +1,62 @@
+import time
+import sqlite3
+from spnkr.models.refdata import Outcome
+from aggregate_store import AggregateStore
+from stats import outcome_to_string
+
+
+def row(match_id, outcome, kills=10, deaths=5):
+    return {
+        'player_xuid': '1', 'match_id': match_id, 'date': f'2024-01-01 00:0{match_id}:00', 'playlist_id': 'p',
+        'map': 'Aquarius', 'game_type': 'Slayer', 'outcome': outcome_to_string(outcome), 'kills': kills,
+        'deaths': deaths, 'duration': '0:10:00'
+    }
+
+
+def test_outcome_totals_from_spnkr_outcomes(tmp_path):
+    store = AggregateStore(str(tmp_path / 'aggregates.sqlite'))
+    try:
+        outcomes = [Outcome.WIN, Outcome.LOSS, Outcome.LOSS, Outcome.TIE, Outcome.DID_NOT_FINISH]
+        assert store.write_rows([row(str(i), outcome) for i, outcome in enumerate(outcomes)]) == 5
+        totals, = store.totals()
+        recent = store.recent_form('1')
+    finally:
+        store.close()
+    assert (totals['matches'], totals['wins'], totals['losses'], totals['ties']) == (5, 1, 2, 1)
+    assert totals['win_rate'] == 20
+    assert (recent['wins'], recent['losses'], recent['ties']) == (1, 2, 1)
+
+
+def test_rows_counted_by_another_process_are_skipped(tmp_path):
+    path = str(tmp_path / 'aggregates.sqlite')
+    first = AggregateStore(path)
+    second = AggregateStore(path)
+    try:
+        assert first.write_rows([row('1', Outcome.WIN)]) == 1
+        # second read its keys before first counted the row
+        assert second.write_rows([row('1', Outcome.WIN), row('2', Outcome.LOSS)]) == 1
+        totals, = second.totals()
+    finally:
+        first.close()
+        second.close()
+    assert (totals['matches'], totals['wins'], totals['losses'], totals['kills']) == (2, 1, 1, 20)
+
+
+def test_locked_database_keeps_rows_pending(tmp_path):
+    path = str(tmp_path / 'aggregates.sqlite')
+    store = AggregateStore(path)
+    other = sqlite3.connect(path, isolation_level=None)
+    try:
+        other.execute('BEGIN IMMEDIATE')
+        started = time.monotonic()
+        assert store.write_rows([row('1', Outcome.WIN)]) == 0
+        assert time.monotonic() - started < 1
+        assert len(store.pending) == 1 and store.lock_waits == 1
+        other.execute('COMMIT')
+        store.flush()
+        assert store.pending == []
+        totals, = store.totals()
+    finally:
+        other.close()
+        store.close()
+    assert totals['matches'] == 1
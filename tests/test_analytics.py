@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip('pandas')
+
+from analytics import MatchTable, analytics_columns
+
+
+ROWS = [
+    {'player_xuid': '1', 'match_id': 'a', 'date': '2024-01-01 00:00:00', 'duration': '0:10:00', 'outcome': 'Win',
+     'kills': 10, 'deaths': 5, 'medal_count': 3, 'medal_killing_spree': 1, 'medal_perfect': 2},
+    {'player_xuid': '1', 'match_id': 'b', 'date': '2024-01-02 00:00:00', 'duration': '0:10:00', 'outcome': 'Loss',
+     'kills': 4, 'deaths': 8, 'medal_count': 1, 'medal_killing_spree': 1, 'medal_perfect': 0},
+]
+
+
+def test_medal_count_is_not_a_medal():
+    assert analytics_columns(['kills', 'medal_count', 'medal_perfect']) == ['kills', 'medal_perfect']
+    rates = MatchTable.from_rows(ROWS).medal_rates()
+    assert list(rates.columns) == ['killing_spree', 'perfect']
+    assert rates.loc['1', 'perfect'] == pytest.approx(1.0)
+
+
+def test_zero_csr_is_unranked_and_outcomes_follow_spnkr():
+    from spnkr.models.refdata import Outcome
+    from stats import outcome_to_string
+    rows = [
+        {'player_xuid': '1', 'match_id': match_id, 'date': f'2024-01-0{day} 00:00:00', 'playlist_id': 'ranked',
+         'outcome': outcome_to_string(outcome), 'match_csr_value': before, 'post_match_csr_value': after}
+        for day, match_id, outcome, before, after in [
+            (1, 'a', Outcome.WIN, 1500, 1510),
+            (2, 'b', Outcome.LOSS, 0, 0),
+            (3, 'c', Outcome.LOSS, 1510, 0),
+            (4, 'd', Outcome.TIE, 1502, 1502),
+        ]
+    ]
+    table = MatchTable.from_rows(rows)
+    deltas = table.csr_deltas().set_index('match_id')['csr_delta']
+    assert deltas['a'] == 10
+    assert deltas['b'] != deltas['b']
+    # No post-match CSR was recorded, so the next ranked match's CSR is used
+    assert deltas['c'] == -8
+    assert list(table.streaks()['streak']) == [1, -1, -2, 0]
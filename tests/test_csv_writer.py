@@ -0,0 +1,27 @@
+import csv
+from csv_writer import StreamingCsvWriter
+
+BASE_HEADERS = ['player_xuid', 'match_id', 'map', 'kills']
+
+
+def test_compact_pads_rows_written_before_new_columns(tmp_path):
+    path = str(tmp_path / 'stats.csv')
+    writer = StreamingCsvWriter(path, BASE_HEADERS)
+    writer.write_rows([
+        {'player_xuid': '1', 'match_id': 'a', 'map': 'Live Fire', 'kills': 10},
+        {'player_xuid': '1', 'match_id': 'b', 'map': 'Aquarius, "Night"', 'kills': 7},
+        {'player_xuid': '1', 'match_id': 'c', 'map': 'Line\nbreak', 'kills': 3}
+    ])
+    writer.write_rows([{'player_xuid': '2', 'match_id': 'a', 'map': 'Recharge', 'kills': 4, 'medal_perfect': 1}])
+    writer.write_rows([{'player_xuid': '2', 'match_id': 'b', 'map': 'Streets', 'kills': 5, 'medal_perfect': 2, 'notes': 'x'}])
+    writer.close()
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        BASE_HEADERS + ['medal_perfect', 'notes'],
+        ['1', 'a', 'Live Fire', '10', '0', ''],
+        ['1', 'b', 'Aquarius, "Night"', '7', '0', ''],
+        ['1', 'c', 'Line\nbreak', '3', '0', ''],
+        ['2', 'a', 'Recharge', '4', '1', ''],
+        ['2', 'b', 'Streets', '5', '2', 'x']
+    ]
@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+import asyncio
+from http_session import ConnectionStats
+
+
+def test_latency_samples_are_bounded():
+    stats = ConnectionStats(latency_samples=100)
+
+    async def record(count):
+        for i in range(count):
+            context = SimpleNamespace()
+            await stats._on_request_start(None, context, SimpleNamespace(url=SimpleNamespace(host='api')))
+            context.started -= i / 1000
+            await stats._on_request_end(None, context, None)
+
+    asyncio.run(record(1000))
+    assert len(stats.latencies) == 100
+    summary = stats.stats()
+    assert summary['hosts']['api']['requests'] == 1000
+    # Only the most recent requests (900-999 ms) are in the percentiles
+    assert 0.9 <= summary['latency_p50'] <= 1.0
@@ -0,0 +1,50 @@
+import os
+import json
+import asyncio
+from functools import partial
+import stats
+from benchmark import SPNKR_SERVICES, write_benchmark_tokens
+from fake_halo_api import FakeHaloApi
+from rate_limiter import AdaptiveRateLimiter
+
+PLAYERS = [{"gamertag": f"Player {i + 1}", "xuid": str(2535400100000000 + i)} for i in range(2)]
+DEPTH = 4
+
+
+def test_incremental_sync_after_full_sync_sets_high_water_mark(tmp_path, monkeypatch):
+    api = FakeHaloApi([player["xuid"] for player in PLAYERS], DEPTH, latency=0, latency_jitter=0)
+    monkeypatch.setattr(stats, 'PLAYERS', PLAYERS)
+    monkeypatch.setattr(stats, 'AdaptiveRateLimiter', partial(AdaptiveRateLimiter, rate=500, max_rate=500))
+    token_file = str(tmp_path / 'tokens.json')
+    sync_state_file = str(tmp_path / 'sync_state.json')
+    write_benchmark_tokens(token_file)
+    run = partial(
+        stats.run_multi_player_stats,
+        match_count=DEPTH,
+        csv_filename=str(tmp_path / 'stats.csv'),
+        metadata_cache_file=str(tmp_path / 'metadata.sqlite'),
+        response_cache_file=None,
+        sync_state_file=sync_state_file,
+        token_file=token_file,
+        report_file=None
+    )
+
+    async def sync_twice():
+        base_url = await api.start()
+        for service in SPNKR_SERVICES:
+            monkeypatch.setattr(service, '_HOST', base_url)
+        try:
+            await run()
+            stats_requests = api.requests['/hi/matches/{match_id}/stats']
+            # Every match was written by the full sync, so none is fetched again
+            await run(incremental=True)
+            assert api.requests['/hi/matches/{match_id}/stats'] == stats_requests
+        finally:
+            await api.stop()
+
+    asyncio.run(sync_twice())
+    assert os.path.exists(sync_state_file)
+    with open(sync_state_file, 'r') as f:
+        sync_state = json.load(f)
+    for player in PLAYERS:
+        assert sync_state[player["xuid"]]['match_id'] == api.histories[player["xuid"]][0]
@@ -0,0 +1,31 @@
+import sqlite3
+from metadata_cache import MetadataCache
+
+
+def last_used(path, kind, key):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT last_used FROM metadata WHERE kind = ? AND key = ?', (kind, key)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_hits_are_served_from_memory_and_touches_written_on_close(tmp_path):
+    path = str(tmp_path / 'metadata.sqlite')
+    cache = MetadataCache(path)
+    cache.set('map', 'a:1', 'Aquarius')
+    cache.set_negative('map', 'b:1', 'Unknown')
+    stored_at = last_used(path, 'map', 'a:1')
+    cache.conn.execute('DELETE FROM metadata')
+    cache.conn.commit()
+    # Stored and missing entries alike are answered without reading SQLite again
+    assert cache.get('map', 'a:1') == (True, 'Aquarius', False)
+    assert cache.get('map', 'b:1') == (True, 'Unknown', True)
+    assert cache.get('map', 'c:1') == (False, None, False)
+    cache.set('map', 'a:1', 'Aquarius')
+    assert cache.get('map', 'a:1') == (True, 'Aquarius', False)
+    assert last_used(path, 'map', 'a:1') >= stored_at
+    touched_at = cache.touched[('map', 'a:1')]
+    cache.close()
+    assert last_used(path, 'map', 'a:1') == touched_at
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
@@ -0,0 +1,51 @@
+import os
+import json
+from datetime import datetime, timedelta
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from parquet_writer import ParquetWriter, read_parquet_dataset
+
+ROW = {
+    'player_xuid': '1', 'match_id': 'a', 'match_number': 3, 'date': datetime(2024, 1, 1, 12),
+    'duration': timedelta(minutes=10), 'outcome': 'Win', 'team_id': 1, 'team_rank': 2, 'kills': 10, 'kd': 2,
+    'match_csr_value': 1450, 'match_csr_tier_name': 'Diamond', 'match_mmr_value': 1500,
+    'post_match_csr_value': 1462, 'pvp_stats_kda': 5, 'medal_perfect': 1
+}
+
+
+def test_saved_schema_types_follow_the_values(tmp_path):
+    output_dir = str(tmp_path / 'parquet')
+    writer = ParquetWriter(output_dir, list(ROW))
+    writer.write_rows([ROW])
+    writer.close()
+    with open(os.path.join(output_dir, '_schema.json'), 'r') as f:
+        types = json.load(f)['types']
+    assert types == {
+        'player_xuid': 'string', 'match_id': 'string', 'match_number': 'int', 'date': 'timestamp',
+        'duration': 'seconds', 'outcome': 'string', 'team_id': 'int', 'team_rank': 'int', 'kills': 'int', 'kd': 'float',
+        'match_csr_value': 'int', 'match_csr_tier_name': 'string', 'match_mmr_value': 'float',
+        'post_match_csr_value': 'int', 'pvp_stats_kda': 'float', 'medal_perfect': 'int'
+    }
+    table = read_parquet_dataset(output_dir, columns=['match_csr_value', 'match_mmr_value'])
+    assert table.to_pylist() == [{'match_csr_value': 1450, 'match_mmr_value': 1500.0}]
+
+
+def test_flushes_append_to_the_partition_file(tmp_path):
+    output_dir = str(tmp_path / 'parquet')
+    writer = ParquetWriter(output_dir, list(ROW))
+    for i in range(3):
+        row = dict(ROW, match_id=str(i), kd=2.5 if i else 2)
+        # A column that only shows up after the first flush
+        writer.write_rows([row], ['medal_killjoy'] if i == 2 else ())
+        writer.flush()
+    writer.close()
+    partition_dir = os.path.join(output_dir, 'player_xuid=1', 'date=2024-01-01')
+    assert len(os.listdir(partition_dir)) == 1
+    table = read_parquet_dataset(output_dir, columns=['match_id', 'kd', 'medal_killjoy'])
+    assert sorted(table.to_pylist(), key=lambda row: row['match_id']) == [
+        {'match_id': '0', 'kd': 2.0, 'medal_killjoy': 0},
+        {'match_id': '1', 'kd': 2.5, 'medal_killjoy': 0},
+        {'match_id': '2', 'kd': 2.5, 'medal_killjoy': 0}
+    ]
@@ -0,0 +1,51 @@
+import time
+import sqlite3
+import asyncio
+from rate_limiter import SharedRateBudget
+
+
+def test_locked_budget_does_not_block_the_event_loop(tmp_path):
+    path = str(tmp_path / 'budget.sqlite')
+    budget = SharedRateBudget(path, rate=100, burst=1)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+
+    async def main():
+        gaps = []
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.5, other.execute, 'COMMIT')
+
+        async def tick():
+            last = time.monotonic()
+            while True:
+                await asyncio.sleep(0.01)
+                gaps.append(time.monotonic() - last)
+                last = time.monotonic()
+
+        ticker = asyncio.ensure_future(tick())
+        started = time.monotonic()
+        await budget.acquire()
+        ticker.cancel()
+        return time.monotonic() - started, max(gaps)
+
+    try:
+        waited, longest_gap = asyncio.run(main())
+    finally:
+        other.close()
+        budget.close()
+    assert waited >= 0.45
+    assert longest_gap < 0.2
+    assert budget.stats()['lock_waits'] > 0
+
+
+def test_pause_is_shared_with_other_processes(tmp_path):
+    path = str(tmp_path / 'budget.sqlite')
+    first = SharedRateBudget(path, rate=100, burst=5)
+    second = SharedRateBudget(path, rate=100, burst=5)
+    try:
+        first.pause(60)
+        assert first._take() > 59
+        assert second._take() > 59
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,51 @@
+import sqlite3
+from datetime import datetime, timedelta
+from sqlite_store import SqliteStatsStore
+
+BASE_HEADERS = [
+    'player_gamertag', 'player_xuid', 'match_number', 'match_id', 'date', 'duration', 'outcome', 'team_id',
+    'team_rank', 'kills', 'kd', 'match_csr_value', 'match_csr_tier_name', 'match_mmr_value'
+]
+ROW = {
+    'player_gamertag': 'Player', 'player_xuid': '1', 'match_number': 3, 'match_id': 'a',
+    'date': datetime(2024, 1, 1, 12), 'duration': timedelta(minutes=10), 'outcome': 'Win', 'team_id': 1,
+    'team_rank': 2, 'kills': 10, 'kd': 2, 'match_csr_value': 1450, 'match_csr_tier_name': 'Diamond',
+    'match_mmr_value': 1500, 'post_match_csr_value': 1462, 'pvp_stats_kda': 5, 'medal_perfect': 1
+}
+
+
+def test_declared_column_types_follow_the_values(tmp_path):
+    path = str(tmp_path / 'stats.sqlite')
+    store = SqliteStatsStore(path, BASE_HEADERS)
+    store.write_rows([ROW])
+    store.close()
+    conn = sqlite3.connect(path)
+    try:
+        declared = {name: column_type for _, name, column_type, *_ in conn.execute('PRAGMA table_info(matches)')}
+        ordered = [csr for csr, in conn.execute('SELECT match_csr_value FROM matches ORDER BY match_csr_value')]
+    finally:
+        conn.close()
+    assert declared == {
+        'match_id': 'TEXT', 'player_xuid': 'TEXT', 'date': 'TEXT', 'playlist_id': 'TEXT', 'player_gamertag': 'TEXT',
+        'match_number': 'INTEGER', 'duration': 'REAL', 'outcome': 'TEXT', 'team_id': 'INTEGER', 'team_rank': 'INTEGER',
+        'kills': 'INTEGER', 'kd': 'REAL', 'match_csr_value': 'INTEGER', 'match_csr_tier_name': 'TEXT',
+        'match_mmr_value': 'REAL', 'post_match_csr_value': 'INTEGER', 'pvp_stats_kda': 'REAL'
+    }
+    assert ordered == [1450]
+
+
+def test_locked_database_keeps_rows_pending(tmp_path):
+    path = str(tmp_path / 'stats.sqlite')
+    store = SqliteStatsStore(path, BASE_HEADERS)
+    other = sqlite3.connect(path, isolation_level=None)
+    try:
+        other.execute('BEGIN IMMEDIATE')
+        assert store.write_rows([ROW]) == 0
+        assert len(store.pending) == 1
+        other.execute('COMMIT')
+        store.flush()
+        assert store.pending == [] and ('1', 'a') in store.keys
+        assert store.recent_matches('1')[0]['pvp_stats_kda'] == 5
+    finally:
+        other.close()
+        store.close()
@@ -0,0 +1,24 @@
+import time
+import pytest
+from token_manager import parse_expiry
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    # Local time must not leak into the result
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-01-01T00:00:00.1234567Z', 1704067200.123456),
+    ('2024-01-01T00:00:00Z', 1704067200),
+    ('2024-01-01T01:00:00.9999999+01:00', 1704067200.999999),
+    ('2023-12-31T19:00:00.1234567-05:00', 1704067200.123456),
+    ('2024-01-01T00:00:00.5', 1704067200.5),
+])
+def test_parse_expiry(new_york, value, expected):
+    assert parse_expiry(value) == pytest.approx(expected)
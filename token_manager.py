@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import time
+import asyncio
+from datetime import datetime
+from aiohttp import ClientResponseError
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+CLIENT_ID = os.getenv("CLIENT_ID")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+REDIRECT_URI = os.getenv("REDIRECT_URI", "http://localhost")
+SCOPES = os.getenv("SCOPES", "XboxLive.signin XboxLive.offline_access")
+TOKEN_FILE = 'tokens.json'
+
+OAUTH_URL = "https://login.live.com/oauth20_token.srf"
+USER_TOKEN_URL = "https://user.auth.xboxlive.com/user/authenticate"
+XSTS_TOKEN_URL = "https://xsts.auth.xboxlive.com/xsts/authorize"
+SPARTAN_TOKEN_URL = "https://settings.svc.halowaypoint.com/spartan-token"
+CLEARANCE_URL = "https://settings.svc.halowaypoint.com/oban/flight-configurations/titles/hi/audiences/RETAIL/players/xuid({xuid})/active"
+HALO_USER_AGENT = "HaloInfinite/6.10022.0.0 (Windows;10;;Professional, x64)"
+
+# Tokens are refreshed in the background once they are this close to expiring
+TOKEN_REFRESH_MARGIN = 10 * 60
+# Below this, callers wait for the refresh instead of using the old token
+TOKEN_MIN_VALIDITY = 30
+# A failed background refresh isn't tried again for this long while the old token still works
+TOKEN_RETRY_SECONDS = 30
+
+# An ISO 8601 time split into everything before the fraction, the fraction and the UTC offset
+EXPIRY_PATTERN = re.compile(r'^(.*?)(\.\d+)?([Zz]|[+-]\d\d:?\d\d)?$')
+
+# Each tier is derived from the one before it, with the key its expiry is saved under
+TOKEN_TIERS = [
+    ('access_token', 'expires_at'),
+    ('user_token', 'user_token_expires_at'),
+    ('xsts_token', 'xsts_token_expires_at'),
+    ('spartan_token', 'spartan_token_expires_at')
+]
+
+
+def parse_expiry(value):
+    """Epoch seconds for an ISO 8601 expiry such as 2024-01-01T00:00:00.1234567Z"""
+    whole, fraction, offset = EXPIRY_PATTERN.match(value.strip()).groups()
+    # Xbox sends 7 fractional digits, fromisoformat takes at most 6; times without an offset are UTC
+    fraction = fraction[:7] if fraction else ''
+    offset = '+00:00' if offset in (None, 'Z', 'z') else offset
+    return datetime.fromisoformat(f"{whole}{fraction}{offset}").timestamp()
+
+
+class TokenManager:
+    """Keeps the spartan and clearance tokens valid for the whole run.
+
+    Every tier (OAuth access token, Xbox user token, XSTS token, spartan token) is
+    saved with its expiry, and a refresh only re-requests the tiers that have
+    expired plus everything above them. Concurrent callers share a single refresh.
+    """
+
+    def __init__(self, session, token_file=TOKEN_FILE, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.session = session
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self.tokens = self._load()
+        self.refresh_task = None
+        self.retry_at = 0
+        self.refreshes = {token_name: 0 for token_name, _ in TOKEN_TIERS}
+
+    def _load(self):
+        if os.path.exists(self.token_file):
+            with open(self.token_file, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _save(self):
+        temp_file = f"{self.token_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(self.tokens, f, indent=4)
+        os.replace(temp_file, self.token_file)
+
+    def _remaining(self, token_name, expiry_key):
+        if not self.tokens.get(token_name):
+            return 0
+        # Tokens saved before expiries were tracked are treated as expired
+        return self.tokens.get(expiry_key, 0) - time.time()
+
+    async def get_tokens(self, rejected_token=None):
+        """Return (spartan_token, clearance_token), refreshing first if needed.
+
+        rejected_token is a spartan token the API refused; it is replaced even if
+        it hasn't expired, unless another caller already replaced it.
+        """
+        force = rejected_token is not None and rejected_token == self.tokens.get('spartan_token')
+        remaining = self._remaining('spartan_token', 'spartan_token_expires_at')
+        if not self.tokens.get('clearance_token'):
+            remaining = 0
+        must_wait = force or remaining < TOKEN_MIN_VALIDITY
+        if must_wait or (remaining < self.refresh_margin and time.time() >= self.retry_at):
+            if self.refresh_task is None or self.refresh_task.done():
+                self.refresh_task = asyncio.ensure_future(self._refresh(force))
+                # A background refresh that fails is reported by _refresh, not left unretrieved
+                self.refresh_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            if must_wait:
+                await asyncio.shield(self.refresh_task)
+        return self.tokens['spartan_token'], self.tokens['clearance_token']
+
+    async def _refresh(self, force):
+        try:
+            await self._refresh_tiers(force)
+        except Exception as e:
+            print(f"Token refresh failed: {e}")
+            self.retry_at = time.time() + TOKEN_RETRY_SECONDS
+            raise
+
+    async def _refresh_tiers(self, force):
+        # Worker processes share the token file, so another one may have refreshed already
+        saved = self._load()
+        if saved.get('spartan_token') and saved.get('spartan_token') != self.tokens.get('spartan_token'):
+            self.tokens = saved
+            force = False
+        # Once a tier is refreshed, every tier above it is refreshed too
+        renewed = False
+        for token_name, expiry_key in TOKEN_TIERS:
+            if force and token_name == 'spartan_token':
+                renewed = True
+            if renewed or self._remaining(token_name, expiry_key) < self.refresh_margin:
+                await getattr(self, f"_request_{token_name}")()
+                self.refreshes[token_name] += 1
+                renewed = True
+        if renewed or not self.tokens.get('clearance_token'):
+            await self._request_clearance_token()
+        self._save()
+
+    async def _post_json(self, url, **kwargs):
+        async with self.session.post(url, **kwargs) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def _request_access_token(self):
+        if not self.tokens.get('refresh_token'):
+            raise RuntimeError("No refresh token saved; run auth.py to sign in")
+        data = await self._post_json(OAUTH_URL, data={
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "refresh_token": self.tokens['refresh_token'],
+            "grant_type": "refresh_token",
+            "redirect_uri": REDIRECT_URI,
+            "scope": SCOPES,
+        })
+        self.tokens['access_token'] = data['access_token']
+        self.tokens['refresh_token'] = data.get('refresh_token', self.tokens['refresh_token'])
+        self.tokens['expires_at'] = time.time() + data.get('expires_in', 3600)
+
+    async def _request_user_token(self):
+        data = await self._post_json(
+            USER_TOKEN_URL,
+            headers={"x-xbl-contract-version": "1"},
+            json={
+                "Properties": {
+                    "AuthMethod": "RPS",
+                    "SiteName": "user.auth.xboxlive.com",
+                    "RpsTicket": f"d={self.tokens['access_token']}"
+                },
+                "RelyingParty": "http://auth.xboxlive.com",
+                "TokenType": "JWT"
+            }
+        )
+        self.tokens['user_token'] = data['Token']
+        self.tokens['user_token_expires_at'] = parse_expiry(data['NotAfter'])
+        xui_data = data.get('DisplayClaims', {}).get('xui', [{}])[0]
+        xuid = xui_data.get('xid') or xui_data.get('id')
+        if xuid:
+            self.tokens['xuid'] = xuid
+
+    async def _request_xsts_token(self):
+        data = await self._post_json(
+            XSTS_TOKEN_URL,
+            headers={"x-xbl-contract-version": "1"},
+            json={
+                "Properties": {
+                    "SandboxId": "RETAIL",
+                    "UserTokens": [self.tokens['user_token']]
+                },
+                "RelyingParty": "https://prod.xsts.halowaypoint.com/",
+                "TokenType": "JWT"
+            }
+        )
+        self.tokens['xsts_token'] = data['Token']
+        self.tokens['xsts_token_expires_at'] = parse_expiry(data['NotAfter'])
+
+    async def _request_spartan_token(self):
+        data = await self._post_json(
+            SPARTAN_TOKEN_URL,
+            headers={"User-Agent": HALO_USER_AGENT, "Accept": "application/json"},
+            json={
+                "Audience": "urn:343:s3:services",
+                "MinVersion": "4",
+                "Proof": [{"Token": self.tokens['xsts_token'], "TokenType": "Xbox_XSTSv3"}]
+            }
+        )
+        self.tokens['spartan_token'] = data['SpartanToken']
+        self.tokens['spartan_token_expires_at'] = parse_expiry(data['ExpiresUtc']['ISO8601Date'])
+
+    async def _request_clearance_token(self):
+        if not self.tokens.get('xuid'):
+            raise RuntimeError("No XUID saved; run auth.py to sign in")
+        async with self.session.get(
+            CLEARANCE_URL.format(xuid=self.tokens['xuid']),
+            headers={
+                "User-Agent": HALO_USER_AGENT,
+                "Accept": "application/json",
+                "x-343-authorization-spartan": self.tokens['spartan_token']
+            },
+            params={"sandbox": "UNUSED", "build": "210921.22.01.10.1706-0"}
+        ) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        self.tokens['clearance_token'] = data['FlightConfigurationId']
+
+    def stats(self):
+        return dict(self.refreshes, spartan_expires_in=int(self._remaining('spartan_token', 'spartan_token_expires_at')))
+
+
+class _TokenRefreshingService:
+    def __init__(self, service, client):
+        self.service = service
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.service, name)
+        if not callable(method):
+            return method
+
+        async def authenticated(*args, **kwargs):
+            tokens = await self.client.ensure_tokens()
+            try:
+                return await method(*args, **kwargs)
+            except ClientResponseError as e:
+                if e.status != 401:
+                    raise
+            # A 401 means the token was revoked or expired early, so refresh and try once more
+            await self.client.ensure_tokens(rejected_token=tokens[0])
+            return await method(*args, **kwargs)
+        return authenticated
+
+
+class TokenRefreshingClient:
+    """Wraps HaloInfiniteClient so each call uses tokens from the TokenManager"""
+
+    def __init__(self, client, token_manager):
+        self.client = client
+        self.token_manager = token_manager
+        self.current_tokens = None
+        self.services = {}
+
+    async def ensure_tokens(self, rejected_token=None):
+        tokens = await self.token_manager.get_tokens(rejected_token)
+        if tokens != self.current_tokens:
+            self.client.set_tokens(*tokens)
+            self.current_tokens = tokens
+        return tokens
+
+    def __getattr__(self, name):
+        if name not in self.services:
+            service = getattr(self.client, name)
+            if callable(service):
+                return service
+            self.services[name] = _TokenRefreshingService(service, self)
+        return self.services[name]